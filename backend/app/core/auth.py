@@ -3,6 +3,9 @@ from fastapi.security import OAuth2PasswordBearer
 from jose import jwt, JWTError
 from pydantic import BaseModel
 from app.core.config import settings
+import logging
+
+logger = logging.getLogger(__name__)
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
@@ -17,13 +20,12 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        print(f"Validating token: {token}")
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
         username: str = payload.get("sub")
         if username is None:
             raise credentials_exception
-        print(f"Token validated for user: {username}")
+        logger.debug("token validated user=%s", username)
         return username
     except JWTError:
-        print("JWT validation failed")
+        logger.info("JWT validation failed")
         raise credentials_exception 
\ No newline at end of file
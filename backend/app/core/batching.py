@@ -0,0 +1,168 @@
+from typing import Iterable, Iterator, List, Optional
+import logging
+import time
+import numpy as np
+import pandas as pd
+from clickhouse_driver.errors import ErrorCodes, ServerException
+from pandas.api import types as ptypes
+from .config import settings
+from .metrics import count, timed
+
+logger = logging.getLogger(__name__)
+
+# With use_numpy, clickhouse_driver warns on every insert that types such as
+# Date32 and Decimal fall back to its generic columns, which is expected here
+logging.getLogger("clickhouse_driver.columns.service").setLevel(logging.ERROR)
+
+# Rows inspected when estimating the encoded size of a row
+_ROW_SAMPLE = 1000
+
+
+def row_bytes(df: pd.DataFrame) -> float:
+    """
+    Estimate the encoded size of one row: fixed-width columns by their dtype,
+    string-like columns by their mean length plus a length prefix
+    """
+    sample = df.head(_ROW_SAMPLE)
+    if sample.empty:
+        return 0.0
+    size = 0.0
+    for col in sample.columns:
+        values = sample[col]
+        if ptypes.is_numeric_dtype(values) or ptypes.is_datetime64_any_dtype(values):
+            size += values.dtype.itemsize
+        else:
+            size += values.dropna().astype(str).str.len().mean() + 1 if values.notna().any() else 1
+    return size
+
+
+class InsertScheduler:
+    """
+    Size insert blocks by bytes and pace them by how ClickHouse keeps up.
+
+    Blocks hold about INSERT_BLOCK_BYTES, so narrow tables get many rows per
+    insert and wide tables few, between INSERT_MIN_BLOCK_ROWS and
+    INSERT_BATCH_SIZE rows. Parsers are pulled lazily by the inserting
+    thread, so pausing here pauses parsing: an insert slower than
+    INSERT_SLOW_SECONDS is followed by a pause as long as the insert, and a
+    "too many parts" rejection is retried with exponential backoff.
+    With `async_insert` ClickHouse buffers and merges small inserts itself;
+    each insert still waits for the flush so errors are reported. Blocks
+    sent with an insert_deduplication_token are always inserted synchronously.
+    """
+
+    def __init__(self, async_insert: Optional[bool] = None, block_bytes: Optional[int] = None):
+        self.async_insert = settings.INSERT_ASYNC if async_insert is None else async_insert
+        self.block_bytes = block_bytes or settings.INSERT_BLOCK_BYTES
+        self.blocks: List[dict] = []
+        self.retries = 0
+        self.paused = 0.0
+
+    def block_rows(self, df: pd.DataFrame) -> int:
+        """
+        Rows per insert block for frames shaped like `df`
+        """
+        size = row_bytes(df)
+        rows = int(self.block_bytes / size) if size else settings.INSERT_BATCH_SIZE
+        return max(settings.INSERT_MIN_BLOCK_ROWS, min(rows, settings.INSERT_BATCH_SIZE))
+
+    def coalesce(self, chunks: Iterable[pd.DataFrame]) -> Iterator[pd.DataFrame]:
+        """
+        Regroup parser chunks into frames of exactly one block each, so small
+        chunks do not each become a small part and large ones leave no
+        undersized remainder
+        """
+        pending: List[pd.DataFrame] = []
+        rows = 0
+        target = None
+        for chunk in chunks:
+            if target is None:
+                target = self.block_rows(chunk)
+            pending.append(chunk)
+            rows += len(chunk)
+            if rows < target:
+                continue
+            buffer = pending[0] if len(pending) == 1 else pd.concat(pending, ignore_index=True)
+            start = 0
+            while len(buffer) - start >= target:
+                yield buffer.iloc[start:start + target]
+                start += target
+            pending = [buffer.iloc[start:]] if start < len(buffer) else []
+            rows = len(buffer) - start
+        if pending:
+            yield pending[0] if len(pending) == 1 else pd.concat(pending, ignore_index=True)
+
+    def insert(self, client, query: str, data: list, rows: int, size: float, insert_settings: Optional[dict] = None):
+        """
+        Send one columnar block, retrying while ClickHouse rejects it for too many parts.
+
+        A block holding NumPy arrays is sent with `use_numpy`, its list
+        columns turned into object arrays, which the driver writes like lists.
+        """
+        insert_settings = dict(insert_settings or {})
+        if any(isinstance(column, np.ndarray) for column in data):
+            insert_settings.update(use_numpy=True)
+            data = [column if isinstance(column, np.ndarray) else np.array(column, dtype=object) for column in data]
+        if "insert_deduplication_token" in insert_settings:
+            # Async inserts ignore the token on non-replicated MergeTree tables,
+            # so a retried block would be inserted twice
+            insert_settings.update(async_insert=0)
+        elif self.async_insert:
+            insert_settings.update(async_insert=1, wait_for_async_insert=1)
+
+        delay = settings.INSERT_RETRY_SECONDS
+        retries = 0
+        while True:
+            started = time.perf_counter()
+            try:
+                with timed("insert"):
+                    client.execute(query, data, columnar=True, settings=insert_settings or None)
+                break
+            except ServerException as e:
+                if e.code != ErrorCodes.TOO_MANY_PARTS or retries >= settings.INSERT_MAX_RETRIES:
+                    raise
+                retries += 1
+                logger.warning("too many parts, retrying insert in %.1fs attempt=%s", delay, retries)
+                self._pause(delay)
+                delay *= 2
+        elapsed = time.perf_counter() - started
+
+        count("ingested", rows=rows)
+        self.retries += retries
+        block = {
+            "rows": rows,
+            "bytes": int(size),
+            "seconds": round(elapsed, 4),
+            "rows_per_second": round(rows / elapsed) if elapsed else None,
+            "mb_per_second": round(size / elapsed / 1e6, 2) if elapsed else None,
+            "retries": retries,
+        }
+        self.blocks.append(block)
+        logger.debug(
+            "insert block rows=%s bytes=%s seconds=%.3f rows_per_second=%s",
+            rows, block["bytes"], elapsed, block["rows_per_second"]
+        )
+        if elapsed > settings.INSERT_SLOW_SECONDS:
+            # Give merges time to catch up before the next block is parsed
+            self._pause(elapsed)
+
+    def _pause(self, seconds: float):
+        self.paused += seconds
+        time.sleep(seconds)
+
+    def report(self) -> dict:
+        """
+        Block count, overall throughput and per-block figures of the inserts so far
+        """
+        rows = sum(block["rows"] for block in self.blocks)
+        size = sum(block["bytes"] for block in self.blocks)
+        seconds = sum(block["seconds"] for block in self.blocks)
+        return {
+            "blocks": len(self.blocks),
+            "rows_per_second": round(rows / seconds) if seconds else None,
+            "mb_per_second": round(size / seconds / 1e6, 2) if seconds else None,
+            "retries": self.retries,
+            "paused_seconds": round(self.paused, 3),
+            "async_insert": self.async_insert,
+            "per_block": self.blocks,
+        }
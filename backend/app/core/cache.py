@@ -0,0 +1,85 @@
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, List, Optional
+import threading
+import time
+from .clickhouse import ClickHouseConnection, profile_key
+from .config import settings
+
+_MISSING = object()
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries also expire `ttl` seconds after being stored
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            expires, value = self._entries.get(key, (0.0, _MISSING))
+            if value is _MISSING or expires < time.monotonic():
+                self._entries.pop(key, None)
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, predicate: Optional[Callable[[Hashable], bool]] = None):
+        """
+        Drop every entry, or only those whose key matches `predicate`
+        """
+        with self._lock:
+            if predicate is None:
+                self._entries.clear()
+                return
+            for key in [key for key in self._entries if predicate(key)]:
+                del self._entries[key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+# Table lists and DESCRIBE results, keyed by (profile, database, kind, ...)
+metadata_cache = TTLCache(settings.METADATA_CACHE_SIZE, settings.METADATA_CACHE_TTL)
+
+def metadata_key(kind: str, *parts: str, conn: Optional[ClickHouseConnection] = None) -> tuple:
+    database = conn.database if conn else settings.CLICKHOUSE_DATABASE
+    return (profile_key(conn), database, kind, *parts)
+
+# Preview results, keyed by (profile, database, tables, normalized query)
+preview_cache = TTLCache(settings.PREVIEW_CACHE_SIZE, settings.PREVIEW_CACHE_TTL)
+
+def preview_key(tables: List[str], normalized_query: str, conn: Optional[ClickHouseConnection] = None) -> tuple:
+    database = conn.database if conn else settings.CLICKHOUSE_DATABASE
+    return (profile_key(conn), database, tuple(table.strip() for table in tables), normalized_query)
+
+def invalidate_table(table_name: str):
+    """
+    Forget cached metadata and previews after a table has been created or written to
+    """
+    metadata_cache.invalidate(
+        lambda key: key[2] == "tables" or (key[2] == "schema" and key[3] == table_name)
+    )
+    preview_cache.invalidate(
+        lambda key: any(table.rpartition(".")[2] == table_name for table in key[2])
+    )
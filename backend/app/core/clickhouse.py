@@ -1,9 +1,16 @@
 from clickhouse_driver import Client
-from fastapi import HTTPException
-from typing import Optional
+from fastapi import HTTPException, Request
+from typing import Dict, List, Optional, Tuple
 from pydantic import BaseModel
+from contextlib import contextmanager
+import hashlib
+import logging
+import threading
+import time
 from .config import settings
 
+logger = logging.getLogger(__name__)
+
 class ClickHouseConnection(BaseModel):
     host: str
     port: int
@@ -11,31 +18,168 @@ class ClickHouseConnection(BaseModel):
     user: str
     password: str
 
-def get_clickhouse_client(conn: Optional[ClickHouseConnection] = None):
-    try:
-        if conn:
-            print(f"Connecting to ClickHouse with custom connection: {conn.host}:{conn.port}")
-            client = Client(
-                host=conn.host,
-                port=conn.port,
-                database=conn.database,
-                user=conn.user,
-                password=conn.password
-            )
-        else:
-            print(f"Connecting to ClickHouse with settings: {settings.CLICKHOUSE_HOST}:{settings.CLICKHOUSE_PORT}")
-            client = Client(
-                host=settings.CLICKHOUSE_HOST,
-                port=settings.CLICKHOUSE_PORT,
-                database=settings.CLICKHOUSE_DATABASE,
-                user=settings.CLICKHOUSE_USER,
-                password=settings.CLICKHOUSE_PASSWORD,
-                secure=False  # Disable SSL for local development
-            )
-        # Test the connection
-        client.execute("SELECT 1")
-        print("ClickHouse connection successful")
+def create_client(conn: Optional[ClickHouseConnection] = None) -> Client:
+    """
+    Build a client for a custom connection or the configured default; the socket opens lazily
+    """
+    if conn:
+        return Client(
+            host=conn.host,
+            port=conn.port,
+            database=conn.database,
+            user=conn.user,
+            password=conn.password,
+            compression=settings.CLICKHOUSE_COMPRESSION or False
+        )
+    return Client(
+        host=settings.CLICKHOUSE_HOST,
+        port=settings.CLICKHOUSE_PORT,
+        database=settings.CLICKHOUSE_DATABASE,
+        user=settings.CLICKHOUSE_USER,
+        password=settings.CLICKHOUSE_PASSWORD,
+        compression=settings.CLICKHOUSE_COMPRESSION or False,
+        secure=False  # Disable SSL for local development
+    )
+
+def profile_key(conn: Optional[ClickHouseConnection] = None) -> Tuple:
+    """
+    Identify a connection profile without keeping the plain-text password in the key
+    """
+    if conn is None:
+        conn = ClickHouseConnection(
+            host=settings.CLICKHOUSE_HOST,
+            port=settings.CLICKHOUSE_PORT,
+            database=settings.CLICKHOUSE_DATABASE,
+            user=settings.CLICKHOUSE_USER,
+            password=settings.CLICKHOUSE_PASSWORD
+        )
+    password_hash = hashlib.sha256(conn.password.encode()).hexdigest()[:16]
+    return (conn.host, conn.port, conn.database, conn.user, password_hash)
+
+class _Profile:
+    def __init__(self, max_size: int):
+        self.slots = threading.BoundedSemaphore(max_size)
+        self.idle: List[Tuple[Client, float]] = []
+        self.in_use = 0
+
+class ClickHousePool:
+    """
+    Process-wide pool of ClickHouse clients, bounded per connection profile.
+
+    Idle clients are reused as-is; a `SELECT 1` probe is only run on checkout
+    when a client has been idle for longer than `stale_after` seconds.
+    """
+
+    def __init__(
+        self,
+        max_size: Optional[int] = None,
+        stale_after: Optional[float] = None,
+        acquire_timeout: Optional[float] = None
+    ):
+        self.max_size = max_size or settings.CLICKHOUSE_POOL_SIZE
+        self.stale_after = stale_after if stale_after is not None else settings.CLICKHOUSE_POOL_STALE_SECONDS
+        self.acquire_timeout = acquire_timeout if acquire_timeout is not None else settings.CLICKHOUSE_POOL_TIMEOUT
+        self._lock = threading.Lock()
+        self._profiles: Dict[Tuple, _Profile] = {}
+        self.metrics = {
+            "created": 0,
+            "reused": 0,
+            "health_checks": 0,
+            "discarded": 0,
+            "wait_timeouts": 0,
+        }
+
+    def _count(self, metric: str):
+        # Requests check clients in and out concurrently, so never lose an increment
+        with self._lock:
+            self.metrics[metric] += 1
+
+    def _profile(self, key: Tuple) -> _Profile:
+        with self._lock:
+            if key not in self._profiles:
+                self._profiles[key] = _Profile(self.max_size)
+            return self._profiles[key]
+
+    def _checkout(self, profile: _Profile, conn: Optional[ClickHouseConnection]) -> Client:
+        with self._lock:
+            client, last_used = profile.idle.pop() if profile.idle else (None, 0.0)
+            profile.in_use += 1
+
+        if client is not None and time.monotonic() - last_used > self.stale_after:
+            self._count("health_checks")
+            try:
+                client.execute("SELECT 1")
+            except Exception:
+                self._count("discarded")
+                client.disconnect()
+                client = None
+
+        if client is None:
+            self._count("created")
+            return create_client(conn)
+        self._count("reused")
         return client
-    except Exception as e:
-        print(f"ClickHouse connection error: {str(e)}")
-        raise HTTPException(status_code=400, detail=str(e)) 
\ No newline at end of file
+
+    def _checkin(self, profile: _Profile, client: Client, healthy: bool):
+        with self._lock:
+            profile.in_use -= 1
+            if healthy:
+                profile.idle.append((client, time.monotonic()))
+                return
+        # The client may be mid-query (e.g. an abandoned stream), so drop its socket
+        self._count("discarded")
+        client.disconnect()
+
+    @contextmanager
+    def connection(self, conn: Optional[ClickHouseConnection] = None):
+        """
+        Check a client out of the pool for the duration of the `with` block
+        """
+        profile = self._profile(profile_key(conn))
+        if not profile.slots.acquire(timeout=self.acquire_timeout):
+            self._count("wait_timeouts")
+            raise HTTPException(status_code=503, detail="ClickHouse connection pool exhausted")
+
+        healthy = False
+        try:
+            client = self._checkout(profile, conn)
+        except Exception:
+            with self._lock:
+                profile.in_use -= 1
+            profile.slots.release()
+            raise
+        try:
+            yield client
+            healthy = True
+        finally:
+            self._checkin(profile, client, healthy)
+            profile.slots.release()
+
+    def stats(self) -> dict:
+        with self._lock:
+            profiles = [
+                {
+                    "host": key[0],
+                    "port": key[1],
+                    "database": key[2],
+                    "user": key[3],
+                    "in_use": profile.in_use,
+                    "idle": len(profile.idle),
+                }
+                for key, profile in self._profiles.items()
+            ]
+            metrics = dict(self.metrics)
+        return {"max_size": self.max_size, "profiles": profiles, **metrics}
+
+    def close(self):
+        with self._lock:
+            for profile in self._profiles.values():
+                for client, _ in profile.idle:
+                    client.disconnect()
+                profile.idle.clear()
+
+def get_clickhouse_pool(request: Request) -> ClickHousePool:
+    """
+    Dependency returning the pool created by the application lifespan
+    """
+    return request.app.state.clickhouse_pool
@@ -0,0 +1,130 @@
+from typing import List, Optional
+import zlib
+import zstandard
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from .config import settings
+from .metrics import count
+
+try:
+    import brotli
+except ImportError:  # br is only offered when the brotli package is installed
+    brotli = None
+
+# Bodies that are already compressed gain nothing from another pass
+_INCOMPRESSIBLE_TYPES = (
+    "application/zip", "application/gzip", "application/zstd",
+    "application/vnd.apache.parquet", "image/", "video/", "audio/",
+)
+
+# Brotli's default quality (11) is meant for static assets; at 4 it streams
+# at gzip-like speed with a better ratio
+_BROTLI_QUALITY = 4
+
+
+class _Encoder:
+    """
+    Streaming compressor whose output is flushed after every chunk, so each
+    streamed block reaches the client as soon as it is produced
+    """
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "gzip":
+            self._compressor = zlib.compressobj(wbits=31)
+        elif encoding == "zstd":
+            self._compressor = zstandard.ZstdCompressor().compressobj()
+        else:
+            self._compressor = brotli.Compressor(quality=_BROTLI_QUALITY)
+
+    def chunk(self, data: bytes) -> bytes:
+        if self.encoding == "gzip":
+            return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        if self.encoding == "zstd":
+            return self._compressor.compress(data) + self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self) -> bytes:
+        if self.encoding == "br":
+            return self._compressor.finish()
+        return self._compressor.flush()
+
+
+def available_encodings() -> List[str]:
+    encodings = [e.strip().lower() for e in settings.RESPONSE_COMPRESSION.split(",") if e.strip()]
+    return [e for e in encodings if e in ("gzip", "zstd") or (e == "br" and brotli is not None)]
+
+
+def negotiate(accept_encoding: str, offered: List[str]) -> Optional[str]:
+    """
+    Pick the first encoding in the server's preference order that the client accepts
+    """
+    accepted = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            accepted[name.strip().lower()] = quality
+    for encoding in offered:
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+
+class CompressionMiddleware:
+    """
+    Compress responses with gzip, zstd or br as negotiated through Accept-Encoding.
+
+    Streaming bodies are compressed chunk by chunk, so NDJSON progress events
+    and streamed downloads keep arriving incrementally.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        offered = available_encodings() if scope["type"] == "http" else []
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding", ""), offered) if offered else None
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        encoder: Optional[_Encoder] = None
+
+        async def send_compressed(message: Message):
+            nonlocal encoder
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(raw=message["headers"])
+                length = headers.get("content-length")
+                content_type = headers.get("content-type", "")
+                if (
+                    "content-encoding" not in headers
+                    and not content_type.startswith(_INCOMPRESSIBLE_TYPES)
+                    and (length is None or int(length) >= settings.RESPONSE_COMPRESSION_MIN_SIZE)
+                ):
+                    encoder = _Encoder(encoding)
+                    del headers["content-length"]
+                    headers["content-encoding"] = encoding
+                    headers.add_vary_header("Accept-Encoding")
+                await send(message)
+                return
+
+            if message["type"] != "http.response.body" or encoder is None:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more = message.get("more_body", False)
+            data = encoder.chunk(body) if body else b""
+            if not more:
+                data += encoder.finish()
+            count("response_uncompressed", size=len(body))
+            count("response_compressed", size=len(data))
+            await send({"type": "http.response.body", "body": data, "more_body": more})
+
+        await self.app(scope, receive, send_compressed)
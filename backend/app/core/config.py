@@ -9,6 +9,57 @@ class Settings(BaseSettings):
     CLICKHOUSE_DATABASE: str = "default"
     CLICKHOUSE_USER: str = "default"
     CLICKHOUSE_PASSWORD: str = ""  # Empty password for default user
+    CLICKHOUSE_HTTP_PORT: int = 8123  # HTTP interface used for native-format exports
+    CLICKHOUSE_HTTP_SECURE: bool = False
+    CLICKHOUSE_POOL_SIZE: int = 10  # Max connections per connection profile
+    CLICKHOUSE_POOL_STALE_SECONDS: float = 30.0  # Idle time before a checkout runs a health check
+    CLICKHOUSE_POOL_TIMEOUT: float = 10.0  # Seconds to wait for a free connection
+    CLICKHOUSE_EXECUTOR_THREADS: int = 32  # Worker threads running blocking driver calls
+    CLICKHOUSE_COMPRESSION: Optional[str] = None  # Native protocol block compression: lz4, lz4hc or zstd
+
+    # Ingestion settings
+    INSERT_BATCH_SIZE: int = 1048576  # Max rows per columnar INSERT block
+    INSERT_MIN_BLOCK_ROWS: int = 1000  # Min rows per block, however wide the table
+    INSERT_BLOCK_BYTES: int = 16 * 1024 * 1024  # Target encoded size of an INSERT block
+    INSERT_SLOW_SECONDS: float = 5.0  # Slower inserts pause parsing for as long as they took
+    INSERT_MAX_RETRIES: int = 5  # Retries of an insert rejected for too many parts
+    INSERT_RETRY_SECONDS: float = 1.0  # First retry delay, doubled on each retry
+    INSERT_ASYNC: bool = False  # Default for async_insert with wait_for_async_insert
+    INGEST_CHUNK_SIZE: int = 100000  # Rows parsed per chunk when streaming uploads
+    SCHEMA_SAMPLE_SIZE: int = 10000  # Rows inspected when inferring column types
+    LOW_CARDINALITY_MAX_DISTINCT: int = 1000  # String columns at or below this become LowCardinality
+    LOW_CARDINALITY_MAX_RATIO: float = 0.5  # ...when distinct values are also at most this share of rows
+    INGEST_QUEUE_BLOCKS: int = 8  # Parsed blocks buffered between batch parsers and the inserter
+    LOCAL_INGEST_ROOT: Optional[str] = None  # Directory served by /ingest/local; unset disables it
+    DEDUP_WINDOW: int = 10000  # Recent insert blocks per table remembered for deduplication
+
+    # Metadata cache settings
+    METADATA_CACHE_TTL: float = 60.0  # Seconds a cached table list or schema stays valid
+    METADATA_CACHE_SIZE: int = 1024  # Max cached entries before least recently used are evicted
+    PREVIEW_CACHE_TTL: float = 300.0  # Seconds a cached preview result stays valid
+    PREVIEW_CACHE_SIZE: int = 256  # Max cached previews before least recently used are evicted
+
+    # Worker processes for parallel exports and batch ingests (0 = one per CPU)
+    PARALLEL_WORKERS: int = 0
+
+    # Export settings
+    EXPORT_BLOCK_SIZE: int = 65536  # max_block_size for streamed SELECTs
+    EXPORT_QUEUE_BLOCKS: int = 4  # Blocks buffered between the query thread and the response
+    EXPORT_MAX_SHARDS: int = 64  # Upper bound on slices per parallel export
+    EXPORT_TEMP_DIR: Optional[str] = None  # Where parallel export slices are spooled
+
+    # API response compression, negotiated per request through Accept-Encoding
+    RESPONSE_COMPRESSION: str = "zstd,gzip,br"  # Offered encodings in order of preference; empty disables
+    RESPONSE_COMPRESSION_MIN_SIZE: int = 1024  # Smaller fixed-size responses are sent as-is
+    
+    # Background job settings
+    JOBS_DIR: str = "jobs"  # SQLite job state, spooled uploads and export results
+    JOB_WORKERS: int = 2  # Jobs run concurrently
+
+    # Incremental sync settings
+    SYNC_DIR: str = "sync"  # Per-consumer watermarks, manifests and chunk files
+    SYNC_CHUNK_ROWS: int = 1000000  # Max rows per sync chunk file
+    SYNC_SETTLE_SECONDS: int = 5  # Rows of a date/time watermark column this recent wait for the next sync
     
     # JWT settings
     SECRET_KEY: str = "your-secret-key-here"
@@ -18,6 +69,7 @@ class Settings(BaseSettings):
     # Application settings
     API_V1_STR: str = "/api/v1"
     PROJECT_NAME: str = "Data Ingestion Tool"
+    LOG_LEVEL: str = "INFO"
     
     class Config:
         env_file = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), ".env")
@@ -0,0 +1,80 @@
+from typing import BinaryIO, Optional
+import hashlib
+import pandas as pd
+from .config import settings
+
+# Files already ingested, one row per (table, file digest)
+LEDGER_TABLE = "_ingest_ledger"
+
+
+def file_digest(source: BinaryIO, size: int = 1 << 20) -> str:
+    """
+    SHA-256 of a whole file, read in chunks and rewound afterwards
+    """
+    digest = hashlib.sha256()
+    source.seek(0)
+    for chunk in iter(lambda: source.read(size), b""):
+        digest.update(chunk)
+    source.seek(0)
+    return digest.hexdigest()
+
+
+def block_digest(block: pd.DataFrame) -> str:
+    """
+    Content hash of a block, computed from pandas' vectorized per-row hashes
+    """
+    hashes = pd.util.hash_pandas_object(block, index=False).values
+    return hashlib.sha256(hashes.tobytes()).hexdigest()[:32]
+
+
+def block_token(file_token: str, offset: int, block: pd.DataFrame) -> str:
+    """
+    insert_deduplication_token for the block starting at row `offset` of a file
+    """
+    return f"{file_token}:{offset}:{block_digest(block)}"
+
+
+def ensure_ledger(client):
+    client.execute(f"""
+        CREATE TABLE IF NOT EXISTS `{LEDGER_TABLE}` (
+            `table_name` String,
+            `file_hash` String,
+            `filename` String,
+            `rows` UInt64,
+            `ingested_at` DateTime DEFAULT now()
+        ) ENGINE = ReplacingMergeTree(ingested_at)
+        ORDER BY (table_name, file_hash)
+    """)
+
+
+def find_ingest(client, table_name: str, file_hash: str) -> Optional[dict]:
+    """
+    Previous ingest of the same file into `table_name`, if any
+    """
+    ensure_ledger(client)
+    rows = client.execute(
+        f"SELECT filename, rows, ingested_at FROM `{LEDGER_TABLE}` FINAL "
+        "WHERE table_name = %(table)s AND file_hash = %(hash)s LIMIT 1",
+        {"table": table_name, "hash": file_hash}
+    )
+    if not rows:
+        return None
+    filename, count, ingested_at = rows[0]
+    return {"filename": filename, "rows": count, "ingested_at": ingested_at}
+
+
+def record_ingest(client, table_name: str, file_hash: str, filename: str, rows: int):
+    client.execute(
+        f"INSERT INTO `{LEDGER_TABLE}` (table_name, file_hash, filename, rows) VALUES",
+        [(table_name, file_hash, filename, rows)]
+    )
+
+
+def enable_block_dedup(client, table_name: str):
+    """
+    Turn on insert deduplication for an existing non-replicated MergeTree table
+    """
+    client.execute(
+        f"ALTER TABLE `{table_name}` MODIFY SETTING "
+        f"non_replicated_deduplication_window = {settings.DEDUP_WINDOW}"
+    )
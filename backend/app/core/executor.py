@@ -0,0 +1,170 @@
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from functools import partial
+from itertools import islice
+from typing import Any, AsyncIterator, Callable, Iterator, Optional
+import asyncio
+import threading
+from .clickhouse import ClickHouseConnection, ClickHousePool
+from .config import settings
+from .metrics import ACTIVE_STREAMS, count, timed
+
+# Bounded pool of threads running the synchronous clickhouse_driver calls
+_executor = ThreadPoolExecutor(
+    max_workers=settings.CLICKHOUSE_EXECUTOR_THREADS,
+    thread_name_prefix="clickhouse"
+)
+
+class StreamClosed(Exception):
+    """
+    Raised in the producer thread when the consumer of a stream has gone away
+    """
+
+async def run_sync(func: Callable, *args, **kwargs) -> Any:
+    """
+    Run a blocking function on the ClickHouse thread pool without stalling the event loop
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, partial(func, *args, **kwargs))
+
+async def run_query(
+    pool: ClickHousePool,
+    query: str,
+    params: Any = None,
+    conn: Optional[ClickHouseConnection] = None,
+    **kwargs
+) -> Any:
+    """
+    Check out a pooled client and run `client.execute` on the thread pool
+    """
+    def execute():
+        with pool.connection(conn) as client, timed("query"):
+            return client.execute(query, params, **kwargs)
+    return await run_sync(execute)
+
+def progress_of(client) -> dict:
+    """
+    Snapshot the progress packets ClickHouse has sent for the client's current query
+    """
+    info = client.last_query.progress if client.last_query else None
+    return {
+        "rows_read": info.rows if info else 0,
+        "bytes_read": info.bytes if info else 0,
+        "total_rows_approx": info.total_rows if info else 0,
+    }
+
+def iter_columns(client, query: str, params: Any = None, settings: Optional[dict] = None) -> Iterator[list]:
+    """
+    Like `client.execute_iter(query, with_column_types=True)`, but yield each
+    result block as the list of columns the driver decoded instead of
+    transposing it into rows. The first item is the list of `(name, type)` pairs.
+    """
+    with client.disconnect_on_error(query, settings):
+        if params is not None:
+            query = client.substitute_params(query, params, client.connection.context)
+        client.connection.send_query(query)
+        client.connection.send_external_tables(None)
+    columns_with_types = None
+    for packet in client.packet_generator():
+        block = getattr(packet, "block", None)
+        if block is None:
+            continue
+        if columns_with_types is None:
+            # The first block is the header, sent even when there are no rows
+            columns_with_types = block.columns_with_types
+            yield columns_with_types
+        if block.num_rows:
+            yield block.get_columns()
+
+async def iter_blocks(
+    pool: ClickHousePool,
+    query: str,
+    params: Any = None,
+    block_size: Optional[int] = None,
+    conn: Optional[ClickHouseConnection] = None,
+    with_column_types: bool = False,
+    progress: Optional[dict] = None,
+    columnar: bool = False
+) -> AsyncIterator[list]:
+    """
+    Stream a SELECT as lists of rows, one per block of at most `block_size` rows.
+
+    The query runs with `execute_iter` on a worker thread that hands blocks to
+    the event loop through a bounded queue, so a slow consumer applies
+    backpressure to ClickHouse instead of buffering the result in memory.
+    With `with_column_types` the first item yielded is the list of
+    `(name, type)` pairs, even when the result has no rows. If a `progress`
+    dict is given it is updated before each block is yielded with the
+    server's own progress counters (`rows_read`, `bytes_read` and
+    `total_rows_approx`), so no separate count query is needed.
+    """
+    block_size = block_size or settings.EXPORT_BLOCK_SIZE
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=settings.EXPORT_QUEUE_BLOCKS)
+    stop = threading.Event()
+
+    def put(item):
+        future = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+        while True:
+            try:
+                return future.result(timeout=0.5)
+            except FutureTimeout:
+                if stop.is_set():
+                    future.cancel()
+                    raise StreamClosed()
+
+    def produce():
+        try:
+            with pool.connection(conn) as client:
+                if columnar:
+                    # ClickHouse blocks already hold at most max_block_size rows
+                    columns = iter_columns(client, query, params, settings={"max_block_size": block_size})
+                    header = next(columns)
+                    if with_column_types:
+                        put(("block", header, progress_of(client)))
+                    read = partial(next, columns, None)
+                else:
+                    rows = client.execute_iter(
+                        query,
+                        params,
+                        with_column_types=with_column_types,
+                        settings={"max_block_size": block_size}
+                    )
+                    if with_column_types:
+                        put(("block", next(rows), progress_of(client)))
+
+                    def read():
+                        return list(islice(rows, block_size))
+                while True:
+                    with timed("query"):
+                        block = read()
+                    if not block:
+                        break
+                    count("queried", rows=len(block[0]) if columnar else len(block))
+                    put(("block", block, progress_of(client)))
+                    if stop.is_set():
+                        # Leaving the block with an error makes the pool drop the half-read connection
+                        raise StreamClosed()
+            put(("done", None, None))
+        except StreamClosed:
+            pass
+        except Exception as e:
+            try:
+                put(("error", e, None))
+            except StreamClosed:
+                pass
+
+    loop.run_in_executor(_executor, produce)
+    ACTIVE_STREAMS.inc()
+    try:
+        while True:
+            kind, payload, snapshot = await queue.get()
+            if kind == "error":
+                raise payload
+            if kind == "done":
+                break
+            if progress is not None:
+                progress.update(snapshot)
+            yield payload
+    finally:
+        ACTIVE_STREAMS.dec()
+        stop.set()
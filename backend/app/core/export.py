@@ -0,0 +1,276 @@
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, AsyncIterator, List, Optional, Sequence, Tuple
+from fastapi import HTTPException
+import csv
+import httpx
+import io
+import re
+import zlib
+import orjson
+import pyarrow as pa
+import pyarrow.parquet as pq
+import zstandard
+from .config import settings
+from .metrics import count, timed
+
+# File suffix and media type for each supported on-the-fly compression
+COMPRESSIONS = {
+    "gzip": (".gz", "application/gzip"),
+    "zstd": (".zst", "application/zstd"),
+}
+
+# Output formats ClickHouse can encode itself: (FORMAT name, media type, file suffix)
+NATIVE_FORMATS = {
+    "csv": ("CSVWithNames", "text/csv", ".csv"),
+    "tsv": ("TSVWithNames", "text/tab-separated-values", ".tsv"),
+    "parquet": ("Parquet", "application/vnd.apache.parquet", ".parquet"),
+    "arrow": ("ArrowStream", "application/vnd.apache.arrow.stream", ".arrow"),
+}
+
+# Arrow-based download formats encoded by the backend: (media type, file suffix)
+ARROW_FORMATS = {
+    "parquet": ("application/vnd.apache.parquet", ".parquet"),
+    "arrow": ("application/vnd.apache.arrow.stream", ".arrow"),
+    "feather": ("application/vnd.apache.arrow.file", ".feather"),
+}
+
+# NDJSON export framings: one object per row, or one line of row arrays per block
+NDJSON_FRAMINGS = ("row", "compact")
+
+_JSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+_ARROW_TYPES = {
+    "Int8": pa.int8(), "Int16": pa.int16(), "Int32": pa.int32(), "Int64": pa.int64(),
+    "UInt8": pa.uint8(), "UInt16": pa.uint16(), "UInt32": pa.uint32(), "UInt64": pa.uint64(),
+    "Float32": pa.float32(), "Float64": pa.float64(),
+    "Bool": pa.bool_(), "String": pa.string(),
+    "Date": pa.date32(), "Date32": pa.date32(), "DateTime": pa.timestamp("s"),
+}
+
+
+def encode_csv(rows: Sequence[Sequence], header: Optional[List[str]] = None) -> bytes:
+    """
+    Encode a block of rows (and an optional header line) as UTF-8 CSV
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header is not None:
+        writer.writerow(header)
+    writer.writerows(rows)
+    return buffer.getvalue().encode("utf-8")
+
+
+def _json_default(value: Any) -> Any:
+    # Only reached for types orjson has no native encoding for
+    if isinstance(value, Decimal):
+        return str(value)  # keeps the exact decimal digits
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()  # e.g. pandas Timestamp, a datetime subclass
+    if isinstance(value, bytes):
+        return value.decode("utf-8", errors="replace")
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    return str(value)
+
+
+def dumps(value: Any) -> bytes:
+    """
+    Serialize to JSON bytes with orjson, covering ClickHouse result types
+    (DateTime, Date, UUID, Decimal, IP addresses, FixedString, Map, Tuple)
+    """
+    return orjson.dumps(value, default=_json_default, option=_JSON_OPTIONS)
+
+
+def encode_ndjson(rows: Sequence[Sequence], framing: str = "row") -> bytes:
+    """
+    Encode a whole result block as NDJSON.
+
+    The "row" framing writes one `{"data": [...], "type": "row"}` line per
+    row. The "compact" framing serializes the block in a single call as one
+    `{"type": "rows", "rows": [[...], ...]}` line; column names and types are
+    sent once up front instead (see `encode_columns`).
+    """
+    if framing == "compact":
+        return dumps({"type": "rows", "rows": rows}) + b"\n"
+    return b"".join([b'{"data":' + dumps(row) + b',"type":"row"}\n' for row in rows])
+
+
+def encode_columns(columns: List[Tuple[str, str]]) -> bytes:
+    """
+    Header line of the compact framing, naming each column of the row arrays
+    """
+    return dumps({"type": "columns", "columns": [{"name": name, "type": col_type} for name, col_type in columns]}) + b"\n"
+
+
+def get_compressor(name: str):
+    """
+    Return a streaming compressor exposing `compress(bytes)` and `flush()`
+    """
+    if name == "gzip":
+        return zlib.compressobj(wbits=31)  # 31 selects the gzip container
+    if name == "zstd":
+        return zstandard.ZstdCompressor().compressobj()
+    raise ValueError(f"Unsupported compression: {name}")
+
+
+async def stream_csv(
+    blocks: AsyncIterator[list],
+    header: List[str],
+    compression: Optional[str] = None
+) -> AsyncIterator[bytes]:
+    """
+    Turn streamed result blocks into CSV bytes, compressing each block as it is produced
+    """
+    compressor = get_compressor(compression) if compression else None
+    chunk = encode_csv([], header)
+    async for block in blocks:
+        with timed("serialize"):
+            chunk += encode_csv(block)
+            if compressor:
+                chunk = compressor.compress(chunk)
+        count("exported", rows=len(block), size=len(chunk))
+        yield chunk
+        chunk = b""
+    if chunk:
+        yield compressor.compress(chunk) if compressor else chunk
+    if compressor:
+        yield compressor.flush()
+
+
+def arrow_type(clickhouse_type: str) -> pa.DataType:
+    """
+    Map a ClickHouse column type to an Arrow type; unknown types fall back to strings
+    """
+    inner = re.fullmatch(r"(?:Nullable|LowCardinality)\((.*)\)", clickhouse_type)
+    if inner:
+        return arrow_type(inner.group(1))
+    if clickhouse_type.startswith("DateTime64"):
+        precision = int(re.match(r"DateTime64\((\d+)", clickhouse_type).group(1))
+        return pa.timestamp("ms" if precision <= 3 else "us" if precision <= 6 else "ns")
+    if clickhouse_type.startswith("DateTime("):
+        return pa.timestamp("s")
+    decimal = re.fullmatch(r"Decimal\((\d+),\s*(\d+)\)", clickhouse_type)
+    if decimal:
+        precision, scale = int(decimal.group(1)), int(decimal.group(2))
+        # decimal128 holds at most 38 digits; Decimal256 columns go up to 76
+        return (pa.decimal128 if precision <= 38 else pa.decimal256)(precision, scale)
+    return _ARROW_TYPES.get(clickhouse_type, pa.string())
+
+
+def to_record_batch(columns: Sequence[Sequence], schema: pa.Schema) -> pa.RecordBatch:
+    """
+    Build one Arrow array per column of a columnar result block
+    """
+    arrays = []
+    for field, values in zip(schema, columns):
+        if pa.types.is_string(field.type):
+            values = [None if value is None else str(value) for value in values]
+        arrays.append(pa.array(values, type=field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+class ChunkSink(io.RawIOBase):
+    """
+    Write-only file that collects encoder output until it is drained
+    """
+
+    def __init__(self):
+        self.chunks: List[bytes] = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+async def stream_arrow(
+    blocks: AsyncIterator[list],
+    columns: List[Tuple[str, str]],
+    format: str
+) -> AsyncIterator[bytes]:
+    """
+    Encode streamed columnar result blocks (see `iter_blocks`) as Parquet row
+    groups or Arrow IPC record batches
+    """
+    schema = pa.schema([(name, arrow_type(col_type)) for name, col_type in columns])
+    sink = ChunkSink()
+    if format == "parquet":
+        writer = pq.ParquetWriter(sink, schema)
+    elif format == "feather":
+        writer = pa.ipc.new_file(sink, schema)
+    else:
+        writer = pa.ipc.new_stream(sink, schema)
+
+    async for block in blocks:
+        with timed("serialize"):
+            batch = to_record_batch(block, schema)
+            if format == "parquet":
+                writer.write_table(pa.Table.from_batches([batch]))
+            else:
+                writer.write_batch(batch)
+            chunk = sink.drain()
+        count("exported", rows=batch.num_rows, size=len(chunk))
+        yield chunk
+    writer.close()
+    yield sink.drain()
+
+
+async def open_native_stream(
+    query: str,
+    format: str,
+    compression: Optional[str] = None
+) -> AsyncIterator[bytes]:
+    """
+    Run `query` over the ClickHouse HTTP interface and relay its output untouched.
+
+    ClickHouse encodes the result in one of NATIVE_FORMATS (and compresses it
+    when `compression` is given), so the bytes never pass through Python
+    rows. Query errors are raised before the first byte is returned.
+    """
+    scheme = "https" if settings.CLICKHOUSE_HTTP_SECURE else "http"
+    url = f"{scheme}://{settings.CLICKHOUSE_HOST}:{settings.CLICKHOUSE_HTTP_PORT}/"
+    params = {"database": settings.CLICKHOUSE_DATABASE}
+    if compression:
+        params["enable_http_compression"] = "1"
+    headers = {
+        "X-ClickHouse-User": settings.CLICKHOUSE_USER,
+        "X-ClickHouse-Key": settings.CLICKHOUSE_PASSWORD,
+        # Relay the body as ClickHouse sent it instead of letting httpx negotiate
+        "Accept-Encoding": compression or "identity",
+    }
+    clickhouse_format = NATIVE_FORMATS[format][0]
+
+    client = httpx.AsyncClient(timeout=None)
+    request = client.build_request(
+        "POST", url, params=params, headers=headers,
+        content=f"{query} FORMAT {clickhouse_format}"
+    )
+    response = await client.send(request, stream=True)
+    if response.status_code != 200:
+        detail = (await response.aread()).decode("utf-8", errors="replace").strip()
+        await response.aclose()
+        await client.aclose()
+        raise HTTPException(status_code=400, detail=detail)
+
+    async def body():
+        try:
+            async for chunk in response.aiter_raw():
+                yield chunk
+        finally:
+            await response.aclose()
+            await client.aclose()
+
+    return body()
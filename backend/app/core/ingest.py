@@ -0,0 +1,351 @@
+from itertools import chain
+from typing import BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+import os
+import shutil
+import tarfile
+import tempfile
+import zipfile
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from .batching import InsertScheduler, row_bytes
+from .config import settings
+from .dedup import block_token, enable_block_dedup
+from .metrics import timed_iter
+from .schema import infer_schema, to_array, widen_type
+
+SUPPORTED_EXTENSIONS = ('.csv', '.xls', '.xlsx', '.parquet', '.arrow', '.feather')
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz')
+
+
+def spool_files(source: BinaryIO, filename: str, directory: str) -> List[Tuple[str, str]]:
+    """
+    Copy an upload into `directory`, expanding zip/tar archives into their data files.
+
+    Returns `(filename, path)` pairs for every supported file found.
+    """
+    files = []
+
+    def copy(stream: BinaryIO, name: str):
+        fd, path = tempfile.mkstemp(suffix=os.path.splitext(name)[1], dir=directory)
+        with os.fdopen(fd, 'wb') as out:
+            shutil.copyfileobj(stream, out)
+        files.append((name, path))
+
+    if filename.endswith('.zip'):
+        with zipfile.ZipFile(source) as archive:
+            for member in archive.infolist():
+                name = os.path.basename(member.filename)
+                if not member.is_dir() and name.endswith(SUPPORTED_EXTENSIONS):
+                    with archive.open(member) as stream:
+                        copy(stream, name)
+    elif filename.endswith(('.tar', '.tar.gz', '.tgz')):
+        with tarfile.open(fileobj=source, mode='r:*') as archive:
+            for member in archive:
+                name = os.path.basename(member.name)
+                if member.isfile() and name.endswith(SUPPORTED_EXTENSIONS):
+                    copy(archive.extractfile(member), name)
+    elif filename.endswith(SUPPORTED_EXTENSIONS):
+        copy(source, filename)
+    else:
+        raise ValueError(f"Unsupported file format: {filename}")
+    return files
+
+
+def read_chunks(
+    source: Union[str, BinaryIO],
+    filename: str,
+    chunk_size: Optional[int] = None,
+    columns: Optional[List[str]] = None,
+    **read_options
+) -> Iterator[pd.DataFrame]:
+    """
+    Parse a flat file incrementally, yielding DataFrames of at most `chunk_size` rows.
+
+    CSV files are parsed chunk by chunk straight from `source`, so memory use
+    stays bounded by the chunk size. Parquet, Arrow IPC and Feather files are
+    read as Arrow record batches and converted column-wise. Excel workbooks
+    cannot be read incrementally and are yielded as a single frame; one
+    with several sheets is rejected unless `sheet_name` picks one, as each
+    file fills a single table.
+
+    `columns` projects the file down to those columns in that order: CSV and
+    Excel skip the others while parsing (usecols) and Parquet/Arrow never
+    decode them. `read_options` are passed to the pandas CSV/Excel readers.
+    """
+    chunk_size = chunk_size or settings.INGEST_CHUNK_SIZE
+    if filename.endswith('.csv'):
+        chunks = pd.read_csv(source, chunksize=chunk_size, usecols=columns, **read_options)
+    elif filename.endswith(('.xls', '.xlsx')):
+        workbook = pd.ExcelFile(source)
+        sheet_name = read_options.pop("sheet_name", None)
+        if sheet_name is None:
+            if len(workbook.sheet_names) > 1:
+                raise ValueError(
+                    f"{filename} has {len(workbook.sheet_names)} sheets "
+                    f"({', '.join(workbook.sheet_names)}); choose one with the sheet option"
+                )
+            sheet_name = 0
+        chunks = iter([workbook.parse(sheet_name, usecols=columns, **read_options)])
+    elif filename.endswith(('.parquet', '.arrow', '.feather')):
+        chunks = (
+            batch.to_pandas()
+            for batch in read_record_batches(source, filename, chunk_size, columns)
+        )
+    else:
+        raise ValueError("Unsupported file format")
+    for chunk in timed_iter(chunks, "parse"):
+        # usecols keeps the file's column order; restore the requested one
+        if columns is not None and list(chunk.columns) != list(columns):
+            chunk = chunk[columns]
+        yield chunk
+
+
+def resolve_local_path(path: str) -> str:
+    """
+    Resolve `path` inside LOCAL_INGEST_ROOT, refusing anything that escapes it
+    """
+    if not settings.LOCAL_INGEST_ROOT:
+        raise PermissionError("Local file ingestion is disabled; set LOCAL_INGEST_ROOT")
+    root = os.path.realpath(settings.LOCAL_INGEST_ROOT)
+    full = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, full]) != root:
+        raise PermissionError(f"Path is outside the ingest root: {path}")
+    if not os.path.isfile(full):
+        raise FileNotFoundError(f"File not found: {path}")
+    return full
+
+
+def read_local_chunks(
+    path: str,
+    chunk_size: Optional[int] = None,
+    columns: Optional[List[str]] = None,
+    delimiter: str = ',',
+    encoding: Optional[str] = None
+) -> Iterator[pd.DataFrame]:
+    """
+    Parse a file on the backend host through a memory map instead of an upload.
+
+    CSV is parsed by pandas straight from the mapped file, and Parquet/Arrow
+    batches are read zero-copy from a pyarrow memory map, so the file is never
+    buffered by the HTTP layer or copied to a temp file. `delimiter` and
+    `encoding` apply to CSV; `columns` limits which columns are read.
+    """
+    if path.endswith('.csv'):
+        yield from read_chunks(
+            path, path, chunk_size, columns,
+            memory_map=True, sep=delimiter, encoding=encoding
+        )
+    elif path.endswith(('.parquet', '.arrow', '.feather')):
+        with pa.memory_map(path) as source:
+            yield from read_chunks(source, path, chunk_size, columns)
+    else:
+        yield from read_chunks(path, path, chunk_size, columns)
+
+
+def read_record_batches(
+    source: BinaryIO,
+    filename: str,
+    chunk_size: int,
+    columns: Optional[List[str]] = None
+) -> Iterator[pa.RecordBatch]:
+    """
+    Yield Arrow record batches of at most `chunk_size` rows from a Parquet or Arrow IPC file
+    """
+    if filename.endswith('.parquet'):
+        yield from pq.ParquetFile(source).iter_batches(batch_size=chunk_size, columns=columns)
+        return
+
+    # Feather v2 is the Arrow IPC file format; .arrow files may also hold an IPC stream
+    try:
+        reader = pa.ipc.open_file(source)
+        batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+    except pa.ArrowInvalid:
+        source.seek(0)
+        batches = pa.ipc.open_stream(source)
+    for batch in batches:
+        if columns is not None:
+            batch = batch.select(columns)
+        # Slicing a record batch is zero-copy
+        for offset in range(0, batch.num_rows, chunk_size):
+            yield batch.slice(offset, chunk_size)
+
+
+def create_table(client, table_name: str, column_types: Dict[str, str]):
+    columns = [f"`{name}` {col_type}" for name, col_type in column_types.items()]
+    create_table_query = f"""
+        CREATE TABLE IF NOT EXISTS `{table_name}` (
+            {', '.join(columns)}
+        ) ENGINE = MergeTree()
+        ORDER BY tuple()
+    """
+    client.execute(create_table_query)
+
+
+def alter_columns(client, table_name: str, changes: Dict[str, str]):
+    """
+    Widen column types in place; existing rows are converted by ClickHouse
+    """
+    modifications = ', '.join(f"MODIFY COLUMN `{name}` {col_type}" for name, col_type in changes.items())
+    client.execute(f"ALTER TABLE `{table_name}` {modifications}")
+
+
+def describe_table(client, table_name: str) -> Dict[str, str]:
+    """
+    Insertable columns of an existing table mapped to their types
+    """
+    rows = client.execute(f"DESCRIBE TABLE `{table_name}`")
+    return {row[0]: row[1] for row in rows if row[2] not in ("MATERIALIZED", "ALIAS")}
+
+
+def prepare_table(client, table_name: str, column_types: Dict[str, str]) -> Dict[str, str]:
+    """
+    Create the table from `column_types` unless it exists, and return the
+    types the table really has for those columns.
+
+    An existing table keeps its schema, so blocks must be converted (and
+    widened) against its types rather than the ones inferred for this file.
+    """
+    create_table(client, table_name, column_types)
+    existing = describe_table(client, table_name)
+    missing = [name for name in column_types if name not in existing]
+    if missing:
+        raise ValueError(f"Table {table_name} has no column {missing[0]}")
+    return {name: existing[name] for name in column_types}
+
+
+def convert_block(
+    block: pd.DataFrame,
+    column_types: Dict[str, str],
+    on_widen: Optional[Callable[[str, str], None]] = None
+) -> list:
+    """
+    Convert `block` column-wise for a columnar insert.
+
+    A column whose values do not fit its type is given a wider one (see
+    `widen_type`): `on_widen(name, wider)` is called first, e.g. to ALTER
+    the table, and `column_types` is updated in place, so no value is ever
+    coerced into a type default.
+
+    Columns are NumPy arrays (see `to_array`), which InsertScheduler sends
+    with `use_numpy`.
+    """
+    data = []
+    for i, (name, col_type) in enumerate(list(column_types.items())):
+        series = block.iloc[:, i]
+        try:
+            data.append(to_array(series, col_type))
+        except ValueError:
+            wider = widen_type(series, col_type)
+            if wider is None:
+                raise
+            if on_widen is not None:
+                on_widen(name, wider)
+            column_types[name] = wider
+            data.append(to_array(series, wider))
+    return data
+
+
+def peek_schema(
+    chunks: Iterable[pd.DataFrame],
+    sample_size: Optional[int] = None,
+    renames: Optional[Dict[str, str]] = None,
+    types: Optional[Dict[str, str]] = None
+) -> Tuple[Optional[Dict[str, str]], Iterator[pd.DataFrame]]:
+    """
+    Infer the schema from the first chunk and return it with the chunks to insert
+    """
+    iterator = iter(chunks)
+    first = next(iterator, None)
+    if first is None:
+        return None, iter(())
+    return infer_schema(first, sample_size, renames, types), chain([first], iterator)
+
+
+def insert_query(table_name: str, column_types: Dict[str, str]) -> str:
+    names = ', '.join(f"`{name}`" for name in column_types)
+    return f"INSERT INTO `{table_name}` ({names}) VALUES"
+
+
+def insert_dataframe(
+    client,
+    table_name: str,
+    df: pd.DataFrame,
+    column_types: Dict[str, str],
+    batch_size: Optional[int] = None,
+    dedup_token: Optional[str] = None,
+    offset: int = 0,
+    scheduler: Optional[InsertScheduler] = None
+) -> int:
+    """
+    Insert a DataFrame into ClickHouse in large columnar blocks.
+
+    `column_types` maps the target column names to their ClickHouse types and
+    must follow the column order of `df`; columns whose values do not fit
+    are widened (see `convert_block`). Blocks hold `batch_size` rows when
+    given, otherwise the scheduler sizes them by bytes (see InsertScheduler).
+    With `dedup_token` every block is sent with an insert_deduplication_token
+    derived from it, the block's row `offset` within the file and its
+    content hash, so a re-sent block is dropped by ClickHouse. Returns the
+    number of rows inserted.
+    """
+    scheduler = scheduler or InsertScheduler()
+    batch_size = batch_size or scheduler.block_rows(df)
+    size = row_bytes(df)
+    query = insert_query(table_name, column_types)
+
+    inserted = 0
+    for start in range(0, len(df), batch_size):
+        block = df.iloc[start:start + batch_size]
+        data = convert_block(
+            block, column_types, lambda name, wider: alter_columns(client, table_name, {name: wider})
+        )
+        insert_settings = None
+        if dedup_token:
+            insert_settings = {"insert_deduplication_token": block_token(dedup_token, offset + start, block)}
+        scheduler.insert(client, query, data, len(block), size * len(block), insert_settings)
+        inserted += len(block)
+    return inserted
+
+
+def ingest_chunks(
+    client,
+    chunks: Iterable[pd.DataFrame],
+    table_name: str,
+    batch_size: Optional[int] = None,
+    sample_size: Optional[int] = None,
+    dedup_token: Optional[str] = None,
+    renames: Optional[Dict[str, str]] = None,
+    types: Optional[Dict[str, str]] = None,
+    scheduler: Optional[InsertScheduler] = None
+) -> int:
+    """
+    Create the target table from the first chunk and insert every chunk in turn.
+
+    Column types are inferred from up to `sample_size` rows of the first chunk
+    (see `peek_schema`), or taken from the table when it already exists (see
+    `prepare_table`), and widened when a later value does not fit;
+    `renames` and `types` rename columns and override their inferred types. Chunks smaller than an insert block are coalesced
+    and larger ones split, and each block is fully inserted before the next
+    one is pulled from `chunks`, so a streaming parser holds at most a block
+    in memory and waits while ClickHouse is slow. With `dedup_token` the
+    table gets a deduplication window and blocks are sent with
+    deduplication tokens (see `insert_dataframe`). Pass a `scheduler` to
+    read the per-block throughput afterwards.
+    """
+    scheduler = scheduler or InsertScheduler()
+    if batch_size is None:
+        chunks = scheduler.coalesce(chunks)
+    column_types, chunks = peek_schema(chunks, sample_size, renames, types)
+    if column_types is None:
+        return 0
+    column_types = prepare_table(client, table_name, column_types)
+    if dedup_token:
+        enable_block_dedup(client, table_name)
+    inserted = 0
+    for chunk in chunks:
+        # Coalesced chunks are already one block each
+        inserted += insert_dataframe(
+            client, table_name, chunk, column_types, batch_size or len(chunk), dedup_token, inserted, scheduler
+        )
+    return inserted
@@ -0,0 +1,359 @@
+from itertools import islice
+from typing import Callable, Dict, List, Optional
+from fastapi import Request
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from .clickhouse import ClickHousePool
+from .batching import InsertScheduler
+from .cache import invalidate_table
+from .config import settings
+from .dedup import enable_block_dedup, file_digest, find_ingest, record_ingest
+from .executor import progress_of
+from .export import dumps, encode_csv
+from .ingest import insert_dataframe, prepare_table, read_chunks
+from .schema import infer_schema
+
+JOB_KINDS = ("ingest", "export")
+FINISHED_STATES = ("completed", "failed", "cancelled")
+
+_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS jobs (
+        id TEXT PRIMARY KEY,
+        kind TEXT NOT NULL,
+        owner TEXT,
+        status TEXT NOT NULL,
+        params TEXT NOT NULL,
+        checkpoint TEXT NOT NULL DEFAULT '{}',
+        progress TEXT NOT NULL DEFAULT '{}',
+        result TEXT,
+        error TEXT,
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL
+    )
+"""
+_JSON_FIELDS = ("params", "checkpoint", "progress", "result")
+
+
+class JobCancelled(Exception):
+    """
+    Raised at a checkpoint once the job has been cancelled
+    """
+
+
+class JobInterrupted(Exception):
+    """
+    Raised at a checkpoint while the manager shuts down; the job resumes on next start
+    """
+
+
+class JobStore:
+    """
+    Job records persisted in a SQLite file so they survive restarts
+    """
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        with self._db:
+            self._db.execute(_SCHEMA)
+
+    def _decode(self, row: sqlite3.Row) -> dict:
+        job = dict(row)
+        for field in _JSON_FIELDS:
+            job[field] = json.loads(job[field]) if job[field] is not None else None
+        return job
+
+    def create(self, kind: str, params: dict, owner: Optional[str] = None) -> dict:
+        now = time.time()
+        job_id = uuid.uuid4().hex
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT INTO jobs (id, kind, owner, status, params, created_at, updated_at) "
+                "VALUES (?, ?, ?, 'queued', ?, ?, ?)",
+                (job_id, kind, owner, json.dumps(params), now, now)
+            )
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._decode(row) if row else None
+
+    def list(self, owner: Optional[str] = None, statuses: Optional[List[str]] = None) -> List[dict]:
+        query, args = "SELECT * FROM jobs WHERE 1 = 1", []
+        if owner is not None:
+            query += " AND owner = ?"
+            args.append(owner)
+        if statuses:
+            query += f" AND status IN ({', '.join('?' for _ in statuses)})"
+            args.extend(statuses)
+        with self._lock:
+            rows = self._db.execute(query + " ORDER BY created_at", args).fetchall()
+        return [self._decode(row) for row in rows]
+
+    def update(self, job_id: str, **fields):
+        fields["updated_at"] = time.time()
+        for field in _JSON_FIELDS:
+            if field in fields:
+                fields[field] = json.dumps(fields[field], default=str)
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock, self._db:
+            self._db.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def delete(self, job_id: str):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def close(self):
+        self._db.close()
+
+
+class JobContext:
+    """
+    Handed to a running job to persist checkpoints and observe cancellation
+    """
+
+    def __init__(self, manager: "JobManager", job: dict):
+        self.manager = manager
+        self.job = job
+        self.params = job["params"]
+        self.state = job["checkpoint"]
+
+    def checkpoint(self, state: dict, progress: dict):
+        """
+        Persist the resume state after a committed block, then stop if asked to
+        """
+        self.state = state
+        self.manager.store.update(self.job["id"], checkpoint=state, progress=progress)
+        if self.job["id"] in self.manager._cancelled:
+            raise JobCancelled()
+        if self.manager._stopping.is_set():
+            raise JobInterrupted()
+
+
+def run_ingest(pool: ClickHousePool, ctx: JobContext) -> dict:
+    """
+    Insert a spooled upload block by block, skipping blocks committed before a restart.
+
+    The chunk size is part of the job parameters and the batch size, when
+    not given, is sized by bytes on the first chunk and checkpointed, so
+    block boundaries are the same on every run and the committed row count
+    is enough to resume. Every block carries a deduplication token derived
+    from the job (or, with `dedup`, the file), so a block inserted just
+    before a crash and sent again on resume is dropped by ClickHouse.
+    """
+    params = ctx.params
+    table_name = params["table_name"]
+    scheduler = InsertScheduler(params.get("async_insert"))
+    batch_size = params.get("batch_size") or ctx.state.get("batch_size")
+    committed = ctx.state.get("rows", 0)
+    column_types = ctx.state.get("column_types")
+    total_bytes = os.path.getsize(params["path"])
+
+    offset = 0
+    with open(params["path"], "rb") as source, pool.connection() as client:
+        file_hash = file_digest(source) if params.get("dedup") else None
+        previous = find_ingest(client, table_name, file_hash) if file_hash else None
+        if previous:
+            os.unlink(params["path"])
+            return {"table_name": table_name, "rows_inserted": 0, "skipped": True, "previous": previous}
+
+        token = file_hash or f"job-{ctx.job['id']}"
+        for chunk in read_chunks(source, params["filename"], params.get("chunk_size")):
+            if column_types is None:
+                column_types = prepare_table(client, table_name, infer_schema(chunk, params.get("sample_size")))
+                enable_block_dedup(client, table_name)
+            batch_size = batch_size or scheduler.block_rows(chunk)
+            for start in range(0, len(chunk), batch_size):
+                block = chunk.iloc[start:start + batch_size]
+                offset += len(block)
+                if offset <= committed:
+                    continue
+                insert_dataframe(
+                    client, table_name, block, column_types, batch_size, token, offset - len(block), scheduler
+                )
+                ctx.checkpoint(
+                    {"rows": offset, "column_types": column_types, "batch_size": batch_size},
+                    {"rows": offset, "bytes_read": min(source.tell(), total_bytes), "total_bytes": total_bytes}
+                )
+        if file_hash:
+            record_ingest(client, table_name, file_hash, params["filename"], offset)
+
+    os.unlink(params["path"])
+    invalidate_table(table_name)
+    report = scheduler.report()
+    del report["per_block"]  # job results stay small; progress already tracks rows
+    return {"table_name": table_name, "rows_inserted": offset, "insert": report}
+
+
+def run_export(pool: ClickHousePool, ctx: JobContext) -> dict:
+    """
+    Write a query result to a file in the jobs directory, resuming after the last flushed block.
+
+    On resume the file is truncated to the last checkpointed size and the
+    rows already written are skipped. Without ORDER BY ClickHouse returns
+    rows in no stable order, so such exports restart from the first row.
+    """
+    params = ctx.params
+    path = params["path"]
+    block_size = settings.EXPORT_BLOCK_SIZE
+    written = ctx.state.get("rows", 0)
+    size = ctx.state.get("bytes", 0)
+    if written and not params.get("ordered"):
+        written = size = 0
+
+    with open(path, "r+b" if os.path.exists(path) else "wb") as out, pool.connection() as client:
+        out.truncate(size)
+        out.seek(size)
+        rows = client.execute_iter(
+            params["query"],
+            with_column_types=True,
+            settings={"max_block_size": block_size}
+        )
+        columns = next(rows)
+        if size == 0 and params["format"] == "csv":
+            out.write(encode_csv([], [name for name, _ in columns]))
+        # Drain the rows committed by the previous run without writing them again
+        for _ in islice(rows, written):
+            pass
+        while True:
+            block = list(islice(rows, block_size))
+            if not block:
+                break
+            if params["format"] == "csv":
+                out.write(encode_csv(block))
+            else:
+                out.write(b"".join([dumps(row) + b"\n" for row in block]))
+            out.flush()
+            written += len(block)
+            ctx.checkpoint(
+                {"rows": written, "bytes": out.tell()},
+                {"rows": written, "bytes": out.tell(), **progress_of(client)}
+            )
+        size = out.tell()
+
+    return {"rows": written, "bytes": size, "format": params["format"]}
+
+
+_HANDLERS: Dict[str, Callable[[ClickHousePool, JobContext], dict]] = {
+    "ingest": run_ingest,
+    "export": run_export,
+}
+
+
+class JobManager:
+    """
+    Runs ingest and export jobs on background threads with state kept in a JobStore.
+
+    Jobs that were queued or running when the process stopped are picked up
+    again on `start()` and continue from their last checkpoint.
+    """
+
+    def __init__(self, pool: ClickHousePool, directory: Optional[str] = None, workers: Optional[int] = None):
+        self.pool = pool
+        self.directory = directory or settings.JOBS_DIR
+        os.makedirs(self.directory, exist_ok=True)
+        self.store = JobStore(os.path.join(self.directory, "jobs.db"))
+        self.workers = workers or settings.JOB_WORKERS
+        self._queue: "queue.Queue[Optional[str]]" = queue.Queue()
+        self._cancelled = set()
+        # Serializes a worker claiming a queued job against cancelling it
+        self._claim_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def start(self):
+        for job in self.store.list(statuses=["queued", "running"]):
+            self.store.update(job["id"], status="queued")
+            self._queue.put(job["id"])
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def close(self, timeout: float = 10.0):
+        """
+        Stop the workers; running jobs halt at their next checkpoint and stay resumable
+        """
+        self._stopping.set()
+        for _ in self._threads:
+            self._queue.put(None)
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        self.store.close()
+
+    def path_for(self, job_id: str, suffix: str) -> str:
+        return os.path.join(self.directory, f"{job_id}{suffix}")
+
+    def submit(self, kind: str, params: dict, owner: Optional[str] = None) -> dict:
+        if kind not in JOB_KINDS:
+            raise ValueError(f"Unknown job kind: {kind}")
+        job = self.store.create(kind, params, owner)
+        self._queue.put(job["id"])
+        return job
+
+    def cancel(self, job_id: str) -> Optional[dict]:
+        """
+        Cancel a queued job at once, or a running one at its next checkpoint;
+        a running job's worker removes its files once it lets go of the job
+        """
+        with self._claim_lock:
+            job = self.store.get(job_id)
+            if job is None or job["status"] in FINISHED_STATES:
+                return job
+            if job["status"] == "running":
+                self._cancelled.add(job_id)
+                return job
+            # Still queued, so no worker holds it
+            self.store.update(job_id, status="cancelled")
+        self._cleanup(job)
+        return self.store.get(job_id)
+
+    def delete(self, job_id: str):
+        job = self.store.get(job_id)
+        if job is not None:
+            self._cleanup(job)
+            self.store.delete(job_id)
+
+    def _cleanup(self, job: dict):
+        path = job["params"].get("path")
+        if path and os.path.exists(path):
+            os.unlink(path)
+
+    def _work(self):
+        while not self._stopping.is_set():
+            job_id = self._queue.get()
+            if job_id is None:
+                break
+            with self._claim_lock:
+                job = self.store.get(job_id)
+                if job is None or job["status"] != "queued":
+                    continue
+                self.store.update(job_id, status="running")
+            self._run(job)
+
+    def _run(self, job: dict):
+        job_id = job["id"]
+        try:
+            result = _HANDLERS[job["kind"]](self.pool, JobContext(self, job))
+            self.store.update(job_id, status="completed", result=result)
+        except JobCancelled:
+            self.store.update(job_id, status="cancelled")
+            self._cleanup(job)
+        except JobInterrupted:
+            self.store.update(job_id, status="queued")
+        except Exception as e:
+            self.store.update(job_id, status="failed", error=str(e))
+        finally:
+            self._cancelled.discard(job_id)
+
+
+def get_job_manager(request: Request) -> JobManager:
+    return request.app.state.job_manager
@@ -0,0 +1,97 @@
+from typing import Iterable, Iterator, TypeVar
+import time
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+T = TypeVar("T")
+
+# Latency buckets from sub-millisecond block encodes up to multi-minute queries
+_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+STAGE_SECONDS = Histogram(
+    "cookiedata_stage_seconds",
+    "Time spent in each pipeline stage (parse, infer, insert, query, serialize)",
+    ["stage"],
+    buckets=_BUCKETS
+)
+REQUEST_SECONDS = Histogram(
+    "cookiedata_http_request_seconds",
+    "HTTP request latency until the response headers are sent",
+    ["method", "route", "status"],
+    buckets=_BUCKETS
+)
+ROWS = Counter("cookiedata_rows", "Rows moved through the pipeline", ["direction"])
+BYTES = Counter("cookiedata_bytes", "Bytes moved through the pipeline", ["direction"])
+ACTIVE_STREAMS = Gauge("cookiedata_active_streams", "Query results currently being streamed")
+
+
+def timed(stage: str):
+    """
+    Context manager observing the duration of its block in the stage histogram
+    """
+    return STAGE_SECONDS.labels(stage).time()
+
+
+def timed_iter(iterable: Iterable[T], stage: str) -> Iterator[T]:
+    """
+    Yield from `iterable`, observing the time spent producing each item
+    """
+    histogram = STAGE_SECONDS.labels(stage)
+    iterator = iter(iterable)
+    while True:
+        started = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        histogram.observe(time.perf_counter() - started)
+        yield item
+
+
+def count(direction: str, rows: int = 0, size: int = 0):
+    if rows:
+        ROWS.labels(direction).inc(rows)
+    if size:
+        BYTES.labels(direction).inc(size)
+
+
+class PoolCollector:
+    """
+    Expose a ClickHousePool's occupancy and counters at scrape time
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def collect(self):
+        stats = self.pool.stats()
+        in_use = GaugeMetricFamily("cookiedata_pool_connections_in_use", "Checked-out connections", labels=["host", "database", "user"])
+        idle = GaugeMetricFamily("cookiedata_pool_connections_idle", "Idle pooled connections", labels=["host", "database", "user"])
+        for profile in stats["profiles"]:
+            labels = [f"{profile['host']}:{profile['port']}", profile["database"], profile["user"]]
+            in_use.add_metric(labels, profile["in_use"])
+            idle.add_metric(labels, profile["idle"])
+        yield in_use
+        yield idle
+        yield GaugeMetricFamily("cookiedata_pool_max_size", "Connection limit per profile", value=stats["max_size"])
+        events = CounterMetricFamily("cookiedata_pool_events", "Connection pool events", labels=["event"])
+        for event in ("created", "reused", "health_checks", "discarded", "wait_timeouts"):
+            events.add_metric([event], stats[event])
+        yield events
+
+
+def register_pool(pool) -> PoolCollector:
+    collector = PoolCollector(pool)
+    REGISTRY.register(collector)
+    return collector
+
+
+def unregister(collector):
+    REGISTRY.unregister(collector)
+
+
+def render() -> tuple:
+    """
+    Current metrics in the Prometheus text format, with its content type
+    """
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
@@ -0,0 +1,358 @@
+from concurrent.futures import Future, ProcessPoolExecutor
+from itertools import islice
+from queue import Empty
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+import asyncio
+import multiprocessing
+import os
+import re
+import tempfile
+import time
+import zipfile
+import pandas as pd
+from .batching import InsertScheduler, row_bytes
+from .clickhouse import ClickHousePool, create_client
+from .config import settings
+from .export import ChunkSink, encode_csv, encode_ndjson
+from .ingest import alter_columns, convert_block, create_table, describe_table, insert_query, read_chunks
+from .schema import common_type, infer_schema, to_array
+
+PARALLEL_FORMATS = ("csv", "ndjson")
+
+# Workers are spawned, not forked: a fork would copy the server's threads,
+# locks and open ClickHouse connections into every worker
+_mp_context = multiprocessing.get_context("spawn")
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+_manager = None
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """
+    Lazily start the worker processes shared by parallel exports and batch ingests
+    """
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(
+            max_workers=settings.PARALLEL_WORKERS or os.cpu_count(),
+            mp_context=_mp_context
+        )
+    return _process_pool
+
+
+def get_manager():
+    """
+    Lazily start the manager process that hosts queues shared with workers
+    """
+    global _manager
+    if _manager is None:
+        _manager = _mp_context.Manager()
+    return _manager
+
+
+def shutdown_process_pool():
+    global _process_pool, _manager
+    if _process_pool is not None:
+        _process_pool.shutdown(cancel_futures=True)
+        _process_pool = None
+    if _manager is not None:
+        _manager.shutdown()
+        _manager = None
+
+
+def shard_expression(shard_key: Optional[str]) -> str:
+    """
+    Hash expression used to split a result into shards.
+
+    Hashes `shard_key` when given, which must be a plain column name, and
+    the whole row otherwise so skewed or low-cardinality leading columns
+    cannot unbalance the shards.
+    """
+    if not shard_key:
+        return "cityHash64(*)"
+    key = shard_key.strip()
+    if not re.fullmatch(r"[A-Za-z_][A-Za-z0-9_.]*", key):
+        raise ValueError(f"Invalid shard key: {shard_key}")
+    return f"cityHash64(`{key}`)"
+
+
+def encode_block(block: list, format: str) -> bytes:
+    if format == "csv":
+        return encode_csv(block)
+    return encode_ndjson(block)
+
+
+def export_slice(query: str, shard_expr: str, shard: int, shards: int, format: str) -> dict:
+    """
+    Run one shard of an export in a worker process and encode it to a temp file
+    """
+    slice_query = f"SELECT * FROM ({query}) WHERE {shard_expr} % {shards} = {shard}"
+    block_size = settings.EXPORT_BLOCK_SIZE
+    client = create_client()
+    fd, path = tempfile.mkstemp(suffix=f".{format}", dir=settings.EXPORT_TEMP_DIR)
+    rows = 0
+    try:
+        with os.fdopen(fd, "wb") as out:
+            result = client.execute_iter(
+                slice_query,
+                with_column_types=True,
+                settings={"max_block_size": block_size}
+            )
+            columns = next(result)
+            while True:
+                block = list(islice(result, block_size))
+                if not block:
+                    break
+                out.write(encode_block(block, format))
+                rows += len(block)
+    except Exception:
+        os.unlink(path)
+        raise
+    finally:
+        client.disconnect()
+    return {"path": path, "rows": rows, "columns": [name for name, _ in columns]}
+
+
+def start_parallel_export(query: str, shard_expr: str, shards: int, format: str) -> List[Future]:
+    """
+    Submit one slice per shard to the process pool
+    """
+    pool = get_process_pool()
+    return [
+        pool.submit(export_slice, query, shard_expr, shard, shards, format)
+        for shard in range(shards)
+    ]
+
+
+def _discard(future: Future):
+    if not future.cancelled() and future.exception() is None:
+        os.unlink(future.result()["path"])
+
+
+def _read_file(path: str, size: int = 1 << 20):
+    try:
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(size)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        os.unlink(path)
+
+
+async def stream_merged(futures: List[Future], format: str) -> AsyncIterator[bytes]:
+    """
+    Concatenate slice outputs in shard order, each as soon as it is ready
+    """
+    consumed = 0
+    try:
+        for future in futures:
+            result = await asyncio.wrap_future(future)
+            consumed += 1
+            if format == "csv" and consumed == 1:
+                yield encode_csv([], result["columns"])
+            for chunk in _read_file(result["path"]):
+                yield chunk
+    finally:
+        # Slices that were not streamed are cancelled, or cleaned up once they finish
+        for future in futures[consumed:]:
+            future.cancel()
+            future.add_done_callback(_discard)
+
+
+async def stream_archive(futures: List[Future], format: str) -> AsyncIterator[bytes]:
+    """
+    Write each slice as its own member of a zip archive streamed in shard order
+    """
+    sink = ChunkSink()
+    consumed = 0
+    try:
+        with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+            for shard, future in enumerate(futures):
+                result = await asyncio.wrap_future(future)
+                consumed += 1
+                with archive.open(f"part-{shard:05d}.{format}", "w", force_zip64=True) as member:
+                    if format == "csv":
+                        member.write(encode_csv([], result["columns"]))
+                    for chunk in _read_file(result["path"]):
+                        member.write(chunk)
+                        yield sink.drain()
+        yield sink.drain()
+    finally:
+        for future in futures[consumed:]:
+            future.cancel()
+            future.add_done_callback(_discard)
+
+
+def parallel_export(
+    query: str,
+    shards: int,
+    shard_expr: str,
+    format: str,
+    archive: bool = False
+) -> Tuple[AsyncIterator[bytes], str, str]:
+    """
+    Start a sharded export and return its body with the matching media type and file suffix
+    """
+    if format not in PARALLEL_FORMATS:
+        raise ValueError(f"Parallel export supports {', '.join(PARALLEL_FORMATS)}, not {format}")
+    futures = start_parallel_export(query, shard_expr, min(shards, settings.EXPORT_MAX_SHARDS), format)
+    if archive:
+        return stream_archive(futures, format), "application/zip", ".zip"
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return stream_merged(futures, format), media_type, f".{format}"
+
+
+def parse_file(
+    path: str,
+    filename: str,
+    index: int,
+    queue,
+    column_types: Dict[str, str],
+    chunk_size: Optional[int] = None
+):
+    """
+    Parse one file in a worker process and feed converted column blocks to `queue`.
+
+    Blocks are converted to the target table's `column_types`; a column
+    whose values do not fit is widened for this file and the inserter
+    reconciles it with the table. Chunks are regrouped into byte-sized
+    insert blocks (see InsertScheduler). `queue.put` blocks while the queue
+    is full, so parsers slow down to the pace of the inserter.
+    """
+    started = time.monotonic()
+    rows = 0
+    column_types = dict(column_types)
+    try:
+        with open(path, "rb") as source:
+            for chunk in InsertScheduler().coalesce(read_chunks(source, filename, chunk_size)):
+                if len(chunk.columns) != len(column_types):
+                    raise ValueError(f"{filename} has {len(chunk.columns)} columns, the table has {len(column_types)}")
+                data = convert_block(chunk, column_types)
+                queue.put(("block", index, dict(column_types), data, len(chunk), row_bytes(chunk) * len(chunk)))
+                rows += len(chunk)
+        queue.put(("done", index, rows, time.monotonic() - started))
+    except Exception as e:
+        queue.put(("error", index, str(e), time.monotonic() - started))
+    finally:
+        os.unlink(path)
+
+
+def settle_schemas(
+    client,
+    files: List[Tuple[str, str, str]],
+    chunk_size: Optional[int] = None,
+    sample_size: Optional[int] = None
+) -> Tuple[Dict[str, Dict[str, str]], Dict[str, str]]:
+    """
+    Create each target table once, from the first readable file loading into it.
+
+    Returns the tables' column types as ClickHouse reports them (so a table
+    that already existed keeps its own schema), and the read error of every
+    file that was tried and failed.
+    """
+    tables: Dict[str, Dict[str, str]] = {}
+    errors: Dict[str, str] = {}
+    for name, path, table in files:
+        if table in tables:
+            continue
+        try:
+            with open(path, "rb") as source:
+                first = next(read_chunks(source, name, chunk_size), None)
+        except Exception as e:
+            errors[path] = str(e)
+            continue
+        if first is not None:
+            create_table(client, table, infer_schema(first, sample_size))
+            tables[table] = describe_table(client, table)
+    return tables, errors
+
+
+def reconcile_block(client, table: str, table_types: Dict[str, str], block_types: Dict[str, str], data: list) -> list:
+    """
+    Fit a block converted with `block_types` into the table.
+
+    Columns a parser had to widen are widened in the table too, and columns
+    converted with a narrower type than the table's (since widened for
+    another file) are converted again. `table_types` is updated in place.
+    """
+    merged = [common_type(table_type, block_type) for table_type, block_type in zip(table_types.values(), block_types.values())]
+    changes = {name: col_type for (name, old), col_type in zip(table_types.items(), merged) if col_type != old}
+    if changes:
+        alter_columns(client, table, changes)
+        table_types.update(changes)
+    return [
+        values if block_type == table_type else to_array(pd.Series(values, dtype=object), table_type)
+        for values, block_type, table_type in zip(data, block_types.values(), table_types.values())
+    ]
+
+
+def ingest_files(
+    pool: ClickHousePool,
+    files: List[Tuple[str, str, str]],
+    chunk_size: Optional[int] = None,
+    sample_size: Optional[int] = None,
+    scheduler: Optional[InsertScheduler] = None
+) -> List[dict]:
+    """
+    Parse `(filename, path, table)` entries concurrently and insert their blocks.
+
+    Each target table gets one schema up front (see `settle_schemas`) that
+    every file loading into it is converted to. Files are parsed by the
+    process pool; this thread drains the shared bounded queue and inserts
+    each block as it arrives, so when the scheduler pauses for a slow
+    ClickHouse the full queue stalls the parsers. Returns per-file row
+    counts and timings.
+    """
+    scheduler = scheduler or InsertScheduler()
+    queue = get_manager().Queue(maxsize=settings.INGEST_QUEUE_BLOCKS)
+    workers = get_process_pool()
+    stats = [
+        {"file": name, "table": table, "rows": 0, "parse_seconds": 0.0, "insert_seconds": 0.0, "error": None}
+        for name, _, table in files
+    ]
+
+    with pool.connection() as client:
+        tables, errors = settle_schemas(client, files, chunk_size, sample_size)
+        futures: Dict[int, Future] = {}
+        for index, (name, path, table) in enumerate(files):
+            if table in tables:
+                futures[index] = workers.submit(parse_file, path, name, index, queue, tables[table], chunk_size)
+            else:
+                # Every file for this table was unreadable or empty
+                stats[index]["error"] = errors.get(path)
+                os.unlink(path)
+
+        pending = set(futures)
+        while pending:
+            try:
+                kind, index, *payload = queue.get(timeout=1)
+            except Empty:
+                # A worker that died without reporting would otherwise stall the batch
+                for index in list(pending):
+                    if futures[index].done() and futures[index].exception() is not None:
+                        stats[index]["error"] = str(futures[index].exception())
+                        pending.discard(index)
+                continue
+            entry = stats[index]
+            if kind == "block":
+                if entry["error"]:
+                    continue
+                block_types, data, rows, size = payload
+                started = time.monotonic()
+                try:
+                    table_types = tables[entry["table"]]
+                    if block_types != table_types:
+                        data = reconcile_block(client, entry["table"], table_types, block_types, data)
+                    scheduler.insert(client, insert_query(entry["table"], table_types), data, rows, size)
+                    entry["rows"] += rows
+                except Exception as e:
+                    entry["error"] = str(e)
+                entry["insert_seconds"] += time.monotonic() - started
+            else:
+                pending.discard(index)
+                if kind == "error":
+                    entry["error"] = payload[0]
+                entry["parse_seconds"] = payload[1]
+    return stats
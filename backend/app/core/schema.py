@@ -0,0 +1,403 @@
+from typing import Dict, Optional
+import re
+import numpy as np
+import pandas as pd
+from pandas.api import types as ptypes
+from .config import settings
+from .metrics import timed
+
+# Narrowest ClickHouse integer types, in order of preference
+_INT_TYPES = [
+    ("UInt8", 0, 2**8 - 1), ("Int8", -2**7, 2**7 - 1),
+    ("UInt16", 0, 2**16 - 1), ("Int16", -2**15, 2**15 - 1),
+    ("UInt32", 0, 2**32 - 1), ("Int32", -2**31, 2**31 - 1),
+    ("Int64", -2**63, 2**63 - 1), ("UInt64", 0, 2**64 - 1),
+]
+
+_BOOL_STRINGS = {"true": True, "false": False}
+
+# Type overrides end up in CREATE TABLE, so only allow type-expression characters
+_TYPE_PATTERN = re.compile(r"[A-Za-z][\w(), ']*")
+
+
+def sanitize_name(name: str) -> str:
+    """
+    Replace spaces and hyphens so the name can be used as a ClickHouse identifier
+    """
+    return str(name).replace(' ', '_').replace('-', '_')
+
+
+def base_type(col_type: str) -> str:
+    """
+    Strip Nullable(...) and LowCardinality(...) wrappers from a ClickHouse type
+    """
+    inner = re.fullmatch(r"(?:Nullable|LowCardinality)\((.*)\)", col_type)
+    return base_type(inner.group(1)) if inner else col_type
+
+
+# Value ranges of the ClickHouse date types
+_DATE_RANGES = {
+    "Date": (pd.Timestamp("1970-01-01"), pd.Timestamp("2149-06-06")),
+    "Date32": (pd.Timestamp("1900-01-01"), pd.Timestamp("2299-12-31")),
+    "DateTime": (pd.Timestamp("1970-01-01"), pd.Timestamp("2106-02-07 06:28:15")),
+}
+
+
+def nullable_type(col_type: str) -> str:
+    """
+    Make a type Nullable, keeping a LowCardinality wrapper outermost
+    """
+    if "Nullable(" in col_type:
+        return col_type
+    if col_type.startswith("LowCardinality("):
+        return f"LowCardinality(Nullable({base_type(col_type)}))"
+    return f"Nullable({col_type})"
+
+
+def _int_type(low, high) -> Optional[str]:
+    for name, type_min, type_max in _INT_TYPES:
+        if type_min <= low and high <= type_max:
+            return name
+    return None
+
+
+def _numeric_type(values: pd.Series) -> str:
+    if ptypes.is_bool_dtype(values):
+        return "Bool"
+    if ptypes.is_integer_dtype(values):
+        return _int_type(values.min(), values.max()) or "Float64"
+    if np.isfinite(values).all() and (values == np.floor(values)).all():
+        return _int_type(values.min(), values.max()) or "Float64"
+    return "Float64"
+
+
+def _datetime_type(values: pd.Series) -> str:
+    if values.dt.tz is not None:
+        values = values.dt.tz_convert(None)
+    if (values == values.dt.normalize()).all():
+        low, high = _DATE_RANGES["Date"]
+        return "Date" if values.min() >= low and values.max() <= high else "Date32"
+    if (values.dt.microsecond == 0).all() and (values.dt.nanosecond == 0).all():
+        return "DateTime"
+    if (values.dt.microsecond % 1000 == 0).all():
+        return "DateTime64(3)"
+    return "DateTime64(6)"
+
+
+def infer_type(series: pd.Series) -> str:
+    """
+    Choose the narrowest ClickHouse type that holds every value of `series`.
+
+    The series is usually only a sample of the column, so later values may
+    not fit: the column is then widened in place (see `widen_type`) rather
+    than typed wide up front.
+    """
+    values = series.dropna()
+    nullable = len(values) < len(series)
+    if values.empty:
+        return "Nullable(String)"
+
+    if ptypes.is_numeric_dtype(values):
+        col_type = _numeric_type(values)
+    elif ptypes.is_datetime64_any_dtype(values):
+        col_type = _datetime_type(values)
+    else:
+        col_type = None
+        strings = values.astype(str).str.strip()
+        numeric = pd.to_numeric(strings, errors="coerce")
+        if numeric.notna().all():
+            col_type = _numeric_type(numeric)
+        elif strings.str.lower().isin(_BOOL_STRINGS).all():
+            col_type = "Bool"
+        else:
+            dates = pd.to_datetime(strings, errors="coerce", format="ISO8601")
+            if dates.notna().all():
+                col_type = _datetime_type(dates)
+
+        if col_type is None:
+            distinct = strings.nunique()
+            low_cardinality = (
+                distinct <= settings.LOW_CARDINALITY_MAX_DISTINCT
+                and distinct <= len(values) * settings.LOW_CARDINALITY_MAX_RATIO
+            )
+            col_type = "String"
+            if nullable:
+                col_type = "Nullable(String)"
+            return f"LowCardinality({col_type})" if low_cardinality else col_type
+
+    return f"Nullable({col_type})" if nullable else col_type
+
+
+def infer_schema(
+    df: pd.DataFrame,
+    sample_size: Optional[int] = None,
+    renames: Optional[Dict[str, str]] = None,
+    types: Optional[Dict[str, str]] = None
+) -> Dict[str, str]:
+    """
+    Map sanitized column names to ClickHouse types inferred from the first `sample_size` rows.
+
+    `renames` maps source column names to target names. `types` maps source or
+    target names to ClickHouse types that replace inference for those columns.
+    """
+    renames = renames or {}
+    types = types or {}
+    sample_size = sample_size or settings.SCHEMA_SAMPLE_SIZE
+    sample = df.head(sample_size)
+    with timed("infer"):
+        column_types = {}
+        for col in sample.columns:
+            name = sanitize_name(renames.get(col, col))
+            if name in column_types:
+                raise ValueError(f"Duplicate column name after rename: {name}")
+            col_type = types.get(col) or types.get(name)
+            if col_type is not None and not _TYPE_PATTERN.fullmatch(col_type):
+                raise ValueError(f"Invalid type for column {col}: {col_type}")
+            column_types[name] = col_type or infer_type(sample[col])
+        return column_types
+
+
+def _parse_numeric(values: pd.Series) -> pd.Series:
+    if ptypes.is_numeric_dtype(values):
+        return values.astype("float64") if ptypes.is_bool_dtype(values) else values
+    return pd.to_numeric(values.astype(str).str.strip(), errors="coerce")
+
+
+def _parse_datetime(values: pd.Series) -> pd.Series:
+    if ptypes.is_numeric_dtype(values):
+        # Numbers are not dates; never read them as epoch offsets
+        return pd.Series(pd.NaT, index=values.index, dtype="datetime64[ns]")
+    values = pd.to_datetime(values, errors="coerce", format="ISO8601")
+    return values.dt.tz_convert(None) if values.dt.tz is not None else values
+
+
+def _int_bounds(col_base: str) -> Optional[tuple]:
+    for name, type_min, type_max in _INT_TYPES:
+        if name == col_base:
+            return type_min, type_max
+    return None  # Int128 and wider are not range-checked
+
+
+def _fits(values: pd.Series, col_base: str) -> bool:
+    """
+    Whether every value of `values` (which holds no nulls) converts to `col_base` exactly
+    """
+    if values.empty:
+        return True
+    if col_base.startswith(("Int", "UInt")):
+        if ptypes.is_bool_dtype(values):
+            return False
+        numeric = _parse_numeric(values)
+        if numeric.isna().any() or not np.isfinite(numeric).all() or (numeric != np.floor(numeric)).any():
+            return False
+        bounds = _int_bounds(col_base)
+        return bounds is None or (bounds[0] <= numeric.min() and numeric.max() <= bounds[1])
+    if col_base.startswith(("Float", "Decimal")):
+        return _parse_numeric(values).notna().all()
+    if col_base == "Bool":
+        return ptypes.is_bool_dtype(values) or values.astype(str).str.strip().str.lower().isin(_BOOL_STRINGS).all()
+    if col_base.startswith("Date"):
+        dates = _parse_datetime(values)
+        if dates.isna().any():
+            return False
+        if col_base in ("Date", "Date32") and (dates != dates.dt.normalize()).any():
+            return False
+        if col_base == "DateTime" and ((dates.dt.microsecond != 0) | (dates.dt.nanosecond != 0)).any():
+            return False
+        if col_base == "DateTime64(3)" and ((dates.dt.microsecond % 1000 != 0) | (dates.dt.nanosecond != 0)).any():
+            return False
+        low, high = _DATE_RANGES.get(col_base, _DATE_RANGES["Date32"])
+        return low <= dates.min() and dates.max() <= high
+    return True
+
+
+# Wider types tried in turn when a value does not fit a column; String holds anything
+_WIDER_TYPES = {
+    "Int": ["Float64"],
+    "UInt": ["Float64"],
+    "Float": [],
+    "Decimal": ["Float64"],
+    "Bool": [],
+}
+
+# Date types holding the whole range (and precision) of each date type, narrowest first
+_WIDER_DATES = {
+    "Date": ["Date32", "DateTime64(3)", "DateTime64(6)"],
+    "Date32": ["DateTime64(3)", "DateTime64(6)"],
+    "DateTime": ["DateTime64(3)", "DateTime64(6)"],
+    "DateTime64(3)": ["DateTime64(6)"],
+}
+
+
+def _wider_int(col_base: str, values: pd.Series) -> Optional[str]:
+    # The column keeps its current values, so the new type must cover its whole range too
+    bounds = _int_bounds(col_base)
+    numeric = _parse_numeric(values)
+    if bounds is None or numeric.isna().any() or (numeric != np.floor(numeric)).any():
+        return None
+    return _int_type(min(bounds[0], numeric.min()), max(bounds[1], numeric.max()))
+
+
+def widen_type(series: pd.Series, col_type: str) -> Optional[str]:
+    """
+    Return the narrowest type that holds both the values `col_type` already
+    holds and every value of `series`, or None when `col_type` fits.
+    The widened type is Nullable only when `col_type` is or `series` holds nulls.
+    """
+    values = series.dropna()
+    nullable = len(values) < len(series) or "Nullable(" in col_type
+    col_base = base_type(col_type)
+    if _fits(values, col_base):
+        return nullable_type(col_type) if nullable and "Nullable(" not in col_type else None
+    family = next((prefix for prefix in ("UInt", "Int", "Float", "Decimal", "Date", "Bool") if col_base.startswith(prefix)), None)
+    candidates = _WIDER_TYPES.get(family, []) if family != "Date" else _WIDER_DATES.get(col_base, [])
+    if family in ("Int", "UInt") and not ptypes.is_bool_dtype(values):
+        candidates = [_wider_int(col_base, values)] + candidates
+    wider = next((c for c in candidates if c and c != col_base and _fits(values, c)), "String")
+    return f"Nullable({wider})" if nullable else wider
+
+
+def _family(col_base: str) -> str:
+    if col_base.startswith(("Int", "UInt")):
+        return "int"
+    if col_base.startswith(("Float", "Decimal")):
+        return "float"
+    if col_base.startswith("Date"):
+        return "date"
+    return col_base
+
+
+def common_type(a: str, b: str) -> str:
+    """
+    The narrowest type holding values of both `a` and `b`
+    """
+    if a == b:
+        return a
+    nullable = "Nullable(" in a or "Nullable(" in b
+    base_a, base_b = base_type(a), base_type(b)
+    if base_a == base_b:
+        return nullable_type(a) if nullable else a
+    family_a, family_b = _family(base_a), _family(base_b)
+    if family_a == family_b == "int" and _int_bounds(base_a) and _int_bounds(base_b):
+        (low_a, high_a), (low_b, high_b) = _int_bounds(base_a), _int_bounds(base_b)
+        common = _int_type(min(low_a, low_b), max(high_a, high_b)) or "Float64"
+    elif family_a in ("int", "float") and family_b in ("int", "float"):
+        common = "Float64"
+    elif family_a == family_b == "date":
+        common = "Date32" if {base_a, base_b} <= {"Date", "Date32"} else "DateTime64(6)"
+    else:
+        common = "String"
+    return f"Nullable({common})" if nullable else common
+
+
+def widen_schema(df: pd.DataFrame, column_types: Dict[str, str]) -> Dict[str, str]:
+    """
+    Columns of `column_types` (in `df` column order) whose type does not hold
+    the values of `df`, mapped to the wider type they need
+    """
+    with timed("infer"):
+        changes = {}
+        for (name, col_type), col in zip(column_types.items(), df.columns):
+            wider = widen_type(df[col], col_type)
+            if wider is not None:
+                changes[name] = wider
+        return changes
+
+
+def _reject(series: pd.Series, failed: pd.Series, col_type: str):
+    if failed.any():
+        raise ValueError(f"Value {series[failed].iloc[0]!r} in column {series.name} does not fit {col_type}")
+
+
+def _convert(series: pd.Series, col_type: str) -> pd.Series:
+    nullable = "Nullable(" in col_type
+    col_base = base_type(col_type)
+    present = series.notna()
+    if not nullable and not present.all():
+        raise ValueError(f"Column {series.name} holds nulls but {col_type} is not Nullable")
+
+    if col_base.startswith(("Int", "UInt")):
+        numeric = _parse_numeric(series)
+        _reject(series, present & (numeric.isna() | ~np.isfinite(numeric) | (numeric != np.floor(numeric))), col_type)
+        bounds = _int_bounds(col_base)
+        if bounds is not None:
+            _reject(series, present & ((numeric < bounds[0]) | (numeric > bounds[1])), col_type)
+        values = numeric.astype("UInt64" if col_base.startswith("U") else "Int64")
+    elif col_base.startswith("Float"):
+        values = _parse_numeric(series).astype("float64")
+        _reject(series, present & values.isna(), col_type)
+    elif col_base.startswith("Decimal"):
+        values = _parse_numeric(series)
+        _reject(series, present & values.isna(), col_type)
+    elif col_base == "Bool":
+        values = series
+        if not ptypes.is_bool_dtype(series):
+            values = series.astype(str).str.strip().str.lower().map(_BOOL_STRINGS).where(present)
+        _reject(series, present & values.isna(), col_type)
+    elif col_base.startswith("Date"):
+        values = _parse_datetime(series)
+        _reject(series, present & values.isna(), col_type)
+        low, high = _DATE_RANGES.get(col_base, _DATE_RANGES["Date32"])
+        _reject(series, present & ((values < low) | (values > high)), col_type)
+        if col_base in ("Date", "Date32"):
+            _reject(series, present & (values != values.dt.normalize()), col_type)
+        elif col_base == "DateTime":
+            _reject(series, present & ((values.dt.microsecond != 0) | (values.dt.nanosecond != 0)), col_type)
+        elif col_base == "DateTime64(3)":
+            _reject(series, present & ((values.dt.microsecond % 1000 != 0) | (values.dt.nanosecond != 0)), col_type)
+    else:
+        values = series.astype(str).where(present)
+    return values
+
+
+def to_column(series: pd.Series, col_type: str) -> list:
+    """
+    Convert a DataFrame column into a list of values matching the ClickHouse type.
+
+    Nulls become None. Raises ValueError, before anything is sent, when a
+    value does not convert exactly or a non-Nullable column holds a null;
+    `widen_type` picks a type that fits instead.
+    """
+    values = _convert(series, col_type)
+    col_base = base_type(col_type)
+    if col_base.startswith("Float") and "Nullable(" not in col_type:
+        return values.tolist()
+    if col_base in ("Date", "Date32"):
+        values = values.dt.date
+    return values.astype(object).where(values.notna(), None).tolist()
+
+
+# Types clickhouse_driver can insert from NumPy arrays, with the array dtype
+# used when the column holds no nulls. Date and DateTime columns take
+# datetime64 arrays, which the driver localizes to the server timezone like
+# the naive datetimes of a list insert; other types are sent as object arrays.
+_NUMPY_DTYPES = {
+    **{name: np.dtype(name.lower()) for name, _, _ in _INT_TYPES},
+    "Float32": np.dtype("float32"),
+    "Float64": np.dtype("float64"),
+    "Bool": np.dtype("bool"),
+    "String": np.dtype(object),
+    "Date": np.dtype("datetime64[D]"),
+    "DateTime": np.dtype("datetime64[s]"),
+    "DateTime64(3)": np.dtype("datetime64[ms]"),
+    "DateTime64(6)": np.dtype("datetime64[us]"),
+}
+
+
+def to_array(series: pd.Series, col_type: str) -> np.ndarray:
+    """
+    Like `to_column`, but return a NumPy array for a `use_numpy` insert.
+
+    Numeric and date columns keep a fixed-width dtype, so values from Arrow
+    batches and numeric CSV columns are never boxed into Python objects.
+    """
+    dtype = _NUMPY_DTYPES.get(base_type(col_type))
+    if dtype is None:
+        return np.array(to_column(series, col_type), dtype=object)
+    values = _convert(series, col_type)
+    if dtype.kind == "M":
+        # NaT marks the nulls of a Nullable column
+        return values.to_numpy(dtype)
+    if not values.isna().any():
+        return values.to_numpy(dtype)
+    return values.astype(object).where(values.notna(), None).to_numpy()
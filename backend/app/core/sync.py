@@ -0,0 +1,276 @@
+from itertools import islice
+from typing import Dict, List, Optional, Tuple
+import json
+import os
+import re
+import shutil
+import threading
+import time
+from .clickhouse import ClickHousePool
+from .config import settings
+from .export import COMPRESSIONS, dumps, encode_csv, get_compressor
+from .metrics import count, timed
+from .schema import base_type
+
+# Chunk file suffix and media type per sync format
+SYNC_FORMATS = {
+    "csv": (".csv", "text/csv"),
+    "ndjson": (".ndjson", "application/x-ndjson"),
+}
+
+# Consumers and tables become directory names, so keep them to plain names
+_NAME = re.compile(r"\w[\w.-]*")
+
+_locks: Dict[Tuple[str, str], threading.Lock] = {}
+_locks_guard = threading.Lock()
+
+
+class SyncBusy(Exception):
+    """
+    Raised when a sync for the same consumer and table is already running
+    """
+
+
+def _lock_for(consumer: str, table: str) -> threading.Lock:
+    with _locks_guard:
+        return _locks.setdefault((consumer, table), threading.Lock())
+
+
+def sync_dir(consumer: str, table: str) -> str:
+    for name in (consumer, table):
+        if not _NAME.fullmatch(name):
+            raise ValueError(f"Invalid name: {name}")
+    return os.path.join(settings.SYNC_DIR, consumer, table)
+
+
+def load_manifest(consumer: str, table: str) -> Optional[dict]:
+    path = os.path.join(sync_dir(consumer, table), "manifest.json")
+    if not os.path.exists(path):
+        return None
+    with open(path) as manifest:
+        return json.load(manifest)
+
+
+def _write_manifest(directory: str, manifest: dict):
+    # Replace atomically so a reader never sees a half-written manifest
+    partial = os.path.join(directory, "manifest.json.partial")
+    with open(partial, "w") as out:
+        json.dump(manifest, out, indent=2)
+    os.replace(partial, os.path.join(directory, "manifest.json"))
+
+
+def reset_sync(consumer: str, table: str) -> bool:
+    """
+    Forget a consumer's watermark and chunk files for `table`
+    """
+    directory = sync_dir(consumer, table)
+    if not os.path.isdir(directory):
+        return False
+    with _lock_for(consumer, table):
+        shutil.rmtree(directory)
+    return True
+
+
+def column_type(client, table: str, column: str) -> str:
+    rows = client.execute(
+        "SELECT type FROM system.columns "
+        "WHERE database = currentDatabase() AND table = %(table)s AND name = %(column)s",
+        {"table": table, "column": column}
+    )
+    if not rows:
+        raise ValueError(f"Column {column} not found in table {table}")
+    return rows[0][0]
+
+
+def watermark_expression(column: str, col_type: str) -> str:
+    """
+    SQL for the upper bound of a sync run: the maximum of `column`, or for
+    date and time columns, whose values repeat, the latest value old enough
+    (SYNC_SETTLE_SECONDS) that no more rows are expected to arrive with it
+    """
+    high = f"maxOrNull(`{column}`)"
+    settle = f"now64(6) - toIntervalSecond({int(settings.SYNC_SETTLE_SECONDS)})"
+    base = base_type(col_type)
+    if base.startswith("DateTime"):
+        return f"least({high}, CAST({settle} AS {base}))"
+    if base.startswith("Date"):
+        # A day is complete only once the settle cutoff has passed its end
+        return f"least({high}, CAST(toDate({settle}) - 1 AS {base}))"
+    return high
+
+
+class _ChunkWriter:
+    """
+    Write rows into numbered chunk files of at most `chunk_rows` rows each.
+
+    Every chunk is a standalone file (CSV chunks repeat the header) written
+    under a temporary name and renamed once complete.
+    """
+
+    def __init__(self, directory: str, sequence: int, format: str, compression: Optional[str], columns: List[str], chunk_rows: int):
+        self.directory = directory
+        self.sequence = sequence
+        self.format = format
+        self.compression = compression
+        self.columns = columns
+        self.chunk_rows = chunk_rows
+        self.suffix = SYNC_FORMATS[format][0] + (COMPRESSIONS[compression][0] if compression else "")
+        self.chunks: List[dict] = []
+        self._out = None
+
+    def _open(self):
+        self.name = f"part-{self.sequence:08d}{self.suffix}"
+        self._out = open(os.path.join(self.directory, self.name + ".partial"), "wb")
+        self._compressor = get_compressor(self.compression) if self.compression else None
+        self._rows = 0
+        self._bytes = 0
+        self._emit(encode_csv([], self.columns) if self.format == "csv" else b"")
+
+    def _emit(self, data: bytes):
+        if self._compressor is not None:
+            data = self._compressor.compress(data)
+        self._out.write(data)
+        self._bytes += len(data)
+
+    def _close(self):
+        if self._compressor is not None:
+            tail = self._compressor.flush()
+            self._out.write(tail)
+            self._bytes += len(tail)
+        self._out.close()
+        os.replace(os.path.join(self.directory, self.name + ".partial"), os.path.join(self.directory, self.name))
+        self.chunks.append({"name": self.name, "rows": self._rows, "bytes": self._bytes, "created_at": time.time()})
+        count("exported", rows=self._rows, size=self._bytes)
+        self.sequence += 1
+        self._out = None
+
+    def write(self, rows: list):
+        while rows:
+            if self._out is None:
+                self._open()
+            take = rows[:self.chunk_rows - self._rows]
+            if self.format == "csv":
+                self._emit(encode_csv(take))
+            else:
+                self._emit(b"".join([dumps(row) + b"\n" for row in take]))
+            self._rows += len(take)
+            rows = rows[len(take):]
+            if self._rows >= self.chunk_rows:
+                self._close()
+
+    def finish(self):
+        if self._out is not None:
+            self._close()
+
+    def discard(self):
+        """
+        Remove every file written by this run; they are not in the manifest yet
+        """
+        if self._out is not None:
+            self._out.close()
+            os.unlink(os.path.join(self.directory, self.name + ".partial"))
+        for chunk in self.chunks:
+            os.unlink(os.path.join(self.directory, chunk["name"]))
+
+
+def sync_table(
+    pool: ClickHousePool,
+    table: str,
+    column: str,
+    consumer: str,
+    format: str = "csv",
+    compression: Optional[str] = None,
+    chunk_rows: Optional[int] = None
+) -> dict:
+    """
+    Export the rows of `table` added since the consumer's last sync as new chunk files.
+
+    Each run exports the range (previous watermark, current watermark], so
+    `column` must increase as rows are inserted. Numeric and string columns
+    such as an auto-incremented id must be strictly increasing; their
+    watermark is the current maximum. Date and time columns, e.g. an insert
+    time with DEFAULT now(), may repeat; their watermark stops
+    SYNC_SETTLE_SECONDS short of the current time (see
+    `watermark_expression`) so rows still arriving with the latest value
+    are left for the next run. The manifest is only advanced after every
+    chunk file has been written, so a failed run is simply repeated.
+    """
+    if format not in SYNC_FORMATS:
+        raise ValueError(f"Unsupported format: {format}")
+    if compression and compression not in COMPRESSIONS:
+        raise ValueError(f"Unsupported compression: {compression}")
+    directory = sync_dir(consumer, table)
+
+    lock = _lock_for(consumer, table)
+    if not lock.acquire(blocking=False):
+        raise SyncBusy(f"A sync of {table} for {consumer} is already running")
+    try:
+        manifest = load_manifest(consumer, table) or {
+            "table": table,
+            "consumer": consumer,
+            "column": column,
+            "watermark": None,
+            "next_sequence": 1,
+            "chunks": [],
+        }
+        if manifest["column"] != column:
+            raise ValueError(f"Sync of {table} for {consumer} tracks column {manifest['column']}; reset it to change columns")
+        low = manifest["watermark"]
+
+        with pool.connection() as client:
+            col_type = column_type(client, table, column)
+            # toString keeps the server's exact representation (e.g. DateTime64 digits)
+            high = client.execute(
+                f"SELECT toString({watermark_expression(column, col_type)}) FROM `{table}`"
+            )[0][0]
+            if high is None or high == low:
+                return {"table": table, "consumer": consumer, "watermark": low, "rows": 0, "chunks": []}
+
+            where = f"`{column}` <= CAST(%(high)s AS {col_type})"
+            if low is not None:
+                where += f" AND `{column}` > CAST(%(low)s AS {col_type})"
+            query = f"SELECT * FROM `{table}` WHERE {where}"
+
+            os.makedirs(directory, exist_ok=True)
+            block_size = settings.EXPORT_BLOCK_SIZE
+            result = client.execute_iter(
+                query,
+                {"low": low, "high": high},
+                with_column_types=True,
+                settings={"max_block_size": block_size}
+            )
+            columns = next(result)
+            writer = _ChunkWriter(
+                directory, manifest["next_sequence"], format, compression,
+                [name for name, _ in columns], chunk_rows or settings.SYNC_CHUNK_ROWS
+            )
+            try:
+                while True:
+                    with timed("query"):
+                        block = list(islice(result, block_size))
+                    if not block:
+                        break
+                    with timed("serialize"):
+                        writer.write(block)
+                writer.finish()
+            except BaseException:
+                writer.discard()
+                raise
+
+        for chunk in writer.chunks:
+            chunk.update(low=low, high=high)
+        manifest["columns"] = [{"name": name, "type": col_type} for name, col_type in columns]
+        manifest["chunks"].extend(writer.chunks)
+        manifest["next_sequence"] = writer.sequence
+        manifest["watermark"] = high
+        manifest["updated_at"] = time.time()
+        _write_manifest(directory, manifest)
+        return {
+            "table": table,
+            "consumer": consumer,
+            "watermark": high,
+            "rows": sum(chunk["rows"] for chunk in writer.chunks),
+            "chunks": writer.chunks,
+        }
+    finally:
+        lock.release()
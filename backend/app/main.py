@@ -1,17 +1,48 @@
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from app.routers import clickhouse, files, auth
+from app.routers import clickhouse, files, flatfile, auth, jobs, sync
 from app.core.config import settings
-from fastapi.responses import FileResponse
+from app.core.clickhouse import ClickHousePool
+from app.core.compression import CompressionMiddleware
+from app.core.jobs import JobManager
+from app.core.metrics import REQUEST_SECONDS, register_pool, render, unregister
+from app.core.parallel import shutdown_process_pool
+from fastapi.responses import FileResponse, Response
+from contextlib import asynccontextmanager
 import logging
+import time
 
-logging.basicConfig(level=logging.DEBUG)
+# key=value messages with lazy %-formatting, so disabled levels cost almost nothing
+logging.basicConfig(
+    level=settings.LOG_LEVEL.upper(),
+    format="%(asctime)s level=%(levelname)s logger=%(name)s %(message)s"
+)
 logger = logging.getLogger(__name__)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Shared ClickHouse connection pool, injected into routers via get_clickhouse_pool
+    app.state.clickhouse_pool = ClickHousePool()
+    # Background ingest/export jobs; interrupted jobs resume from their last checkpoint
+    app.state.job_manager = JobManager(app.state.clickhouse_pool)
+    app.state.job_manager.start()
+    pool_collector = register_pool(app.state.clickhouse_pool)
+
+    for route in app.routes:
+        logger.debug("route path=%s methods=%s", route.path, getattr(route, "methods", None))
+
+    yield
+
+    unregister(pool_collector)
+    app.state.job_manager.close()
+    app.state.clickhouse_pool.close()
+    shutdown_process_pool()
+
 app = FastAPI(
     title="Data Ingestion Tool",
     description="Bidirectional data ingestion between ClickHouse and Flat Files",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Configure CORS
@@ -23,28 +54,39 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Negotiated gzip/zstd/br compression of API responses, applied per streamed chunk
+app.add_middleware(CompressionMiddleware)
+
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
-    logger.info(f"Request: {request.method} {request.url.path}")
+    started = time.perf_counter()
     response = await call_next(request)
+    elapsed = time.perf_counter() - started
+    # Label by route template so per-table paths do not create new series
+    route = request.scope.get("route")
+    REQUEST_SECONDS.labels(
+        request.method, route.path if route else "unmatched", response.status_code
+    ).observe(elapsed)
+    logger.info(
+        "request method=%s path=%s status=%s duration_ms=%.1f",
+        request.method, request.url.path, response.status_code, elapsed * 1000
+    )
     return response
 
 # Include routers
 app.include_router(auth.router, prefix="/api/auth", tags=["auth"])
 app.include_router(clickhouse.router, prefix="/api/clickhouse", tags=["clickhouse"])
-
-# Register the files router with explicit routes
-files_router = files.router
-print("Registering files router with routes:")
-for route in files_router.routes:
-    print(f"  {route.path} [{route.methods}]")
+app.include_router(jobs.router, prefix="/api/jobs", tags=["jobs"])
+app.include_router(sync.router, prefix="/api/sync", tags=["sync"])
 
 app.include_router(
-    files_router,
+    files.router,
     prefix="/api/flatfile",
     tags=["flatfile"],
     responses={404: {"description": "Not found"}},
 )
+# Column listing and column-selective ingest used by the flat file page
+app.include_router(flatfile.router, prefix="/api/flatfile", tags=["flatfile"])
 
 # Register the test endpoint directly
 @app.get("/api/flatfile/test")
@@ -54,13 +96,14 @@ async def test_endpoint():
     """
     return {"message": "Router is working"}
 
+@app.get("/metrics")
+async def metrics():
+    """
+    Prometheus scrape endpoint
+    """
+    body, content_type = render()
+    return Response(body, media_type=content_type)
+
 @app.get("/")
 async def root():
     return {"message": "Data Ingestion Tool API"}
-
-# Print all registered routes
-@app.on_event("startup")
-async def startup_event():
-    logger.info("Registered routes:")
-    for route in app.routes:
-        logger.info(f"{route.path} - {route.methods}") 
\ No newline at end of file
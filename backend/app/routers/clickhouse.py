@@ -1,112 +1,243 @@
 from fastapi import APIRouter, HTTPException, Depends
-from clickhouse_driver import Client
-from typing import List, Optional, Dict
-from pydantic import BaseModel
-from app.core.config import settings
-import asyncio
+from typing import Any, List, Optional, Dict, Tuple, Union
+from pydantic import BaseModel, Field, StrictBool, StrictFloat, StrictInt, StrictStr
+from clickhouse_driver.util.escape import escape_params
+from app.core.cache import metadata_cache, metadata_key, preview_cache, preview_key
+from app.core.clickhouse import ClickHousePool, get_clickhouse_pool
+from app.core.executor import run_query, iter_blocks
+from app.core.metrics import count, timed
+from app.core.export import NATIVE_FORMATS, NDJSON_FRAMINGS, dumps, encode_columns, encode_ndjson, open_native_stream
+from app.core.parallel import parallel_export, shard_expression
+import time
 from fastapi.responses import StreamingResponse
 import json
+import logging
+import re
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-class ClickHouseConnection(BaseModel):
-    host: str
-    port: int
-    database: str
-    user: str
-    password: str
+FILTER_OPERATORS = (
+    "=", "!=", "<", "<=", ">", ">=", "LIKE", "NOT LIKE", "ILIKE",
+    "IN", "NOT IN", "BETWEEN", "IS NULL", "IS NOT NULL"
+)
+IDENTIFIER = re.compile(r"[A-Za-z_][A-Za-z0-9_.]*")
+
+Scalar = Union[StrictBool, StrictInt, StrictFloat, StrictStr]
+
+class Filter(BaseModel):
+    column: str
+    operator: str = "="
+    value: Union[Scalar, List[Scalar], None] = None
+
+class OrderBy(BaseModel):
+    column: str
+    direction: str = "ASC"
 
 class MultiTableQuery(BaseModel):
     tables: List[str]
     columns: List[str]
     join_conditions: List[Dict[str, str]] = []
+    filters: List[Filter] = []
+    order_by: List[OrderBy] = []
+    limit: Optional[int] = Field(None, ge=0)
+    offset: Optional[int] = Field(None, ge=0)
+    # Fraction of the data (0 < sample <= 1) or approximate row count (> 1) for SAMPLE
+    sample: Optional[float] = Field(None, gt=0)
 
 class QueryRequest(BaseModel):
     query: str
 
-def get_clickhouse_client(conn: Optional[ClickHouseConnection] = None):
-    try:
-        if conn:
-            print(f"Connecting to ClickHouse with custom connection: {conn.host}:{conn.port}")
-            client = Client(
-                host=conn.host,
-                port=conn.port,
-                database=conn.database,
-                user=conn.user,
-                password=conn.password
-            )
-        else:
-            print(f"Connecting to ClickHouse with settings: {settings.CLICKHOUSE_HOST}:{settings.CLICKHOUSE_PORT}")
-            client = Client(
-                host=settings.CLICKHOUSE_HOST,
-                port=settings.CLICKHOUSE_PORT,
-                database=settings.CLICKHOUSE_DATABASE,
-                user=settings.CLICKHOUSE_USER,
-                password=settings.CLICKHOUSE_PASSWORD,
-                secure=False  # Disable SSL for local development
-            )
-        # Test the connection
-        client.execute("SELECT 1")
-        print("ClickHouse connection successful")
-        return client
-    except Exception as e:
-        print(f"ClickHouse connection error: {str(e)}")
-        raise HTTPException(status_code=400, detail=str(e))
-
 @router.post("/query")
-async def execute_query(request: QueryRequest):
+async def execute_query(request: QueryRequest, pool: ClickHousePool = Depends(get_clickhouse_pool)):
     try:
-        print(f"Attempting to connect to ClickHouse at {settings.CLICKHOUSE_HOST}:{settings.CLICKHOUSE_PORT}")
-        client = get_clickhouse_client()
-        print(f"Executing query: {request.query}")
-        result = client.execute(request.query)
-        print(f"Query executed successfully, result: {result}")
+        logger.debug("executing query=%s", request.query)
+        result = await run_query(pool, request.query)
+        if not request.query.lstrip().upper().startswith(("SELECT", "SHOW", "DESCRIBE", "WITH")):
+            # Arbitrary statements may create, alter or drop tables
+            metadata_cache.invalidate()
+            preview_cache.invalidate()
+        logger.debug("query returned rows=%s", len(result) if isinstance(result, list) else None)
         return {"data": result}
     except Exception as e:
-        print(f"Error executing query: {str(e)}")
+        logger.warning("query failed error=%s", e)
         raise HTTPException(status_code=400, detail=str(e))
 
 @router.get("/tables")
-async def get_tables():
+async def get_tables(refresh: bool = False, pool: ClickHousePool = Depends(get_clickhouse_pool)):
     try:
-        client = get_clickhouse_client()
-        result = client.execute("SHOW TABLES")
-        return {"tables": [row[0] for row in result]}
+        key = metadata_key("tables")
+        tables = None if refresh else metadata_cache.get(key)
+        if tables is None:
+            result = await run_query(pool, "SHOW TABLES")
+            tables = [row[0] for row in result]
+            metadata_cache.set(key, tables)
+        return {"tables": tables}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 @router.get("/schema/{table_name}")
-async def get_table_schema(table_name: str):
+async def get_table_schema(
+    table_name: str,
+    refresh: bool = False,
+    pool: ClickHousePool = Depends(get_clickhouse_pool)
+):
     try:
-        client = get_clickhouse_client()
-        result = client.execute(f"DESCRIBE TABLE {table_name}")
-        return {"columns": [{"name": row[0], "type": row[1]} for row in result]}
+        key = metadata_key("schema", table_name)
+        columns = None if refresh else metadata_cache.get(key)
+        if columns is None:
+            result = await run_query(pool, f"DESCRIBE TABLE {table_name}")
+            columns = [{"name": row[0], "type": row[1]} for row in result]
+            metadata_cache.set(key, columns)
+        return {"columns": columns}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
-@router.post("/preview")
-async def preview_data(query: MultiTableQuery):
-    try:
-        client = get_clickhouse_client()
-        
-        # Build the query
-        if len(query.tables) == 1:
-            query_str = f"SELECT {', '.join(query.columns)} FROM {query.tables[0]} LIMIT 100"
+def normalize_query(query: MultiTableQuery) -> str:
+    """
+    Canonical text form of a MultiTableQuery, used as a cache key
+    """
+    return json.dumps({
+        "tables": [table.strip() for table in query.tables],
+        "columns": [column.strip() for column in query.columns],
+        "join_conditions": [
+            {name: value.strip() for name, value in condition.items()}
+            for condition in query.join_conditions
+        ],
+        "filters": [f.model_dump() for f in query.filters],
+        "order_by": [o.model_dump() for o in query.order_by],
+        "limit": query.limit,
+        "offset": query.offset,
+        "sample": query.sample,
+    }, sort_keys=True)
+
+def _identifier(name: str) -> str:
+    name = name.strip()
+    if not IDENTIFIER.fullmatch(name):
+        raise ValueError(f"Invalid column name: {name}")
+    return name
+
+def build_where(query: MultiTableQuery) -> Tuple[str, Dict[str, Any]]:
+    """
+    WHERE clause for the query's filters, with every value passed as a `%(pN)s` parameter
+    """
+    conditions, params = [], {}
+
+    def param(value) -> str:
+        name = f"p{len(params)}"
+        # Bool columns compare against 0/1; ClickHouse has no True literal in older versions
+        params[name] = int(value) if isinstance(value, bool) else value
+        return f"%({name})s"
+
+    for f in query.filters:
+        column = _identifier(f.column)
+        operator = f.operator.strip().upper()
+        if operator not in FILTER_OPERATORS:
+            raise ValueError(f"Unsupported filter operator: {f.operator}")
+        if operator in ("IS NULL", "IS NOT NULL"):
+            conditions.append(f"{column} {operator}")
+        elif operator in ("IN", "NOT IN"):
+            if not isinstance(f.value, list) or not f.value:
+                raise ValueError(f"{operator} needs a non-empty list of values")
+            conditions.append(f"{column} {operator} ({', '.join(param(v) for v in f.value)})")
+        elif operator == "BETWEEN":
+            if not isinstance(f.value, list) or len(f.value) != 2:
+                raise ValueError("BETWEEN needs a list of two values")
+            conditions.append(f"{column} BETWEEN {param(f.value[0])} AND {param(f.value[1])}")
         else:
-            # Build JOIN query
-            join_parts = []
-            for condition in query.join_conditions:
-                join_parts.append(
-                    f"{condition['joinType']} JOIN {condition['rightTable']} "
-                    f"ON {condition['leftTable']}.{condition['leftColumn']} = "
-                    f"{condition['rightTable']}.{condition['rightColumn']}"
-                )
-            query_str = (
-                f"SELECT {', '.join(query.columns)} FROM {query.tables[0]} "
-                f"{' '.join(join_parts)} LIMIT 100"
+            if f.value is None or isinstance(f.value, list):
+                raise ValueError(f"{operator} needs a single value")
+            conditions.append(f"{column} {operator} {param(f.value)}")
+
+    return (f" WHERE {' AND '.join(conditions)}" if conditions else ""), params
+
+def build_query(query: MultiTableQuery, max_rows: Optional[int] = None) -> Tuple[str, Optional[Dict[str, Any]]]:
+    """
+    Build the SELECT (with optional JOINs) described by a MultiTableQuery.
+
+    Filters, ordering, LIMIT/OFFSET and SAMPLE are pushed down to ClickHouse.
+    Returns the SQL and its parameters; pass both to the driver, or use
+    `render_query` where plain SQL is needed. `max_rows` caps the LIMIT.
+    """
+    sql = f"SELECT {', '.join(query.columns)} FROM {query.tables[0]}"
+    if query.sample is not None:
+        # SAMPLE needs a table with a sampling key; the value is validated by the model
+        sql += f" SAMPLE {query.sample:g}"
+
+    if len(query.tables) > 1:
+        # Build JOIN query
+        join_parts = []
+        for condition in query.join_conditions:
+            join_parts.append(
+                f"{condition['joinType']} JOIN {condition['rightTable']} "
+                f"ON {condition['leftTable']}.{condition['leftColumn']} = "
+                f"{condition['rightTable']}.{condition['rightColumn']}"
             )
-        
-        result = client.execute(query_str)
+        sql += f" {' '.join(join_parts)}"
+
+    where, params = build_where(query)
+    sql += where
+    if query.order_by:
+        sql += " ORDER BY " + ", ".join(
+            f"{_identifier(o.column)} {'DESC' if o.direction.upper() == 'DESC' else 'ASC'}"
+            for o in query.order_by
+        )
+
+    limit = query.limit
+    if max_rows is not None:
+        limit = min(limit, max_rows) if limit is not None else max_rows
+    if limit is not None:
+        sql += f" LIMIT {int(limit)}"
+    if query.offset:
+        sql += f" OFFSET {int(query.offset)}"
+    # No parameters means no %-substitution, so literal % in raw column expressions survives
+    return sql, params or None
+
+def render_query(sql: str, params: Optional[Dict[str, Any]]) -> str:
+    """
+    Inline escaped parameters for consumers that take plain SQL (HTTP interface, worker processes, jobs)
+    """
+    return sql % escape_params(params, None) if params else sql
+
+def is_filtered(query: MultiTableQuery) -> bool:
+    return bool(query.filters or query.limit is not None or query.offset or query.sample is not None)
+
+async def count_rows(pool: ClickHousePool, query: MultiTableQuery) -> int:
+    """
+    Exact row count of the query result, computed by ClickHouse
+    """
+    sql, params = build_query(query)
+    result = await run_query(pool, f"SELECT count() FROM ({sql})", params)
+    return result[0][0]
+
+async def estimate_rows(pool: ClickHousePool, table: str) -> int:
+    """
+    Approximate row count of a table from its active parts, without scanning data
+    """
+    database, _, name = table.rpartition(".")
+    result = await run_query(
+        pool,
+        "SELECT sum(rows) FROM system.parts WHERE active "
+        "AND database = if(%(database)s = '', currentDatabase(), %(database)s) "
+        "AND table = %(table)s",
+        {"database": database, "table": name}
+    )
+    return result[0][0]
+
+@router.post("/preview")
+async def preview_data(
+    query: MultiTableQuery,
+    refresh: bool = False,
+    pool: ClickHousePool = Depends(get_clickhouse_pool)
+):
+    try:
+        key = preview_key(query.tables, normalize_query(query))
+        result = None if refresh else preview_cache.get(key)
+        if result is None:
+            sql, params = build_query(query, max_rows=100)
+            result = await run_query(pool, sql, params)
+            preview_cache.set(key, result)
         return {
             "data": result,
             "count": len(result)
@@ -114,51 +245,129 @@ async def preview_data(query: MultiTableQuery):
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+@router.post("/count")
+async def count_query(query: MultiTableQuery, pool: ClickHousePool = Depends(get_clickhouse_pool)):
+    """
+    Number of rows the query would export, with its filters applied by ClickHouse
+    """
+    try:
+        return {"count": await count_rows(pool, query)}
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @router.post("/export")
-async def export_to_flatfile(query: MultiTableQuery):
+async def export_to_flatfile(
+    query: MultiTableQuery,
+    format: str = "ndjson",
+    framing: str = "row",
+    estimate: bool = False,
+    parallel: int = 0,
+    shard_key: Optional[str] = None,
+    archive: bool = False,
+    pool: ClickHousePool = Depends(get_clickhouse_pool)
+):
+    """
+    Stream the query result as NDJSON with progress events, or relay one of
+    ClickHouse's own output formats (csv, tsv, parquet, arrow) byte for byte.
+
+    NDJSON uses one line per row by default; `framing=compact` sends the
+    columns once and then one line of row arrays per block.
+    With `estimate=true` the first event carries the row count of the first
+    table taken from `system.parts`, or an exact count() when the query is
+    filtered, limited or sampled. With `parallel=N` (csv or ndjson) the
+    result is split into N `cityHash64(shard_key) % N` slices, hashing the
+    whole row when no `shard_key` is given, exported by
+    worker processes, then concatenated in shard order or, with
+    `archive=true`, returned as one zip member per slice. Shards cannot keep
+    a global order or row window, so `parallel` rejects order_by, limit and
+    offset.
+    """
     try:
-        client = get_clickhouse_client()
-        
-        # Build the query
-        if len(query.tables) == 1:
-            query_str = f"SELECT {', '.join(query.columns)} FROM {query.tables[0]}"
-        else:
-            # Build JOIN query
-            join_parts = []
-            for condition in query.join_conditions:
-                join_parts.append(
-                    f"{condition['joinType']} JOIN {condition['rightTable']} "
-                    f"ON {condition['leftTable']}.{condition['leftColumn']} = "
-                    f"{condition['rightTable']}.{condition['rightColumn']}"
+        sql, params = build_query(query)
+        query_str = render_query(sql, params)
+
+        if parallel > 1:
+            if query.order_by or query.limit is not None or query.offset:
+                raise HTTPException(
+                    status_code=400,
+                    detail="Parallel export cannot apply order_by, limit or offset; export without parallel"
+                )
+            try:
+                body, media_type, suffix = parallel_export(
+                    query_str, parallel, shard_expression(shard_key), format, archive
                 )
-            query_str = (
-                f"SELECT {', '.join(query.columns)} FROM {query.tables[0]} "
-                f"{' '.join(join_parts)}"
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            return StreamingResponse(
+                body,
+                media_type=media_type,
+                headers={"Content-Disposition": f'attachment; filename="export{suffix}"'}
+            )
+
+        if format != "ndjson":
+            if format not in NATIVE_FORMATS:
+                raise HTTPException(status_code=400, detail=f"Unsupported format: {format}")
+            _, media_type, suffix = NATIVE_FORMATS[format]
+            return StreamingResponse(
+                await open_native_stream(query_str, format),
+                media_type=media_type,
+                headers={"Content-Disposition": f'attachment; filename="export{suffix}"'}
             )
         
-        # Get total count for progress tracking
-        count_query = f"SELECT count() FROM ({query_str})"
-        total_count = client.execute(count_query)[0][0]
+        if framing not in NDJSON_FRAMINGS:
+            raise HTTPException(status_code=400, detail=f"Unsupported framing: {framing}")
+
+        # Optional cheap estimate from part metadata instead of a count() over the query
+        estimated_rows = None
+        if estimate:
+            estimated_rows = await (count_rows(pool, query) if is_filtered(query) else estimate_rows(pool, query.tables[0]))
         
-        # Stream the results
+        # Stream the results of a single query, one NDJSON chunk per block; progress
+        # comes from ClickHouse's own progress packets, so the data is only read once
         async def generate():
-            yield json.dumps({"total": total_count, "type": "progress"}) + "\n"
+            yield dumps({"total": estimated_rows, "type": "progress"}) + b"\n"
             
-            batch_size = 1000
-            offset = 0
-            while True:
-                batch_query = f"{query_str} LIMIT {batch_size} OFFSET {offset}"
-                result = client.execute(batch_query)
-                if not result:
-                    break
-                    
-                for row in result:
-                    yield json.dumps({"data": row, "type": "row"}) + "\n"
-                
-                offset += batch_size
-                progress = min(100, int((offset / total_count) * 100))
-                yield json.dumps({"progress": progress, "type": "progress"}) + "\n"
+            sent = 0
+            progress = {}
+            started = time.monotonic()
+            blocks = iter_blocks(pool, sql, params, progress=progress, with_column_types=framing == "compact")
+            if framing == "compact":
+                yield encode_columns(await blocks.__anext__())
+            async for block in blocks:
+                sent += len(block)
+                elapsed = max(time.monotonic() - started, 1e-6)
+                total = progress["total_rows_approx"]
+                with timed("serialize"):
+                    chunk = encode_ndjson(block, framing) + dumps({
+                        "type": "progress",
+                        "progress": min(100, int(progress["rows_read"] * 100 / total)) if total else None,
+                        "rows": sent,
+                        "rows_read": progress["rows_read"],
+                        "bytes_read": progress["bytes_read"],
+                        "total_rows_approx": total,
+                        "rows_per_second": round(progress["rows_read"] / elapsed),
+                        "bytes_per_second": round(progress["bytes_read"] / elapsed),
+                    }) + b"\n"
+                count("exported", rows=len(block), size=len(chunk))
+                yield chunk
+            yield dumps({"progress": 100, "rows": sent, "type": "progress"}) + b"\n"
         
         return StreamingResponse(generate(), media_type="application/x-ndjson")
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e)) 
\ No newline at end of file
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/pool")
+async def pool_stats(pool: ClickHousePool = Depends(get_clickhouse_pool)):
+    """
+    Connection pool usage for monitoring
+    """
+    return pool.stats()
+
+@router.get("/cache")
+async def cache_stats():
+    """
+    Hit/miss counters of the metadata and preview caches for monitoring
+    """
+    return {"metadata": metadata_cache.stats(), "preview": preview_cache.stats()}
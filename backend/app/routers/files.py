@@ -1,14 +1,59 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Response
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Depends, Response
+from fastapi.responses import FileResponse, StreamingResponse
+from starlette.background import BackgroundTask
 import pandas as pd
 import tempfile
 import os
-from typing import List
+import shutil
+import time
+from typing import Dict, List, Optional
+from pydantic import BaseModel, ValidationError
+import logging
 from ..core.auth import get_current_user
-from ..core.clickhouse import get_clickhouse_client
+from ..core.batching import InsertScheduler
+from ..core.cache import invalidate_table
+from ..core.clickhouse import ClickHousePool, get_clickhouse_pool
+from ..core.executor import run_query, run_sync, iter_blocks
+from ..core.export import (
+    ARROW_FORMATS, COMPRESSIONS, NATIVE_FORMATS,
+    open_native_stream, stream_arrow, stream_csv
+)
+from ..core.config import settings
+from ..core.dedup import file_digest, find_ingest, record_ingest
+from ..core.ingest import (
+    ARCHIVE_EXTENSIONS, SUPPORTED_EXTENSIONS,
+    ingest_chunks, peek_schema, read_chunks, read_local_chunks, resolve_local_path, spool_files
+)
+from ..core.parallel import ingest_files, parallel_export, shard_expression
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+class ColumnOptions(BaseModel):
+    columns: Optional[List[str]] = None  # Read only these source columns, in this order
+    renames: Dict[str, str] = {}  # Source column name -> table column name
+    types: Dict[str, str] = {}  # Source or table column name -> ClickHouse type
+    delimiter: str = ","  # CSV only
+    encoding: Optional[str] = None  # CSV only
+    sheet: Optional[str] = None  # Excel only: the sheet to read from a multi-sheet workbook
+
+    def read_options(self, filename: str) -> dict:
+        if filename.endswith('.csv'):
+            return {"sep": self.delimiter, "encoding": self.encoding}
+        if filename.endswith(('.xls', '.xlsx')) and self.sheet is not None:
+            return {"sheet_name": self.sheet}
+        return {}
+
+def parse_column_options(options: Optional[str], model=ColumnOptions):
+    """
+    Parse the JSON options form field sent alongside a multipart upload
+    """
+    try:
+        return model.model_validate_json(options or "{}")
+    except ValidationError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @router.get("/test")
 async def test_endpoint():
     """
@@ -20,31 +65,33 @@ async def test_endpoint():
 async def download_file(
     table_name: str,
     format: str = "csv",
-    current_user: str = Depends(get_current_user)
+    compression: Optional[str] = None,
+    native: bool = False,
+    parallel: int = 0,
+    shard_key: Optional[str] = None,
+    archive: bool = False,
+    current_user: str = Depends(get_current_user),
+    pool: ClickHousePool = Depends(get_clickhouse_pool)
 ):
     """
-    Download data from ClickHouse table as a flat file
+    Download data from ClickHouse table as a flat file.
+
+    CSV, Parquet, Arrow IPC and Feather are streamed block by block; CSV can be
+    gzip or zstd compressed on the fly.
+    With `native=true` ClickHouse encodes (and compresses) the file itself and
+    the bytes are relayed as-is; csv, tsv, parquet and arrow are supported.
+    With `parallel=N` a CSV is exported as N hash-sharded slices by worker
+    processes and merged in order, or zipped per slice with `archive=true`.
     """
     try:
-        print(f"Attempting to download table: {table_name} in format: {format}")
-        try:
-            client = get_clickhouse_client()
-            print("ClickHouse client created successfully")
-        except Exception as e:
-            print(f"Error creating ClickHouse client: {str(e)}")
-            raise HTTPException(
-                status_code=500,
-                detail=f"Error connecting to ClickHouse: {str(e)}"
-            )
+        logger.debug("download table=%s format=%s", table_name, format)
         
         # First check if the table exists
         check_table_query = f"SELECT count() FROM system.tables WHERE database = 'default' AND name = '{table_name}'"
-        print(f"Checking table existence with query: {check_table_query}")
         try:
-            table_count = client.execute(check_table_query)[0][0]
-            print(f"Table count result: {table_count}")
+            table_count = (await run_query(pool, check_table_query))[0][0]
         except Exception as e:
-            print(f"Error checking table existence: {str(e)}")
+            logger.error("table existence check failed table=%s error=%s", table_name, e)
             raise HTTPException(
                 status_code=500,
                 detail=f"Error checking table existence: {str(e)}"
@@ -56,14 +103,93 @@ async def download_file(
                 detail=f"Table '{table_name}' not found in database 'default'"
             )
         
-        # Query data from ClickHouse
         query = f"SELECT * FROM {table_name}"
-        print(f"Executing query: {query}")
+        if native:
+            if format not in NATIVE_FORMATS:
+                raise HTTPException(status_code=400, detail="Unsupported format")
+            if compression and compression not in COMPRESSIONS:
+                raise HTTPException(status_code=400, detail=f"Unsupported compression: {compression}")
+            _, media_type, suffix = NATIVE_FORMATS[format]
+            filename = f"{table_name}{suffix}"
+            if compression:
+                suffix, media_type = COMPRESSIONS[compression]
+                filename += suffix
+            logger.debug("relaying native export format=%s query=%s", format, query)
+            return StreamingResponse(
+                await open_native_stream(query, format, compression),
+                media_type=media_type,
+                headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+            )
+
+        if parallel > 1:
+            if format != "csv" or compression:
+                raise HTTPException(status_code=400, detail="Parallel download supports uncompressed csv only")
+            try:
+                body, media_type, suffix = parallel_export(
+                    query, parallel, shard_expression(shard_key), format, archive
+                )
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            return StreamingResponse(
+                body,
+                media_type=media_type,
+                headers={"Content-Disposition": f'attachment; filename="{table_name}{suffix}"'}
+            )
+
+        if format not in ("csv", "xlsx") and format not in ARROW_FORMATS:
+            raise HTTPException(status_code=400, detail="Unsupported format")
+        if compression and (format != "csv" or compression not in COMPRESSIONS):
+            raise HTTPException(status_code=400, detail=f"Unsupported compression: {compression}")
+
+        if format == "csv" or format in ARROW_FORMATS:
+            # Stream straight from the query blocks so nothing is materialized
+            logger.debug("streaming query=%s", query)
+            # Arrow encoders take columns, so their blocks are never transposed into rows
+            blocks = iter_blocks(pool, query, with_column_types=True, columnar=format in ARROW_FORMATS)
+            try:
+                columns = await blocks.__anext__()
+                first_block = await blocks.__anext__()
+            except StopAsyncIteration:
+                await blocks.aclose()
+                raise HTTPException(
+                    status_code=404,
+                    detail=f"No data found in table '{table_name}'"
+                )
+            except Exception as e:
+                logger.error("query failed table=%s error=%s", table_name, e)
+                raise HTTPException(
+                    status_code=500,
+                    detail=f"Error executing query: {str(e)}"
+                )
+
+            async def rows():
+                yield first_block
+                async for block in blocks:
+                    yield block
+
+            if format in ARROW_FORMATS:
+                media_type, suffix = ARROW_FORMATS[format]
+                filename = f"{table_name}{suffix}"
+                body = stream_arrow(rows(), columns, format)
+            else:
+                filename = f"{table_name}.csv"
+                media_type = "application/csv"
+                if compression:
+                    suffix, media_type = COMPRESSIONS[compression]
+                    filename += suffix
+                body = stream_csv(rows(), [name for name, _ in columns], compression)
+            return StreamingResponse(
+                body,
+                media_type=media_type,
+                headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+            )
+
+        # Excel has to be written in one piece, so query the full result
         try:
-            result = client.execute(query)
-            print(f"Query result: {result}")
+            result, columns = await run_query(pool, query, with_column_types=True)
+            logger.debug("query returned rows=%d table=%s", len(result), table_name)
         except Exception as e:
-            print(f"Error executing query: {str(e)}")
+            logger.error("query failed table=%s error=%s", table_name, e)
             raise HTTPException(
                 status_code=500,
                 detail=f"Error executing query: {str(e)}"
@@ -77,34 +203,26 @@ async def download_file(
         
         # Convert to DataFrame
         try:
-            df = pd.DataFrame(result)
-            print(f"DataFrame created with shape: {df.shape}")
+            df = pd.DataFrame(result, columns=[name for name, _ in columns])
         except Exception as e:
-            print(f"Error creating DataFrame: {str(e)}")
+            logger.error("building DataFrame failed table=%s error=%s", table_name, e)
             raise HTTPException(
                 status_code=500,
                 detail=f"Error creating DataFrame: {str(e)}"
             )
         
-        # Create temporary file
+        # Create temporary file, removed once the response has been sent
         try:
             with tempfile.NamedTemporaryFile(delete=False, suffix=f'.{format}') as temp_file:
-                print(f"Creating temporary file: {temp_file.name}")
-                if format == "csv":
-                    df.to_csv(temp_file.name, index=False)
-                elif format == "xlsx":
-                    df.to_excel(temp_file.name, index=False)
-                else:
-                    raise HTTPException(status_code=400, detail="Unsupported format")
-                
-                print(f"File created successfully, returning response")
+                df.to_excel(temp_file.name, index=False)
                 return FileResponse(
                     temp_file.name,
                     filename=f"{table_name}.{format}",
-                    media_type=f"application/{format}"
+                    media_type=f"application/{format}",
+                    background=BackgroundTask(os.unlink, temp_file.name)
                 )
         except Exception as e:
-            print(f"Error creating file: {str(e)}")
+            logger.error("writing file failed table=%s error=%s", table_name, e)
             raise HTTPException(
                 status_code=500,
                 detail=f"Error creating file: {str(e)}"
@@ -113,36 +231,44 @@ async def download_file(
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Error in download_file: {str(e)}")
+        logger.exception("download failed table=%s", table_name)
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/upload")
 async def upload_file(
     file: UploadFile = File(...),
     table_name: str = None,
-    current_user: str = Depends(get_current_user)
+    batch_size: Optional[int] = None,
+    chunk_size: Optional[int] = None,
+    sample_size: Optional[int] = None,
+    dry_run: bool = False,
+    dedup: bool = False,
+    async_insert: Optional[bool] = None,
+    options: Optional[str] = Form(None),
+    current_user: str = Depends(get_current_user),
+    pool: ClickHousePool = Depends(get_clickhouse_pool)
 ):
     """
-    Upload a flat file and insert its contents into ClickHouse
+    Upload a flat file and insert its contents into ClickHouse chunk by chunk.
+
+    With `dry_run=true` only the inferred table schema is returned. With
+    `dedup=true` a file whose content was already ingested into the table is
+    skipped, and each block carries a deduplication token so retrying a
+    partially failed upload does not insert its blocks twice.
+
+    `options` is a JSON form field (see ColumnOptions) selecting which columns
+    are parsed, renaming them and overriding their inferred types.
+    Insert blocks are sized by bytes unless `batch_size` is given, and
+    `async_insert` overrides the INSERT_ASYNC default (blocks sent with a
+    deduplication token are always inserted synchronously); the response
+    reports the throughput of every block.
     """
     try:
-        # Create a temporary file to store the uploaded content
-        with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.filename)[1]) as temp_file:
-            content = await file.read()
-            temp_file.write(content)
-            temp_file_path = temp_file.name
-
-        # Read the file based on its extension
-        if file.filename.endswith('.csv'):
-            df = pd.read_csv(temp_file_path)
-        elif file.filename.endswith(('.xls', '.xlsx')):
-            df = pd.read_excel(temp_file_path)
-        else:
+        column_options = parse_column_options(options)
+        read_options = column_options.read_options(file.filename)
+        if not file.filename.endswith(SUPPORTED_EXTENSIONS):
             raise HTTPException(status_code=400, detail="Unsupported file format")
 
-        # Get ClickHouse client
-        client = get_clickhouse_client()
-
         # If table_name is not provided, use the filename (without extension) as table name
         if not table_name:
             table_name = os.path.splitext(file.filename)[0]
@@ -150,48 +276,174 @@ async def upload_file(
         # Sanitize table name by replacing hyphens with underscores
         table_name = table_name.replace('-', '_')
 
-        # Create table if it doesn't exist
-        columns = []
-        for col in df.columns:
-            # Sanitize column names by replacing spaces and special characters with underscores
-            col_name = col.replace(' ', '_').replace('-', '_')
-            # Try to infer the type from the first non-null value
-            sample = df[col].dropna().iloc[0] if not df[col].isna().all() else None
-            if sample is not None:
-                if isinstance(sample, (int, float)):
-                    col_type = 'Float64'
-                else:
-                    col_type = 'String'
-            else:
-                col_type = 'String'
-            columns.append(f"`{col_name}` {col_type}")
-
-        create_table_query = f"""
-            CREATE TABLE IF NOT EXISTS `{table_name}` (
-                {', '.join(columns)}
-            ) ENGINE = MergeTree()
-            ORDER BY tuple()
-        """
-        client.execute(create_table_query)
-
-        # Insert data
-        for _, row in df.iterrows():
-            values = []
-            for val in row:
-                if pd.isna(val):
-                    values.append('NULL')
-                elif isinstance(val, (int, float)):
-                    values.append(str(val))
-                else:
-                    values.append(f"'{str(val)}'")
-            
-            insert_query = f"INSERT INTO `{table_name}` VALUES ({','.join(values)})"
-            client.execute(insert_query)
-
-        # Clean up
-        os.unlink(temp_file_path)
-
-        return {"message": f"File uploaded and data inserted into table {table_name}"}
+        if dry_run:
+            # Infer the schema from the first chunk without touching ClickHouse
+            def infer():
+                file.file.seek(0)
+                chunks = read_chunks(file.file, file.filename, chunk_size, column_options.columns, **read_options)
+                column_types, _ = peek_schema(chunks, sample_size, column_options.renames, column_options.types)
+                return column_types or {}
+
+            column_types = await run_sync(infer)
+            return {
+                "table_name": table_name,
+                "dry_run": True,
+                "columns": [{"name": name, "type": col_type} for name, col_type in column_types.items()]
+            }
+
+        # Parse the spooled upload incrementally; each block is inserted before the next is read
+        scheduler = InsertScheduler(async_insert)
+
+        def ingest():
+            file_hash = file_digest(file.file) if dedup else None
+            with pool.connection() as client:
+                if dedup:
+                    previous = find_ingest(client, table_name, file_hash)
+                    if previous:
+                        return 0, previous
+                file.file.seek(0)
+                chunks = read_chunks(file.file, file.filename, chunk_size, column_options.columns, **read_options)
+                rows = ingest_chunks(
+                    client, chunks, table_name, batch_size, sample_size, file_hash,
+                    column_options.renames, column_options.types, scheduler
+                )
+                if dedup:
+                    record_ingest(client, table_name, file_hash, file.filename, rows)
+                return rows, None
+
+        rows_inserted, previous = await run_sync(ingest)
+        if previous:
+            return {
+                "message": f"File was already ingested into table {table_name}, skipped",
+                "rows_inserted": 0,
+                "skipped": True,
+                "previous": previous
+            }
+        invalidate_table(table_name)
+
+        return {
+            "message": f"File uploaded and data inserted into table {table_name}",
+            "rows_inserted": rows_inserted,
+            "insert": scheduler.report()
+        }
 
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/upload/batch")
+async def upload_batch(
+    files: List[UploadFile] = File(...),
+    table_name: str = None,
+    chunk_size: Optional[int] = None,
+    sample_size: Optional[int] = None,
+    async_insert: Optional[bool] = None,
+    current_user: str = Depends(get_current_user),
+    pool: ClickHousePool = Depends(get_clickhouse_pool)
+):
+    """
+    Upload many flat files (or zip/tar archives of them) and ingest them in parallel.
+
+    Files are parsed concurrently by worker processes and inserted through a
+    shared bounded queue. Each file goes to `table_name` when given, otherwise
+    to a table named after the file. Returns per-file row counts and timings.
+    """
+    try:
+        for file in files:
+            if not file.filename.endswith(SUPPORTED_EXTENSIONS + ARCHIVE_EXTENSIONS):
+                raise HTTPException(status_code=400, detail=f"Unsupported file format: {file.filename}")
+
+        scheduler = InsertScheduler(async_insert)
+
+        def ingest():
+            entries = []
+            directory = tempfile.mkdtemp(dir=settings.EXPORT_TEMP_DIR)
+            try:
+                for file in files:
+                    file.file.seek(0)
+                    entries.extend(spool_files(file.file, file.filename, directory))
+                targets = [
+                    (name, path, (table_name or os.path.splitext(name)[0]).replace('-', '_'))
+                    for name, path in entries
+                ]
+                started = time.monotonic()
+                stats = ingest_files(pool, targets, chunk_size, sample_size, scheduler)
+                return stats, time.monotonic() - started
+            finally:
+                shutil.rmtree(directory, ignore_errors=True)
+
+        stats, elapsed = await run_sync(ingest)
+        for table in {entry["table"] for entry in stats}:
+            invalidate_table(table)
+
+        return {
+            "files": stats,
+            "rows_inserted": sum(entry["rows"] for entry in stats),
+            "failed": sum(1 for entry in stats if entry["error"]),
+            "seconds": round(elapsed, 3),
+            "insert": scheduler.report()
+        }
+
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e)) 
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+class LocalIngestRequest(ColumnOptions):
+    path: str  # Relative to LOCAL_INGEST_ROOT
+    table_name: Optional[str] = None
+    batch_size: Optional[int] = None
+    chunk_size: Optional[int] = None
+    sample_size: Optional[int] = None
+    async_insert: Optional[bool] = None
+
+@router.post("/ingest/local")
+async def ingest_local_file(
+    request: LocalIngestRequest,
+    current_user: str = Depends(get_current_user),
+    pool: ClickHousePool = Depends(get_clickhouse_pool)
+):
+    """
+    Ingest a file that already sits on the backend host or a mounted volume.
+
+    The file is memory-mapped and parsed in place, skipping the multipart
+    upload and its temp-file copy. Paths are resolved inside LOCAL_INGEST_ROOT.
+    """
+    try:
+        path = resolve_local_path(request.path)
+        if not path.endswith(SUPPORTED_EXTENSIONS):
+            raise HTTPException(status_code=400, detail="Unsupported file format")
+        table_name = (request.table_name or os.path.splitext(os.path.basename(path))[0]).replace('-', '_')
+        scheduler = InsertScheduler(request.async_insert)
+
+        def ingest():
+            chunks = read_local_chunks(
+                path,
+                request.chunk_size,
+                columns=request.columns,
+                delimiter=request.delimiter,
+                encoding=request.encoding
+            )
+            with pool.connection() as client:
+                return ingest_chunks(
+                    client, chunks, table_name, request.batch_size, request.sample_size,
+                    renames=request.renames, types=request.types, scheduler=scheduler
+                )
+
+        rows_inserted = await run_sync(ingest)
+        invalidate_table(table_name)
+        return {
+            "message": f"File {request.path} inserted into table {table_name}",
+            "rows_inserted": rows_inserted,
+            "insert": scheduler.report()
+        }
+
+    except PermissionError as e:
+        raise HTTPException(status_code=403, detail=str(e))
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
@@ -1,22 +1,41 @@
-from fastapi import APIRouter, HTTPException, UploadFile, File
+from fastapi import APIRouter, HTTPException, UploadFile, File, Form, Depends
 from typing import List, Optional
 import pandas as pd
 import io
-from pydantic import BaseModel
+from ..core.auth import get_current_user
+from ..core.batching import InsertScheduler
+from ..core.cache import invalidate_table
+from ..core.clickhouse import ClickHousePool, get_clickhouse_pool
+from ..core.executor import run_sync
+from ..core.ingest import SUPPORTED_EXTENSIONS, read_chunks, ingest_chunks
+from .files import ColumnOptions, parse_column_options
 
 router = APIRouter()
 
-class FileIngestionRequest(BaseModel):
-    columns: List[str]
-    delimiter: str = ","
+class FileIngestionRequest(ColumnOptions):
     table_name: str
+    batch_size: Optional[int] = None
+    chunk_size: Optional[int] = None
+    sample_size: Optional[int] = None
+    async_insert: Optional[bool] = None
 
-@router.post("/upload")
-async def upload_file(file: UploadFile = File(...)):
+@router.post("/columns")
+async def list_columns(
+    file: UploadFile = File(...),
+    delimiter: str = ",",
+    sheet: Optional[str] = None,
+    current_user: str = Depends(get_current_user)
+):
+    """
+    Return the column names of an upload, read from its header only
+    """
     try:
-        contents = await file.read()
-        df = pd.read_csv(io.StringIO(contents.decode('utf-8')))
-        return {"message": "File uploaded successfully", "columns": df.columns.tolist()}
+        if file.filename.endswith('.csv'):
+            df = pd.read_csv(file.file, sep=delimiter, nrows=0)
+        else:
+            read_options = ColumnOptions(sheet=sheet).read_options(file.filename)
+            df = next(read_chunks(file.file, file.filename, chunk_size=1, **read_options), pd.DataFrame())
+        return {"columns": [str(col) for col in df.columns]}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
@@ -34,23 +53,49 @@ async def download_file(data: List[dict]):
 @router.post("/ingest")
 async def ingest_to_clickhouse(
     file: UploadFile = File(...),
-    request: FileIngestionRequest = None
+    request: str = Form(...),
+    current_user: str = Depends(get_current_user),
+    pool: ClickHousePool = Depends(get_clickhouse_pool)
 ):
+    """
+    Ingest only the selected columns of an upload into a ClickHouse table.
+
+    `request` is a JSON form field (see FileIngestionRequest). Unselected
+    columns are skipped by the parser and never converted or sent.
+    """
     try:
-        contents = await file.read()
-        df = pd.read_csv(
-            io.StringIO(contents.decode('utf-8')),
-            usecols=request.columns,
-            delimiter=request.delimiter
-        )
-        
-        # Here you would implement the actual ingestion to ClickHouse
-        # This is a placeholder for the actual implementation
+        options = parse_column_options(request, FileIngestionRequest)
+        if not file.filename.endswith(SUPPORTED_EXTENSIONS):
+            raise HTTPException(status_code=400, detail="Unsupported file format")
+        table_name = options.table_name.replace('-', '_')
+        scheduler = InsertScheduler(options.async_insert)
+
+        # Parse and insert the spooled upload chunk by chunk to keep memory bounded
+        def ingest():
+            file.file.seek(0)
+            chunks = read_chunks(
+                file.file,
+                file.filename,
+                options.chunk_size,
+                options.columns,
+                **options.read_options(file.filename)
+            )
+            with pool.connection() as client:
+                return ingest_chunks(
+                    client, chunks, table_name, options.batch_size, options.sample_size,
+                    renames=options.renames, types=options.types, scheduler=scheduler
+                )
+
+        rows_processed = await run_sync(ingest)
+        invalidate_table(table_name)
         return {
             "status": "success",
-            "rows_processed": len(df),
-            "columns": request.columns
+            "rows_processed": rows_processed,
+            "columns": options.columns,
+            "insert": scheduler.report()
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
@@ -0,0 +1,178 @@
+from fastapi import APIRouter, UploadFile, File, HTTPException, Depends
+from fastapi.responses import FileResponse
+from typing import Optional
+import os
+import shutil
+from ..core.auth import get_current_user
+from ..core.executor import run_sync
+from ..core.ingest import SUPPORTED_EXTENSIONS
+from ..core.jobs import FINISHED_STATES, JobManager, get_job_manager
+from .clickhouse import MultiTableQuery, build_query, render_query
+
+router = APIRouter()
+
+JOB_EXPORT_FORMATS = {
+    "csv": ("text/csv", ".csv"),
+    "ndjson": ("application/x-ndjson", ".ndjson"),
+}
+
+
+def describe(job: dict) -> dict:
+    """
+    Public view of a job record; internal parameters and checkpoints stay server-side
+    """
+    return {
+        "id": job["id"],
+        "kind": job["kind"],
+        "status": job["status"],
+        "progress": job["progress"],
+        "result": job["result"],
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+    }
+
+
+def owned_job(manager: JobManager, job_id: str, current_user: str) -> dict:
+    job = manager.store.get(job_id)
+    if job is None or job["owner"] != current_user:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@router.post("/ingest")
+async def submit_ingest(
+    file: UploadFile = File(...),
+    table_name: str = None,
+    batch_size: Optional[int] = None,
+    chunk_size: Optional[int] = None,
+    sample_size: Optional[int] = None,
+    dedup: bool = False,
+    async_insert: Optional[bool] = None,
+    current_user: str = Depends(get_current_user),
+    manager: JobManager = Depends(get_job_manager)
+):
+    """
+    Queue an upload for background ingestion and return the job to poll
+    """
+    if not file.filename.endswith(SUPPORTED_EXTENSIONS):
+        raise HTTPException(status_code=400, detail="Unsupported file format")
+
+    table_name = (table_name or os.path.splitext(file.filename)[0]).replace('-', '_')
+    path = manager.path_for(os.urandom(8).hex(), os.path.splitext(file.filename)[1])
+
+    def save():
+        file.file.seek(0)
+        with open(path, "wb") as out:
+            shutil.copyfileobj(file.file, out)
+
+    try:
+        await run_sync(save)
+        job = manager.submit("ingest", {
+            "path": path,
+            "filename": file.filename,
+            "table_name": table_name,
+            "batch_size": batch_size,
+            "chunk_size": chunk_size,
+            "sample_size": sample_size,
+            "dedup": dedup,
+            "async_insert": async_insert,
+        }, owner=current_user)
+        return describe(job)
+    except Exception as e:
+        if os.path.exists(path):
+            os.unlink(path)
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/export")
+async def submit_export(
+    query: MultiTableQuery,
+    format: str = "csv",
+    current_user: str = Depends(get_current_user),
+    manager: JobManager = Depends(get_job_manager)
+):
+    """
+    Queue an export of the query result to a file fetched later from `/jobs/{id}/result`.
+
+    An interrupted export resumes after its last flushed block only when the
+    query has an `order_by` that sorts the rows uniquely; otherwise it
+    starts over.
+    """
+    if format not in JOB_EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported format: {format}")
+    try:
+        path = manager.path_for(os.urandom(8).hex(), JOB_EXPORT_FORMATS[format][1])
+        job = manager.submit("export", {
+            "query": render_query(*build_query(query)),
+            "ordered": bool(query.order_by),
+            "format": format,
+            "path": path,
+        }, owner=current_user)
+        return describe(job)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.get("")
+async def list_jobs(
+    current_user: str = Depends(get_current_user),
+    manager: JobManager = Depends(get_job_manager)
+):
+    return [describe(job) for job in manager.store.list(owner=current_user)]
+
+
+@router.get("/{job_id}")
+async def get_job(
+    job_id: str,
+    current_user: str = Depends(get_current_user),
+    manager: JobManager = Depends(get_job_manager)
+):
+    return describe(owned_job(manager, job_id, current_user))
+
+
+@router.post("/{job_id}/cancel")
+async def cancel_job(
+    job_id: str,
+    current_user: str = Depends(get_current_user),
+    manager: JobManager = Depends(get_job_manager)
+):
+    """
+    Cancel a queued job, or stop a running one after its current block
+    """
+    owned_job(manager, job_id, current_user)
+    return describe(manager.cancel(job_id))
+
+
+@router.delete("/{job_id}")
+async def delete_job(
+    job_id: str,
+    current_user: str = Depends(get_current_user),
+    manager: JobManager = Depends(get_job_manager)
+):
+    """
+    Forget a finished job and remove its files
+    """
+    job = owned_job(manager, job_id, current_user)
+    if job["status"] not in FINISHED_STATES:
+        raise HTTPException(status_code=409, detail="Cancel the job before deleting it")
+    manager.delete(job_id)
+    return {"message": f"Job {job_id} deleted"}
+
+
+@router.get("/{job_id}/result")
+async def job_result(
+    job_id: str,
+    current_user: str = Depends(get_current_user),
+    manager: JobManager = Depends(get_job_manager)
+):
+    """
+    Download the file written by a completed export, or the summary of any other completed job
+    """
+    job = owned_job(manager, job_id, current_user)
+    if job["status"] != "completed":
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}")
+    if job["kind"] != "export":
+        return job["result"]
+    media_type, suffix = JOB_EXPORT_FORMATS[job["params"]["format"]]
+    return FileResponse(job["params"]["path"], media_type=media_type, filename=f"export-{job_id}{suffix}")
@@ -0,0 +1,108 @@
+from fastapi import APIRouter, HTTPException, Depends
+from fastapi.responses import FileResponse
+from typing import Optional
+import os
+from ..core.auth import get_current_user
+from ..core.clickhouse import ClickHousePool, get_clickhouse_pool
+from ..core.executor import run_sync
+from ..core.export import COMPRESSIONS
+from ..core.sync import SYNC_FORMATS, SyncBusy, load_manifest, reset_sync, sync_dir, sync_table
+
+router = APIRouter()
+
+
+@router.post("/{table_name}")
+async def run_table_sync(
+    table_name: str,
+    column: str,
+    consumer: Optional[str] = None,
+    format: str = "csv",
+    compression: Optional[str] = None,
+    chunk_rows: Optional[int] = None,
+    current_user: str = Depends(get_current_user),
+    pool: ClickHousePool = Depends(get_clickhouse_pool)
+):
+    """
+    Export the rows added to a table since the consumer's last sync.
+
+    `column` is the increasing column the watermark tracks: a strictly
+    increasing id, or an insert time whose most recent rows wait for the
+    next run. New rows are written as chunk files and listed in the
+    consumer's manifest; the response lists only the chunks of this run.
+    `consumer` defaults to the current user.
+    """
+    try:
+        return await run_sync(
+            sync_table, pool, table_name, column, consumer or current_user,
+            format, compression, chunk_rows
+        )
+    except SyncBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/{table_name}/manifest")
+async def get_manifest(
+    table_name: str,
+    consumer: Optional[str] = None,
+    current_user: str = Depends(get_current_user)
+):
+    """
+    The consumer's watermark and every chunk file produced so far
+    """
+    try:
+        manifest = load_manifest(consumer or current_user, table_name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if manifest is None:
+        raise HTTPException(status_code=404, detail="No sync for this table and consumer")
+    return manifest
+
+
+@router.get("/{table_name}/chunks/{chunk_name}")
+async def download_chunk(
+    table_name: str,
+    chunk_name: str,
+    consumer: Optional[str] = None,
+    current_user: str = Depends(get_current_user)
+):
+    """
+    Download one chunk file listed in the consumer's manifest
+    """
+    consumer = consumer or current_user
+    try:
+        manifest = load_manifest(consumer, table_name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if manifest is None or not any(chunk["name"] == chunk_name for chunk in manifest["chunks"]):
+        raise HTTPException(status_code=404, detail="Chunk not found")
+
+    path = os.path.join(sync_dir(consumer, table_name), chunk_name)
+    media_type = next(media for suffix, media in SYNC_FORMATS.values() if suffix in chunk_name)
+    for suffix, compressed_type in COMPRESSIONS.values():
+        if chunk_name.endswith(suffix):
+            media_type = compressed_type
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Chunk file was removed")
+    return FileResponse(path, media_type=media_type, filename=chunk_name)
+
+
+@router.delete("/{table_name}")
+async def delete_sync(
+    table_name: str,
+    consumer: Optional[str] = None,
+    current_user: str = Depends(get_current_user)
+):
+    """
+    Reset the consumer's watermark and remove its chunk files; the next sync starts over
+    """
+    try:
+        removed = await run_sync(reset_sync, consumer or current_user, table_name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not removed:
+        raise HTTPException(status_code=404, detail="No sync for this table and consumer")
+    return {"message": f"Sync of {table_name} reset"}
@@ -0,0 +1,62 @@
+from typing import Dict
+import os
+import numpy as np
+import pandas as pd
+
+# Named dataset sizes accepted by --sizes
+SIZES: Dict[str, int] = {
+    "10k": 10_000,
+    "1m": 1_000_000,
+    "10m": 10_000_000,
+}
+
+FORMATS = ("csv", "parquet")
+
+# Rows generated and written per step, so 10M-row files never sit in memory at once
+_WRITE_CHUNK = 1_000_000
+
+
+def generate(rows: int, offset: int = 0, seed: int = 0) -> pd.DataFrame:
+    """
+    Synthetic rows mixing the column kinds the ingest path cares about:
+    integers, floats, timestamps, low-cardinality strings, booleans and free text
+    """
+    rng = np.random.default_rng(seed + offset)
+    ids = np.arange(offset, offset + rows, dtype=np.int64)
+    return pd.DataFrame({
+        "id": ids,
+        "created_at": pd.Timestamp("2024-01-01") + pd.to_timedelta(ids, unit="s"),
+        "category": rng.choice(["alpha", "beta", "gamma", "delta", "epsilon"], size=rows),
+        "amount": rng.normal(100.0, 25.0, size=rows).round(2),
+        "quantity": rng.integers(0, 1000, size=rows, dtype=np.int32),
+        "active": rng.random(size=rows) < 0.5,
+        "note": np.char.add("note-", (ids % 100_003).astype(str)),
+    })
+
+
+def dataset_path(directory: str, size: str, format: str) -> str:
+    """
+    Create (once) and return the path of a synthetic dataset file
+    """
+    path = os.path.join(directory, f"bench_{size}.{format}")
+    if os.path.exists(path):
+        return path
+
+    os.makedirs(directory, exist_ok=True)
+    rows = SIZES[size]
+    partial = path + ".partial"
+    if format == "csv":
+        for offset in range(0, rows, _WRITE_CHUNK):
+            chunk = generate(min(_WRITE_CHUNK, rows - offset), offset)
+            chunk.to_csv(partial, mode="a" if offset else "w", header=not offset, index=False)
+    else:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        writer = None
+        for offset in range(0, rows, _WRITE_CHUNK):
+            table = pa.Table.from_pandas(generate(min(_WRITE_CHUNK, rows - offset), offset), preserve_index=False)
+            writer = writer or pq.ParquetWriter(partial, table.schema)
+            writer.write_table(table)
+        writer.close()
+    os.replace(partial, path)
+    return path
@@ -0,0 +1,215 @@
+"""
+Throughput benchmarks for the ingest and export endpoints.
+
+Run from the backend directory:
+
+    python -m benchmarks.run --sizes 10k,1m --repeat 5
+    python -m benchmarks.run --stand-in                     # no ClickHouse needed
+    python -m benchmarks.run --base-url http://localhost:8000
+
+By default the FastAPI app runs in-process against the ClickHouse from the
+settings (e.g. the docker-compose service). `--stand-in` swaps the driver
+for an in-memory fake so only the backend's own cost is measured, and
+`--base-url` drives an already running server instead (peak RSS is then
+not available).
+"""
+from typing import Callable, List, Optional
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+import numpy as np
+from .datasets import FORMATS, SIZES, dataset_path
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+# Fewer runs than this leave p99 equal to the slowest one, so it is not reported
+_P99_MIN_SAMPLES = 100
+
+
+def current_rss() -> int:
+    """
+    Resident set size of this process in bytes
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * _PAGE_SIZE
+    except OSError:
+        # ru_maxrss is in KiB on Linux and bytes on macOS; it is only a lifetime peak
+        scale = 1 if sys.platform == "darwin" else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+class PeakRSS:
+    """
+    Sample RSS on a background thread and keep the highest value seen
+    """
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, current_rss())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = current_rss()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+
+
+def measure(name: str, run: Callable[[], int], rows: int, repeat: int, track_rss: bool) -> dict:
+    """
+    Call `run` `repeat` times; it returns the number of bytes moved over HTTP
+    """
+    latencies: List[float] = []
+    moved = 0
+    with PeakRSS() as rss:
+        try:
+            for _ in range(repeat):
+                started = time.perf_counter()
+                moved = run()
+                latencies.append(time.perf_counter() - started)
+        except Exception as e:
+            # Keep going so one broken endpoint does not hide the other numbers
+            return {"benchmark": name, "rows": rows, "error": f"{type(e).__name__}: {e}"}
+    median = float(np.percentile(latencies, 50))
+    return {
+        "benchmark": name,
+        "rows": rows,
+        "rows_per_second": round(rows / median) if median else None,
+        "mb_per_second": round(moved / median / 1e6, 2) if median else None,
+        "peak_rss_mb": round(rss.peak / 1e6, 1) if track_rss else None,
+        "p50_ms": round(median * 1000, 1),
+        "p99_ms": round(float(np.percentile(latencies, 99)) * 1000, 1) if len(latencies) >= _P99_MIN_SAMPLES else None,
+        "error": None,
+    }
+
+
+def make_client(base_url: Optional[str], stand_in: bool, accept_encoding: str):
+    if base_url:
+        import httpx
+        client = httpx.Client(base_url=base_url, timeout=None)
+    else:
+        if stand_in:
+            from .standin import install
+            install()
+        from fastapi.testclient import TestClient
+        from app.main import app
+        client = TestClient(app)
+        client.__enter__()
+
+    # httpx offers gzip (and br) by default, which would silently benchmark compression
+    client.headers["Accept-Encoding"] = accept_encoding
+    response = client.post("/api/auth/token", data={"username": "admin", "password": "admin"})
+    response.raise_for_status()
+    client.headers["Authorization"] = f"Bearer {response.json()['access_token']}"
+    return client
+
+
+def streamed_bytes(response) -> int:
+    # Bytes on the wire, so a compressed response counts at its encoded size
+    response.raise_for_status()
+    return sum(len(chunk) for chunk in response.iter_raw())
+
+
+def run_suite(client, sizes: List[str], formats: List[str], repeat: int, data_dir: str, track_rss: bool) -> List[dict]:
+    results = []
+    for size in sizes:
+        rows = SIZES[size]
+        for format in formats:
+            path = dataset_path(data_dir, size, format)
+            table = f"bench_{size}_{format}"
+
+            def upload() -> int:
+                client.post("/api/clickhouse/query", json={"query": f"DROP TABLE IF EXISTS {table}"})
+                with open(path, "rb") as source:
+                    response = client.post(
+                        "/api/flatfile/upload",
+                        params={"table_name": table},
+                        files={"file": (os.path.basename(path), source)}
+                    )
+                response.raise_for_status()
+                return os.path.getsize(path)
+
+            results.append(measure(f"upload {format} {size}", upload, rows, repeat, track_rss))
+
+        # Read-side benchmarks use the table loaded from the last format
+        query = {"tables": [table], "columns": ["*"]}
+
+        def download() -> int:
+            with client.stream("GET", f"/api/flatfile/download/{table}", params={"format": "csv"}) as response:
+                return streamed_bytes(response)
+
+        def export() -> int:
+            with client.stream("POST", "/api/clickhouse/export", json=query) as response:
+                return streamed_bytes(response)
+
+        def preview() -> int:
+            response = client.post("/api/clickhouse/preview", params={"refresh": True}, json=query)
+            response.raise_for_status()
+            return len(response.content)
+
+        results.append(measure(f"download csv {size}", download, rows, repeat, track_rss))
+        results.append(measure(f"export ndjson {size}", export, rows, repeat, track_rss))
+        results.append(measure(f"preview {size}", preview, min(rows, 100), repeat, track_rss))
+    return results
+
+
+def print_table(results: List[dict]):
+    headers = ["benchmark", "rows", "rows_per_second", "mb_per_second", "peak_rss_mb", "p50_ms", "p99_ms", "error"]
+    widths = {h: max(len(h), *(len(str(r.get(h, ""))) for r in results)) for h in headers}
+    print("  ".join(h.ljust(widths[h]) for h in headers))
+    for result in results:
+        print("  ".join(str(result.get(h, "")).ljust(widths[h]) for h in headers))
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="10k", help=f"comma-separated subset of {', '.join(SIZES)}")
+    parser.add_argument("--formats", default=",".join(FORMATS), help="comma-separated upload formats")
+    parser.add_argument("--repeat", type=int, default=3, help=f"runs per benchmark; p99 needs at least {_P99_MIN_SAMPLES}")
+    parser.add_argument("--accept-encoding", default="identity", help="Accept-Encoding sent with every request")
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "cookiedata-bench"))
+    parser.add_argument("--stand-in", action="store_true", help="use the in-memory ClickHouse stand-in")
+    parser.add_argument("--base-url", help="benchmark a running server instead of the in-process app")
+    parser.add_argument("--json", dest="json_path", help="also write results to this file")
+    args = parser.parse_args(argv)
+
+    sizes = [size.strip().lower() for size in args.sizes.split(",")]
+    formats = [format.strip().lower() for format in args.formats.split(",")]
+    unknown = [s for s in sizes if s not in SIZES] + [f for f in formats if f not in FORMATS]
+    if unknown:
+        parser.error(f"unknown size or format: {', '.join(unknown)}")
+
+    client = make_client(args.base_url, args.stand_in, args.accept_encoding)
+    try:
+        results = run_suite(client, sizes, formats, args.repeat, args.data_dir, track_rss=not args.base_url)
+    finally:
+        if hasattr(client, "__exit__"):
+            client.__exit__(None, None, None)
+
+    for result in results:
+        result["accept_encoding"] = args.accept_encoding
+    print(f"Accept-Encoding: {args.accept_encoding}")
+    print_table(results)
+    if args.json_path:
+        with open(args.json_path, "w") as out:
+            json.dump(results, out, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+from itertools import islice
+from typing import Dict, List, Tuple
+import re
+import threading
+
+_lock = threading.Lock()
+# name -> (columns as (name, type) pairs, one value list per column)
+_tables: Dict[str, Tuple[List[Tuple[str, str]], List[list]]] = {}
+
+
+def _name(identifier: str) -> str:
+    return identifier.strip("`").rpartition(".")[2]
+
+
+class StandInClient:
+    """
+    In-memory replacement for clickhouse_driver.Client.
+
+    It understands just the statements the API sends during a benchmark
+    (CREATE, columnar INSERT, plain SELECT with an optional LIMIT and the
+    system table lookups), so runs measure the backend's own parsing,
+    conversion and serialization cost without a ClickHouse server.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.last_query = None
+
+    def disconnect(self):
+        pass
+
+    def execute(self, query, params=None, with_column_types=False, columnar=False, settings=None, **kwargs):
+        sql = " ".join(query.split())
+        upper = sql.upper()
+        if upper.startswith("CREATE TABLE"):
+            match = re.match(r"CREATE TABLE (?:IF NOT EXISTS )?(\S+) \((.*)\) ENGINE", sql)
+            columns = re.findall(r"`([^`]+)` ([^,]+(?:\([^)]*\))?)", match.group(2))
+            with _lock:
+                _tables.setdefault(_name(match.group(1)), ([(n, t.strip()) for n, t in columns], [[] for _ in columns]))
+            return []
+        if upper.startswith("INSERT INTO"):
+            table = _tables.get(_name(sql.split()[2]))
+            if table is not None and params:
+                data = params if columnar else list(zip(*params))
+                with _lock:
+                    for values, new in zip(table[1], data):
+                        # use_numpy blocks hold arrays; keep Python values like the driver returns
+                        values.extend(new.tolist() if hasattr(new, "tolist") else new)
+            return []
+        if upper.startswith(("ALTER", "DROP", "TRUNCATE")):
+            if upper.startswith("DROP"):
+                with _lock:
+                    _tables.pop(_name(sql.split()[-1]), None)
+            return []
+        if "SYSTEM.TABLES" in upper:
+            name = re.search(r"name = '([^']+)'", sql)
+            return [(int(name is not None and name.group(1) in _tables),)]
+        if "SYSTEM.PARTS" in upper:
+            table = _tables.get((params or {}).get("table", ""))
+            return [(len(table[1][0]) if table and table[1] else 0,)]
+        if upper == "SHOW TABLES":
+            return [(name,) for name in sorted(_tables)]
+        if upper.startswith("DESCRIBE"):
+            table = _tables.get(_name(sql.split()[-1]), ([], []))
+            return [(name, col_type, "", "", "", "", "") for name, col_type in table[0]]
+        if upper.startswith("SELECT") and " FROM " not in upper:
+            return [(1,)]
+
+        rows, columns = self._select(sql)
+        rows = list(rows)
+        return (rows, columns) if with_column_types else rows
+
+    def execute_iter(self, query, params=None, with_column_types=False, settings=None, **kwargs):
+        rows, columns = self._select(" ".join(query.split()))
+        if with_column_types:
+            yield columns
+        yield from rows
+
+    def _select(self, sql: str):
+        match = re.match(r"SELECT (.*?) FROM (\S+)", sql, re.IGNORECASE)
+        if not match:
+            return iter(()), []
+        names, table = match.group(1), _tables.get(_name(match.group(2)))
+        if table is None:
+            return iter(()), []
+        columns, values = table
+        if names.strip() != "*":
+            wanted = [_name(name.strip()) for name in names.split(",")]
+            indices = [i for i, (name, _) in enumerate(columns) if name in wanted]
+            columns, values = [columns[i] for i in indices], [values[i] for i in indices]
+        limit = re.search(r"LIMIT (\d+)\s*$", sql, re.IGNORECASE)
+        rows = zip(*values)
+        return (islice(rows, int(limit.group(1))) if limit else rows), columns
+
+
+def install():
+    """
+    Route every ClickHouse client the app creates to the in-memory stand-in
+    """
+    import app.core.clickhouse
+    app.core.clickhouse.Client = StandInClient
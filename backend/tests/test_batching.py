@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+import pytest
+from clickhouse_driver.errors import ErrorCodes, ServerException
+from app.core.batching import InsertScheduler
+from app.core.config import settings
+
+
+class FlakyClient:
+    """
+    Rejects the first `failures` inserts with `code` and records every attempt
+    """
+
+    def __init__(self, failures=0, code=ErrorCodes.TOO_MANY_PARTS):
+        self.failures = failures
+        self.code = code
+        self.attempts = []
+
+    def execute(self, query, data, columnar=False, settings=None):
+        self.attempts.append(settings)
+        if len(self.attempts) <= self.failures:
+            raise ServerException("Too many parts", code=self.code)
+
+
+def scheduler(**kwargs) -> InsertScheduler:
+    scheduler = InsertScheduler(**kwargs)
+    scheduler.block_rows = lambda df: 10
+    scheduler.pauses = []
+    scheduler._pause = scheduler.pauses.append
+    return scheduler
+
+
+def frames(*sizes):
+    start = 0
+    for size in sizes:
+        yield pd.DataFrame({"id": range(start, start + size)})
+        start += size
+
+
+def test_coalesce_regroups_chunks_into_whole_blocks():
+    blocks = list(scheduler().coalesce(frames(3, 4, 5, 25, 2)))
+    assert [len(block) for block in blocks] == [10, 10, 10, 9]
+    assert pd.concat(blocks)["id"].tolist() == list(range(39))
+
+
+def test_coalesce_passes_exact_blocks_through():
+    assert [len(block) for block in scheduler().coalesce(frames(10, 10))] == [10, 10]
+    assert list(scheduler().coalesce(frames())) == []
+
+
+def test_too_many_parts_is_retried_with_backoff(monkeypatch):
+    monkeypatch.setattr(settings, "INSERT_RETRY_SECONDS", 0.5)
+    client = FlakyClient(failures=3)
+    insert = scheduler()
+    insert.insert(client, "INSERT INTO t VALUES", [np.arange(3)], rows=3, size=24)
+
+    assert len(client.attempts) == 4
+    assert insert.pauses == [0.5, 1.0, 2.0]
+    assert insert.retries == 3
+    assert insert.report()["blocks"] == 1
+
+
+def test_retries_give_up_after_the_limit(monkeypatch):
+    monkeypatch.setattr(settings, "INSERT_MAX_RETRIES", 2)
+    client = FlakyClient(failures=5)
+    with pytest.raises(ServerException):
+        scheduler().insert(client, "INSERT INTO t VALUES", [[1]], rows=1, size=8)
+    assert len(client.attempts) == 3
+
+
+def test_other_server_errors_are_not_retried():
+    client = FlakyClient(failures=1, code=ErrorCodes.UNKNOWN_TABLE)
+    with pytest.raises(ServerException):
+        scheduler().insert(client, "INSERT INTO t VALUES", [[1]], rows=1, size=8)
+    assert len(client.attempts) == 1
+
+
+def test_deduplicated_blocks_are_never_inserted_asynchronously():
+    client = FlakyClient()
+    insert = scheduler(async_insert=True)
+    insert.insert(client, "INSERT INTO t VALUES", [[1]], rows=1, size=8)
+    insert.insert(client, "INSERT INTO t VALUES", [[1]], rows=1, size=8, insert_settings={"insert_deduplication_token": "f:0:x"})
+
+    assert client.attempts[0] == {"async_insert": 1, "wait_for_async_insert": 1}
+    assert client.attempts[1] == {"insert_deduplication_token": "f:0:x", "async_insert": 0}
@@ -0,0 +1,77 @@
+import pytest
+from app.core import cache
+from app.core.cache import TTLCache, invalidate_table, metadata_cache, metadata_key, preview_cache, preview_key
+from app.core.clickhouse import ClickHouseConnection
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    lru = TTLCache(max_size=2, ttl=60)
+    lru.set("a", 1)
+    lru.set("b", 2)
+    assert lru.get("a") == 1  # "b" is now the least recently used
+    lru.set("c", 3)
+
+    assert lru.get("b") is None
+    assert (lru.get("a"), lru.get("c")) == (1, 3)
+    assert lru.stats()["size"] == 2
+
+
+def test_entries_expire_after_ttl(clock):
+    ttl = TTLCache(max_size=10, ttl=30)
+    ttl.set("a", [1, 2])
+    clock[0] += 30
+    assert ttl.get("a") == [1, 2]
+    clock[0] += 1
+    assert ttl.get("a", "gone") == "gone"
+    assert ttl.stats() == {"size": 0, "max_size": 10, "ttl": 30, "hits": 1, "misses": 1}
+
+
+def test_setting_again_refreshes_the_expiry(clock):
+    ttl = TTLCache(max_size=10, ttl=30)
+    ttl.set("a", 1)
+    clock[0] += 20
+    ttl.set("a", 2)
+    clock[0] += 20
+    assert ttl.get("a") == 2
+
+
+def test_invalidate_by_predicate():
+    entries = TTLCache(max_size=10, ttl=60)
+    for key in ("t1", "t2", "u1"):
+        entries.set(key, key)
+    entries.invalidate(lambda key: key.startswith("t"))
+    assert [entries.get(key) for key in ("t1", "t2", "u1")] == [None, None, "u1"]
+    entries.invalidate()
+    assert entries.stats()["size"] == 0
+
+
+def test_keys_separate_connection_profiles():
+    other = ClickHouseConnection(host="other", port=9000, database="db", user="u", password="p")
+    assert metadata_key("schema", "t") != metadata_key("schema", "t", conn=other)
+    assert metadata_key("schema", "t", conn=other)[1:] == ("db", "schema", "t")
+    assert preview_key([" t "], "q") == preview_key(["t"], "q")
+
+
+def test_invalidate_table_drops_only_its_entries():
+    metadata_cache.invalidate()
+    preview_cache.invalidate()
+    metadata_cache.set(metadata_key("tables"), ["events", "users"])
+    metadata_cache.set(metadata_key("schema", "events"), [("id", "UInt64")])
+    metadata_cache.set(metadata_key("schema", "users"), [("id", "UInt64")])
+    preview_cache.set(preview_key(["db.events", "users"], "q1"), "joined")
+    preview_cache.set(preview_key(["users"], "q2"), "users only")
+
+    invalidate_table("events")
+
+    assert metadata_cache.get(metadata_key("tables")) is None
+    assert metadata_cache.get(metadata_key("schema", "events")) is None
+    assert metadata_cache.get(metadata_key("schema", "users")) == [("id", "UInt64")]
+    assert preview_cache.get(preview_key(["db.events", "users"], "q1")) is None
+    assert preview_cache.get(preview_key(["users"], "q2")) == "users only"
@@ -0,0 +1,98 @@
+import asyncio
+import gzip
+import zlib
+import brotli
+import zstandard
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
+from fastapi.testclient import TestClient
+from app.core.compression import CompressionMiddleware, available_encodings, negotiate
+
+BODY = "row,value\n" * 500
+
+app = FastAPI()
+app.add_middleware(CompressionMiddleware)
+
+
+@app.get("/text")
+def text():
+    return PlainTextResponse(BODY)
+
+
+@app.get("/small")
+def small():
+    return PlainTextResponse("ok")
+
+
+@app.get("/zip")
+def archive():
+    return PlainTextResponse(BODY, media_type="application/zip")
+
+
+def raw_get(path: str, accept_encoding: str):
+    # Stream the response so the client does not decode it
+    client = TestClient(app)
+    with client.stream("GET", path, headers={"Accept-Encoding": accept_encoding}) as response:
+        chunks = list(response.iter_raw())
+    return response, chunks
+
+
+def test_negotiate_follows_server_preference_and_quality():
+    offered = ["zstd", "gzip", "br"]
+    assert negotiate("gzip, deflate, br", offered) == "gzip"
+    assert negotiate("br, zstd", offered) == "zstd"
+    assert negotiate("gzip;q=0, br", offered) == "br"
+    assert negotiate("*", offered) == "zstd"
+    assert negotiate("identity", offered) is None
+    assert negotiate("gzip;q=bad", offered) is None
+
+
+def test_brotli_is_ranked_below_gzip_by_default():
+    assert available_encodings() == ["zstd", "gzip", "br"]
+
+
+def test_responses_are_compressed_as_negotiated():
+    response, chunks = raw_get("/text", "gzip, deflate, br")
+    assert response.headers["content-encoding"] == "gzip"
+    assert "content-length" not in response.headers
+    assert "Accept-Encoding" in response.headers["vary"]
+    assert gzip.decompress(b"".join(chunks)).decode() == BODY
+
+    response, chunks = raw_get("/text", "zstd")
+    assert zstandard.ZstdDecompressor().decompressobj().decompress(b"".join(chunks)).decode() == BODY
+
+    response, chunks = raw_get("/text", "br")
+    assert brotli.decompress(b"".join(chunks)).decode() == BODY
+
+
+def test_small_and_compressed_bodies_are_sent_as_is():
+    for path in ("/small", "/zip"):
+        response, chunks = raw_get(path, "gzip")
+        assert "content-encoding" not in response.headers
+    assert b"".join(raw_get("/text", "identity")[1]).decode() == BODY
+
+
+def test_each_streamed_block_is_decodable_on_arrival():
+    blocks = [(f"block {i}\n" * 100).encode() for i in range(3)]
+
+    async def streaming_app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"text/csv")]})
+        for i, block in enumerate(blocks):
+            await send({"type": "http.response.body", "body": block, "more_body": i < len(blocks) - 1})
+
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "headers": [(b"accept-encoding", b"gzip")]}
+    asyncio.run(CompressionMiddleware(streaming_app)(scope, None, send))
+
+    assert (b"content-encoding", b"gzip") in sent[0]["headers"]
+    bodies = [message["body"] for message in sent[1:]]
+    assert len(bodies) == len(blocks)
+    decoder = zlib.decompressobj(wbits=31)
+    # Every block is sync-flushed, so it decodes before the next one is sent
+    for block, body in zip(blocks, bodies):
+        assert decoder.decompress(body) == block
+    assert decoder.eof
@@ -0,0 +1,58 @@
+import hashlib
+import io
+import pandas as pd
+from app.core.batching import InsertScheduler
+from app.core.dedup import block_digest, block_token, enable_block_dedup, file_digest
+from app.core.ingest import insert_dataframe
+
+
+class RecordingClient:
+    def __init__(self):
+        self.queries = []
+        self.settings = []
+
+    def execute(self, query, data=None, columnar=False, settings=None):
+        self.queries.append(" ".join(query.split()))
+        self.settings.append(settings or {})
+        return []
+
+
+def test_block_digest_depends_on_content_not_index():
+    block = pd.DataFrame({"id": [1, 2, 3], "name": ["a", "b", "c"]})
+    assert block_digest(block) == block_digest(block.copy())
+    assert block_digest(block) == block_digest(block.set_axis([10, 11, 12]))
+    assert block_digest(block) != block_digest(block.assign(name=["a", "b", "d"]))
+    assert block_digest(block) != block_digest(block.iloc[::-1])
+
+
+def test_block_token_names_file_offset_and_content():
+    block = pd.DataFrame({"id": [1, 2]})
+    token = block_token("job-1", 20, block)
+    assert token == f"job-1:20:{block_digest(block)}"
+    # The same rows at another offset are a different block of the file
+    assert block_token("job-1", 40, block) != token
+
+
+def test_file_digest_rewinds_the_source():
+    source = io.BytesIO(b"id\n1\n2\n")
+    assert file_digest(source, size=3) == hashlib.sha256(b"id\n1\n2\n").hexdigest()
+    assert source.read() == b"id\n1\n2\n"
+
+
+def test_every_block_carries_its_token():
+    client = RecordingClient()
+    df = pd.DataFrame({"id": range(25)})
+    insert_dataframe(
+        client, "t", df, {"id": "UInt8"}, batch_size=10, dedup_token="abc", offset=100,
+        scheduler=InsertScheduler(async_insert=False)
+    )
+
+    tokens = [settings["insert_deduplication_token"] for settings in client.settings]
+    assert [token.split(":")[:2] for token in tokens] == [["abc", "100"], ["abc", "110"], ["abc", "120"]]
+    assert tokens[0] == block_token("abc", 100, df.iloc[:10])
+
+
+def test_enable_block_dedup_sets_the_window():
+    client = RecordingClient()
+    enable_block_dedup(client, "t")
+    assert client.queries[0].startswith("ALTER TABLE `t` MODIFY SETTING non_replicated_deduplication_window = ")
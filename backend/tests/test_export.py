@@ -0,0 +1,19 @@
+from decimal import Decimal
+import pyarrow as pa
+from app.core.export import arrow_type, to_record_batch
+
+
+def test_arrow_type():
+    assert arrow_type("Nullable(UInt16)") == pa.uint16()
+    assert arrow_type("DateTime64(6, 'UTC')") == pa.timestamp("us")
+    assert arrow_type("Decimal(18, 2)") == pa.decimal128(18, 2)
+    assert arrow_type("Decimal(76, 10)") == pa.decimal256(76, 10)
+    assert arrow_type("UUID") == pa.string()
+
+
+def test_record_batch_is_built_from_columns():
+    schema = pa.schema([("id", arrow_type("UInt8")), ("amount", arrow_type("Decimal(50, 2)")), ("ip", arrow_type("IPv4"))])
+    batch = to_record_batch([(1, 2), (Decimal("1.50"), None), ("10.0.0.1", None)], schema)
+    assert batch.num_rows == 2
+    assert batch.column(1).to_pylist() == [Decimal("1.50"), None]
+    assert batch.column(2).to_pylist() == ["10.0.0.1", None]
@@ -0,0 +1,54 @@
+import re
+import numpy as np
+import pandas as pd
+from app.core.batching import InsertScheduler
+from app.core.ingest import ingest_chunks
+
+
+class TableClient:
+    """
+    Keeps one table's column types and records inserts, like a ClickHouse
+    server that already holds the table
+    """
+
+    def __init__(self, column_types):
+        self.column_types = dict(column_types)
+        self.inserts = []
+
+    def execute(self, query, params=None, columnar=False, settings=None, **kwargs):
+        sql = " ".join(query.split())
+        if sql.startswith("DESCRIBE"):
+            return [(name, col_type, "", "", "", "", "") for name, col_type in self.column_types.items()]
+        if sql.startswith("ALTER"):
+            for name, col_type in re.findall(r"MODIFY COLUMN `(\w+)` ([^,]+(?:\)|\w))", sql):
+                self.column_types[name] = col_type
+        if sql.startswith("INSERT"):
+            self.inserts.append((dict(self.column_types), params, settings or {}))
+        return []
+
+
+def test_existing_table_types_are_widened_not_wrapped():
+    # Left by an earlier, exhaustively inferred upload
+    client = TableClient({"id": "UInt8", "name": "String"})
+    chunk = pd.DataFrame({"id": np.arange(250, 260), "name": ["a"] * 9 + [None]})
+
+    rows = ingest_chunks(client, [chunk], "t", batch_size=100, scheduler=InsertScheduler(async_insert=False))
+
+    assert rows == 10
+    assert client.column_types == {"id": "UInt16", "name": "Nullable(String)"}
+    (table_types, data, settings), = client.inserts
+    assert table_types == client.column_types
+    assert list(data[0]) == list(range(250, 260))
+    assert list(data[1]) == ["a"] * 9 + [None]
+
+
+def test_existing_table_types_are_used_when_values_fit():
+    client = TableClient({"id": "UInt16", "name": "String"})
+    chunk = pd.DataFrame({"id": [1, 2, 3], "name": ["a", "b", "c"]})
+
+    ingest_chunks(client, [chunk], "t", batch_size=100, scheduler=InsertScheduler(async_insert=False))
+
+    (table_types, data, settings), = client.inserts
+    assert table_types == {"id": "UInt16", "name": "String"}
+    assert data[0].dtype == np.uint16
+    assert settings["use_numpy"]
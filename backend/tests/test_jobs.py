@@ -0,0 +1,98 @@
+import contextlib
+import os
+import pandas as pd
+from app.core.jobs import JobManager
+
+
+class InsertClient:
+    def __init__(self):
+        self.queries = []
+        self.tokens = []
+
+    def execute(self, query, params=None, settings=None, **kwargs):
+        sql = " ".join(query.split())
+        self.queries.append(sql)
+        if sql.startswith("DESCRIBE"):
+            return [("id", "UInt16", "", "", "", "", ""), ("name", "String", "", "", "", "", "")]
+        if sql.startswith("INSERT"):
+            self.tokens.append((settings or {}).get("insert_deduplication_token"))
+        return []
+
+
+class Pool:
+    def __init__(self, client=None):
+        self.client = client or InsertClient()
+
+    @contextlib.contextmanager
+    def connection(self):
+        yield self.client
+
+
+def spool(manager: JobManager, rows: int) -> str:
+    path = manager.path_for("upload", ".csv")
+    pd.DataFrame({"id": range(rows), "name": ["a"] * rows}).to_csv(path, index=False)
+    return path
+
+
+def ingest_params(path: str) -> dict:
+    return {"path": path, "filename": "t.csv", "table_name": "t", "batch_size": 10, "async_insert": False}
+
+
+def test_ingest_blocks_carry_job_dedup_tokens(tmp_path):
+    manager = JobManager(Pool(), str(tmp_path), workers=1)
+    job = manager.submit("ingest", ingest_params(spool(manager, 25)))
+    manager._run(manager.store.get(job["id"]))
+
+    client = manager.pool.client
+    assert manager.store.get(job["id"])["status"] == "completed"
+    assert any("non_replicated_deduplication_window" in query for query in client.queries)
+    assert [token.split(":")[:2] for token in client.tokens] == [
+        [f"job-{job['id']}", "0"], [f"job-{job['id']}", "10"], [f"job-{job['id']}", "20"]
+    ]
+
+
+def test_resumed_ingest_resends_the_same_tokens(tmp_path):
+    manager = JobManager(Pool(), str(tmp_path), workers=1)
+    path = spool(manager, 25)
+    job = manager.submit("ingest", ingest_params(path))
+    manager._run(manager.store.get(job["id"]))
+    first_run = manager.pool.client.tokens
+
+    # The process died after inserting the second block but before checkpointing it
+    pd.DataFrame({"id": range(25), "name": ["a"] * 25}).to_csv(path, index=False)
+    manager.pool.client = InsertClient()
+    manager.store.update(job["id"], status="queued", checkpoint={
+        "rows": 10, "batch_size": 10, "column_types": {"id": "UInt16", "name": "String"}
+    })
+    manager._run(manager.store.get(job["id"]))
+    assert manager.pool.client.tokens == first_run[1:]
+
+
+def test_cancelled_queued_job_is_never_claimed(tmp_path):
+    manager = JobManager(Pool(), str(tmp_path), workers=1)
+    path = spool(manager, 5)
+    job = manager.submit("ingest", ingest_params(path))
+
+    assert manager.cancel(job["id"])["status"] == "cancelled"
+    assert not os.path.exists(path)
+
+    # A worker that dequeued the job before the cancel must skip it
+    manager._queue.put(None)
+    manager._work()
+    assert manager.store.get(job["id"])["status"] == "cancelled"
+    assert manager.pool.client.queries == []
+
+
+def test_cancelling_a_running_job_leaves_its_spool_to_the_worker(tmp_path):
+    manager = JobManager(Pool(), str(tmp_path), workers=1)
+    path = spool(manager, 25)
+    job = manager.submit("ingest", ingest_params(path))
+    manager.store.update(job["id"], status="running")
+
+    assert manager.cancel(job["id"])["status"] == "running"
+    assert os.path.exists(path)
+
+    manager._run(manager.store.get(job["id"]))
+    assert manager.store.get(job["id"])["status"] == "cancelled"
+    assert not os.path.exists(path)
+    assert len(manager.pool.client.tokens) == 1
@@ -0,0 +1,43 @@
+import pytest
+from app.core.parallel import reconcile_block, shard_expression
+
+
+class RecordingClient:
+    def __init__(self):
+        self.queries = []
+
+    def execute(self, query, *args, **kwargs):
+        self.queries.append(" ".join(query.split()))
+        return []
+
+
+def test_wider_block_widens_the_table():
+    client = RecordingClient()
+    table_types = {"id": "Nullable(Int64)", "code": "Nullable(Int64)"}
+    data = reconcile_block(
+        client, "t", table_types,
+        {"id": "Nullable(Int64)", "code": "Nullable(String)"},
+        [[1], ["abc"]]
+    )
+    assert data == [[1], ["abc"]]
+    assert table_types["code"] == "Nullable(String)"
+    assert client.queries == ["ALTER TABLE `t` MODIFY COLUMN `code` Nullable(String)"]
+
+
+def test_narrower_block_is_converted_to_the_table_types():
+    client = RecordingClient()
+    table_types = {"id": "Nullable(Float64)", "code": "Nullable(String)"}
+    data = reconcile_block(
+        client, "t", table_types,
+        {"id": "Nullable(Int64)", "code": "Nullable(Int64)"},
+        [[1, None], [7, None]]
+    )
+    assert [column.tolist() for column in data] == [[1.0, None], ["7", None]]
+    assert client.queries == []
+
+
+def test_shard_expression_hashes_the_row_by_default():
+    assert shard_expression(None) == "cityHash64(*)"
+    assert shard_expression(" t1.id ") == "cityHash64(`t1.id`)"
+    with pytest.raises(ValueError):
+        shard_expression("id) OR (1")
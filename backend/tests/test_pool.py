@@ -0,0 +1,32 @@
+import threading
+import app.core.clickhouse as clickhouse
+from app.core.clickhouse import ClickHousePool
+
+
+class IdleClient:
+    def execute(self, query, *args, **kwargs):
+        return [(1,)]
+
+    def disconnect(self):
+        pass
+
+
+def test_counters_survive_concurrent_checkouts(monkeypatch):
+    monkeypatch.setattr(clickhouse, "create_client", lambda conn=None: IdleClient())
+    pool = ClickHousePool(max_size=8, stale_after=0.0)
+
+    def work():
+        for _ in range(200):
+            with pool.connection():
+                pass
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    stats = pool.stats()
+    assert stats["created"] + stats["reused"] == 1600
+    assert stats["health_checks"] == stats["reused"]
+    assert stats["profiles"][0]["in_use"] == 0
@@ -0,0 +1,92 @@
+import pytest
+from app.routers.clickhouse import Filter, MultiTableQuery, OrderBy, build_query, build_where, render_query
+
+
+def make_query(**fields) -> MultiTableQuery:
+    return MultiTableQuery(tables=["events"], columns=["id", "name"], **fields)
+
+
+def test_no_filters():
+    assert build_where(make_query()) == ("", {})
+    assert build_query(make_query()) == ("SELECT id, name FROM events", None)
+
+
+def test_values_are_parameters():
+    where, params = build_where(make_query(filters=[
+        Filter(column="name", value="x' OR 1=1 --"),
+        Filter(column="id", operator=">=", value=10),
+        Filter(column="active", value=True),
+    ]))
+    assert where == " WHERE name = %(p0)s AND id >= %(p1)s AND active = %(p2)s"
+    assert params == {"p0": "x' OR 1=1 --", "p1": 10, "p2": 1}
+
+
+def test_list_and_null_operators():
+    where, params = build_where(make_query(filters=[
+        Filter(column="id", operator="in", value=[1, 2]),
+        Filter(column="id", operator="BETWEEN", value=[5, 9]),
+        Filter(column="name", operator="IS NOT NULL"),
+    ]))
+    assert where == " WHERE id IN (%(p0)s, %(p1)s) AND id BETWEEN %(p2)s AND %(p3)s AND name IS NOT NULL"
+    assert params == {"p0": 1, "p1": 2, "p2": 5, "p3": 9}
+
+
+@pytest.mark.parametrize("operator", ["; DROP TABLE events", "REGEXP", "OR"])
+def test_unknown_operators_are_rejected(operator):
+    with pytest.raises(ValueError, match="operator"):
+        build_where(make_query(filters=[Filter(column="id", operator=operator, value=1)]))
+
+
+@pytest.mark.parametrize("column", ["id; DROP TABLE events", "id)", "1id", "name = name"])
+def test_invalid_columns_are_rejected(column):
+    with pytest.raises(ValueError, match="column"):
+        build_where(make_query(filters=[Filter(column=column, value=1)]))
+
+
+@pytest.mark.parametrize("value", [[1], [1, 2, 3], 1, None])
+def test_between_needs_two_values(value):
+    with pytest.raises(ValueError, match="BETWEEN"):
+        build_where(make_query(filters=[Filter(column="id", operator="BETWEEN", value=value)]))
+
+
+@pytest.mark.parametrize("operator", ["IN", "NOT IN"])
+@pytest.mark.parametrize("value", [[], 1, None])
+def test_in_needs_a_non_empty_list(operator, value):
+    with pytest.raises(ValueError, match=operator):
+        build_where(make_query(filters=[Filter(column="id", operator=operator, value=value)]))
+
+
+def test_comparison_needs_a_single_value():
+    with pytest.raises(ValueError, match="single value"):
+        build_where(make_query(filters=[Filter(column="id", operator="<", value=[1, 2])]))
+
+
+def test_build_query_pushes_down_everything():
+    sql, params = build_query(make_query(
+        filters=[Filter(column="id", operator=">", value=3)],
+        order_by=[OrderBy(column="id", direction="desc"), OrderBy(column="name", direction="sideways")],
+        limit=50,
+        offset=10,
+        sample=0.1,
+    ))
+    assert sql == (
+        "SELECT id, name FROM events SAMPLE 0.1 WHERE id > %(p0)s "
+        "ORDER BY id DESC, name ASC LIMIT 50 OFFSET 10"
+    )
+    assert params == {"p0": 3}
+
+
+def test_max_rows_caps_the_limit():
+    assert build_query(make_query(limit=500), max_rows=100)[0].endswith(" LIMIT 100")
+    assert build_query(make_query(limit=5), max_rows=100)[0].endswith(" LIMIT 5")
+    assert build_query(make_query(), max_rows=100)[0].endswith(" LIMIT 100")
+
+
+def test_invalid_order_by_column_is_rejected():
+    with pytest.raises(ValueError):
+        build_query(make_query(order_by=[OrderBy(column="id; DROP TABLE events")]))
+
+
+def test_render_query_escapes_values():
+    sql, params = build_query(make_query(filters=[Filter(column="name", value="it's")]))
+    assert render_query(sql, params) == "SELECT id, name FROM events WHERE name = 'it\\'s'"
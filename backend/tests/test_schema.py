@@ -0,0 +1,152 @@
+import datetime
+import pandas as pd
+import pytest
+import numpy as np
+from app.core.schema import (
+    common_type, infer_schema, infer_type, to_array, to_column, widen_schema, widen_type
+)
+
+
+def test_integers_are_narrowed_to_the_sample_range():
+    assert infer_type(pd.Series(range(100))) == "UInt8"
+    assert infer_type(pd.Series(["1", "2", "3"])) == "UInt8"
+    assert infer_type(pd.Series([-1, 70000])) == "Int32"
+    assert infer_type(pd.Series([2**63])) == "UInt64"
+
+
+def test_nullable_only_when_the_sample_holds_nulls():
+    assert infer_type(pd.Series([1, None])) == "Nullable(UInt8)"
+    assert infer_type(pd.Series(["a", "b", "c"])) == "String"
+    assert infer_type(pd.Series(["a", None, "c"])) == "Nullable(String)"
+
+
+def test_dates_are_narrowed():
+    assert infer_type(pd.Series(["2024-01-01", "2024-01-02"])) == "Date"
+    assert infer_type(pd.Series(["1900-01-01"])) == "Date32"
+    assert infer_type(pd.Series(["2024-01-01 10:00:00"])) == "DateTime"
+    assert infer_type(pd.Series(["2024-01-01 10:00:00.250"])) == "DateTime64(3)"
+    assert infer_type(pd.Series(["2024-01-01 10:00:00.000250"])) == "DateTime64(6)"
+
+
+def test_other_types():
+    assert infer_type(pd.Series([1.5, 2.0])) == "Float64"
+    assert infer_type(pd.Series(["true", "False"])) == "Bool"
+    assert infer_type(pd.Series([None, None])) == "Nullable(String)"
+    assert infer_type(pd.Series(["a"] * 10)) == "LowCardinality(String)"
+
+
+def test_infer_schema_uses_only_the_sample():
+    df = pd.DataFrame({"id": range(1000)})
+    assert infer_schema(df) == {"id": "UInt16"}
+    assert infer_schema(df, sample_size=10) == {"id": "UInt8"}
+
+
+def test_infer_schema_renames_and_overrides():
+    df = pd.DataFrame({"a b": [1, 2], "c": ["x", "y"]})
+    column_types = infer_schema(df, renames={"c": "name"}, types={"name": "String"})
+    assert column_types == {"a_b": "UInt8", "name": "String"}
+    with pytest.raises(ValueError):
+        infer_schema(df, types={"c": "String); DROP TABLE x; --"})
+    with pytest.raises(ValueError):
+        infer_schema(df, renames={"c": "a b"})
+
+
+def test_to_column_converts_values():
+    assert to_column(pd.Series(["1", "2", None]), "Nullable(Int64)") == [1, 2, None]
+    assert to_column(pd.Series([1.0, 2.0]), "UInt8") == [1, 2]
+    assert to_column(pd.Series(["1.5", None]), "Nullable(Float64)") == [1.5, None]
+    assert to_column(pd.Series(["true", "FALSE"]), "Bool") == [True, False]
+    assert to_column(pd.Series(["2024-01-02"]), "Date32") == [datetime.date(2024, 1, 2)]
+    assert to_column(pd.Series([3, None]), "Nullable(String)") == ["3.0", None]
+
+
+def test_to_column_rejects_out_of_range_integers():
+    with pytest.raises(ValueError, match="70000"):
+        to_column(pd.Series([1, 70000]), "UInt8")
+
+
+def test_to_column_never_coerces_to_defaults():
+    with pytest.raises(ValueError, match="N/A"):
+        to_column(pd.Series(["1", "N/A"]), "Nullable(Int64)")
+    with pytest.raises(ValueError, match="N/A"):
+        to_column(pd.Series(["1.5", "N/A"]), "Float64")
+    with pytest.raises(ValueError, match="maybe"):
+        to_column(pd.Series(["true", "maybe"]), "Bool")
+    with pytest.raises(ValueError, match="soon"):
+        to_column(pd.Series(["2024-01-01", "soon"]), "Date32")
+
+
+def test_to_column_rejects_nulls_in_non_nullable_columns():
+    with pytest.raises(ValueError, match="Nullable"):
+        to_column(pd.Series([1, None]), "Int64")
+    with pytest.raises(ValueError, match="Nullable"):
+        to_column(pd.Series(["a", None]), "String")
+
+
+def test_to_column_rejects_fractions_in_integer_columns():
+    with pytest.raises(ValueError, match="2.5"):
+        to_column(pd.Series([1.0, 2.5]), "Nullable(Int64)")
+
+
+def test_to_column_rejects_truncated_dates():
+    with pytest.raises(ValueError):
+        to_column(pd.Series(["2024-01-01 10:30:00"]), "Date32")
+    with pytest.raises(ValueError):
+        to_column(pd.Series(["2024-01-01 10:30:00.5"]), "DateTime")
+
+
+def test_to_array_keeps_numeric_dtypes():
+    assert to_array(pd.Series([1, 2]), "UInt8").dtype == np.uint8
+    assert to_array(pd.Series([1.0, 2.0]), "Int64").dtype == np.int64
+    assert to_array(pd.Series(["true", "false"]), "Bool").tolist() == [True, False]
+    assert to_array(pd.Series([1, None]), "Nullable(Int64)").tolist() == [1, None]
+    assert to_array(pd.Series(["a", None]), "Nullable(String)").tolist() == ["a", None]
+    with pytest.raises(ValueError, match="2.5"):
+        to_array(pd.Series([1.0, 2.5]), "Int64")
+
+
+def test_to_array_sends_dates_as_datetime64():
+    dates = to_array(pd.Series(["2024-01-02", None]), "Nullable(Date)")
+    assert dates.dtype == np.dtype("datetime64[D]")
+    assert dates[0] == np.datetime64("2024-01-02") and np.isnat(dates[1])
+    assert to_array(pd.Series(["2024-01-02 10:30:00"]), "DateTime").dtype == np.dtype("datetime64[s]")
+    assert to_array(pd.Series(["2024-01-02 10:30:00.5"]), "DateTime64(3)").dtype == np.dtype("datetime64[ms]")
+    # Types without a NumPy column in the driver are sent as object arrays
+    assert to_array(pd.Series(["1900-01-01"]), "Date32").tolist() == [datetime.date(1900, 1, 1)]
+    with pytest.raises(ValueError, match="2200"):
+        to_array(pd.Series(["2200-01-01"]), "Date")
+
+
+def test_widen_type():
+    assert widen_type(pd.Series([1, 2]), "UInt8") is None
+    assert widen_type(pd.Series([1, 300]), "UInt8") == "UInt16"
+    assert widen_type(pd.Series([-1, 2]), "UInt8") == "Int16"
+    assert widen_type(pd.Series([1, 70000]), "Nullable(UInt8)") == "Nullable(UInt32)"
+    assert widen_type(pd.Series([1, -1]), "UInt64") == "Float64"
+    assert widen_type(pd.Series([1, None]), "UInt8") == "Nullable(UInt8)"
+    assert widen_type(pd.Series([1.0, 2.5]), "Int64") == "Float64"
+    assert widen_type(pd.Series(["1", "N/A"]), "Int64") == "String"
+    assert widen_type(pd.Series(["1", "N/A", None]), "Int64") == "Nullable(String)"
+    assert widen_type(pd.Series(["1900-01-01"]), "Date") == "Date32"
+    assert widen_type(pd.Series(["2024-01-01 10:30:00"]), "Date") == "DateTime64(3)"
+    assert widen_type(pd.Series(["1900-01-01 10:30:00"]), "Date32") == "DateTime64(3)"
+    assert widen_type(pd.Series(["1960-01-01"]), "DateTime") == "DateTime64(3)"
+    assert widen_type(pd.Series(["2024-01-01 10:30:00.000250"]), "DateTime64(3)") == "DateTime64(6)"
+    assert widen_type(pd.Series(["maybe"]), "Bool") == "String"
+    assert widen_type(pd.Series(["a", None]), "LowCardinality(String)") == "LowCardinality(Nullable(String))"
+
+
+def test_widen_schema_reports_only_changed_columns():
+    df = pd.DataFrame({"id": [1, 70000], "code": ["1", "N/A"], "name": ["a", "b"]})
+    changes = widen_schema(df, {"id": "UInt8", "code": "Nullable(Int64)", "name": "String"})
+    assert changes == {"id": "UInt32", "code": "Nullable(String)"}
+
+
+def test_common_type():
+    assert common_type("UInt8", "Nullable(Int64)") == "Nullable(Int64)"
+    assert common_type("UInt8", "Int8") == "Int16"
+    assert common_type("UInt64", "Int8") == "Float64"
+    assert common_type("Int64", "Float64") == "Float64"
+    assert common_type("Nullable(Date32)", "DateTime64(6)") == "Nullable(DateTime64(6))"
+    assert common_type("Nullable(Int64)", "Nullable(String)") == "Nullable(String)"
+    assert common_type("LowCardinality(String)", "Nullable(String)") == "LowCardinality(Nullable(String))"
@@ -0,0 +1,13 @@
+from app.core.sync import watermark_expression
+
+
+def test_strictly_increasing_columns_use_the_maximum():
+    assert watermark_expression("id", "UInt64") == "maxOrNull(`id`)"
+    assert watermark_expression("key", "LowCardinality(String)") == "maxOrNull(`key`)"
+
+
+def test_time_columns_settle_before_the_watermark_passes_them():
+    expression = watermark_expression("ts", "Nullable(DateTime64(3))")
+    assert expression.startswith("least(maxOrNull(`ts`), CAST(now64(6) - toIntervalSecond(")
+    assert expression.endswith(" AS DateTime64(3)))")
+    assert "toDate(" in watermark_expression("day", "Date") and "- 1 AS Date" in watermark_expression("day", "Date")
@@ -14,13 +14,14 @@ import {
 } from '@mui/material';
 import { UploadFile } from '@mui/icons-material';
 import axios from 'axios';
+import { useAuth } from '../contexts/AuthContext';
 
 interface FileData {
   columns: string[];
-  rowCount: number;
 }
 
 const FlatFilePage: React.FC = () => {
+  const { token } = useAuth();
   const [file, setFile] = useState<File | null>(null);
   const [fileData, setFileData] = useState<FileData | null>(null);
   const [selectedColumns, setSelectedColumns] = useState<string[]>([]);
@@ -45,9 +46,10 @@ const FlatFilePage: React.FC = () => {
       const formData = new FormData();
       formData.append('file', file);
 
-      const response = await axios.post('http://localhost:8000/api/flatfile/upload', formData, {
+      const response = await axios.post('http://localhost:8000/api/flatfile/columns', formData, {
         headers: {
           'Content-Type': 'multipart/form-data',
+          'Authorization': `Bearer ${token}`,
         },
       });
 
@@ -85,6 +87,7 @@ const FlatFilePage: React.FC = () => {
       const response = await axios.post('http://localhost:8000/api/flatfile/ingest', formData, {
         headers: {
           'Content-Type': 'multipart/form-data',
+          'Authorization': `Bearer ${token}`,
         },
       });
 
@@ -136,7 +139,7 @@ const FlatFilePage: React.FC = () => {
             File Information
           </Typography>
           <Typography variant="body1" gutterBottom>
-            Total Rows: {fileData.rowCount}
+            Columns: {fileData.columns.length}
           </Typography>
 
           <Box sx={{ display: 'flex', gap: 2, mb: 3 }}>